@@ -1,185 +1,884 @@
+import base64
+import bisect
+import csv
+import hashlib
+import hmac
+import io
 import json
 import os
+import time
 import psycopg2
+from psycopg2 import pool
+from datetime import datetime
 
-def handler(event: dict, context) -> dict:
-    """API для админ-панели: управление пользователями, модерация"""
-    method = event.get('httpMethod', 'GET')
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', '30'))
+
+_pool = None
+_last_used = {}
+
+
+def get_connection():
+    """Выдаёт соединение из пула контейнера, переживающего тёплые вызовы.
+
+    Соединение, простаивавшее дольше DB_POOL_CHECK_AFTER секунд, проверяется
+    запросом SELECT 1; закрытые и отвалившиеся соединения выбрасываются
+    из пула и заменяются новыми.
+    """
+    global _pool
+    if _pool is None:
+        _pool = pool.ThreadedConnectionPool(DB_POOL_SIZE, DB_POOL_MAX_SIZE, os.environ['DATABASE_URL'])
     
-    if method == 'OPTIONS':
-        return {
+    for _ in range(DB_POOL_MAX_SIZE + 1):
+        conn = _pool.getconn()
+        last_used = _last_used.pop(id(conn), None)
+        
+        if not conn.closed and last_used is not None and time.monotonic() - last_used > DB_POOL_CHECK_AFTER:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+            except psycopg2.Error:
+                conn.close()
+        
+        if conn.closed:
+            _pool.putconn(conn, close=True)
+            continue
+        
+        if not conn.autocommit:
+            conn.set_session(autocommit=True)
+        return conn
+    
+    raise psycopg2.OperationalError('Не удалось получить рабочее соединение с базой данных')
+
+
+def release_connection(conn) -> None:
+    """Возвращает соединение в пул; пул сам откатывает незавершённые транзакции"""
+    _pool.putconn(conn)
+    if not conn.closed:
+        _last_used[id(conn)] = time.monotonic()
+
+
+# Действия модерации: (колонка, новое значение, отзывать сессии, сообщение для одного user_id)
+MODERATION_ACTIONS = {
+    'ban': ('is_banned', True, True, 'Пользователь заблокирован'),
+    'unban': ('is_banned', False, False, 'Пользователь разблокирован'),
+    'grant_admin': ('is_admin', True, False, 'Права администратора выданы'),
+    'revoke_admin': ('is_admin', False, True, 'Права администратора отозваны'),
+}
+MODERATION_MAX_IDS = 1000
+
+USERS_PAGE_SIZE = 50
+USERS_MAX_PAGE_SIZE = 500
+# Строк в одной части выгрузки: около мегабайта, с запасом до предела ответа функции
+USERS_EXPORT_MAX_ROWS = int(os.environ.get('USERS_EXPORT_MAX_ROWS', '5000'))
+USERS_EXPORT_COLUMNS = ('id', 'full_name', 'username', 'phone', 'is_admin', 'is_banned', 'avatar_url', 'created_at')
+# Короче трёх символов в шаблоне нет триграмм, и ILIKE '%q%' читал бы всю таблицу
+USERS_MIN_QUERY_LENGTH = 3
+
+RECONCILE_BATCH_SIZE = 5000
+RECONCILE_MAX_BATCH_SIZE = 50000
+
+STATS_COUNTERS = ('users_count', 'posts_count', 'banned_count', 'messages_count')
+STATS_SERIES = ('new_users', 'posts', 'messages', 'active_users')
+STATS_SERIES_DAYS = 30
+STATS_MAX_SERIES_DAYS = 90
+STATS_ACTIVITY_RETENTION_DAYS = 90
+
+
+SESSION_TTL = int(os.environ.get('SESSION_TTL', '900'))
+SESSION_REVOCATION_REFRESH = float(os.environ.get('SESSION_REVOCATION_REFRESH', '30'))
+REQUIRE_SESSION_TOKEN = os.environ.get('REQUIRE_SESSION_TOKEN', 'false').lower() == 'true'
+
+_revoked_sessions = {}
+_revocations_loaded_at = None
+
+
+class InvalidSession(Exception):
+    """Токен сессии подделан, просрочен, отозван или отсутствует там, где обязателен"""
+
+
+def b64url_decode(value: str) -> bytes:
+    """Декодирует base64url, дополняя срезанные '='"""
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+
+def sign_session(payload: str) -> bytes:
+    """HMAC-SHA256 подпись полезной нагрузки токена ключом SESSION_SECRET"""
+    return hmac.new(os.environ['SESSION_SECRET'].encode('utf-8'), payload.encode('ascii'), hashlib.sha256).digest()
+
+
+def load_revocations(cur) -> None:
+    """Обновляет кеш отзывов сессий не чаще раза в SESSION_REVOCATION_REFRESH секунд.
+
+    Хранятся только отзывы моложе SESSION_TTL: более старые токены
+    к этому моменту уже истекли сами.
+    """
+    global _revoked_sessions, _revocations_loaded_at
+    now = time.monotonic()
+    if _revocations_loaded_at is not None and now - _revocations_loaded_at < SESSION_REVOCATION_REFRESH:
+        return
+    cur.execute(
+        "SELECT user_id, EXTRACT(EPOCH FROM revoked_at) FROM session_revocations WHERE revoked_at > CURRENT_TIMESTAMP - make_interval(secs => %s)",
+        (SESSION_TTL,)
+    )
+    _revoked_sessions = {row[0]: float(row[1]) for row in cur.fetchall()}
+    _revocations_loaded_at = now
+
+
+def read_session(event: dict, cur):
+    """Проверяет токен из X-Auth-Token или Authorization: Bearer без запроса к users.
+
+    Возвращает claims токена ({'uid', 'adm', 'ban', 'iat', 'exp'}) или None,
+    если токен не передан; InvalidSession — если токен недействителен.
+    """
+    headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+    token = headers.get('x-auth-token')
+    if not token and headers.get('authorization', '').startswith('Bearer '):
+        token = headers['authorization'][len('Bearer '):]
+    if not token:
+        return None
+    
+    try:
+        payload, signature = token.split('.')
+        if not hmac.compare_digest(sign_session(payload), b64url_decode(signature)):
+            raise InvalidSession()
+        claims = json.loads(b64url_decode(payload))
+    except (ValueError, UnicodeError) as e:
+        raise InvalidSession() from e
+    
+    if claims.get('exp', 0) < time.time() or claims.get('ban'):
+        raise InvalidSession()
+    
+    load_revocations(cur)
+    revoked_at = _revoked_sessions.get(claims['uid'])
+    if revoked_at is not None and claims['iat'] <= revoked_at:
+        raise InvalidSession()
+    return claims
+
+
+def session_user_id(session, fallback):
+    """id пользователя из токена; без токена — id из запроса, пока REQUIRE_SESSION_TOKEN выключен"""
+    if session:
+        return session['uid']
+    if REQUIRE_SESSION_TOKEN:
+        raise InvalidSession()
+    return fallback
+
+
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+
+class ApiError(Exception):
+    """Ошибка запроса: отдаётся клиенту со статусом status и телом {'error': message}"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def dump_json(data) -> str:
+    """Сериализует тело ответа: orjson, если он установлен, иначе стандартный json"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return json.dumps(data)
+
+
+def respond(data, status: int = 200) -> dict:
+    """JSON-ответ функции с общими заголовками"""
+    return {'statusCode': status, 'headers': JSON_HEADERS, 'body': dump_json(data), 'isBase64Encoded': False}
+
+
+def parse_body(event: dict) -> dict:
+    """Разбирает JSON-тело запроса; ApiError 400, если это не JSON-объект"""
+    raw = event.get('body') or '{}'
+    try:
+        body = orjson.loads(raw) if orjson is not None else json.loads(raw)
+    except ValueError as e:
+        raise ApiError(400, 'Некорректный JSON в теле запроса') from e
+    if not isinstance(body, dict):
+        raise ApiError(400, 'Тело запроса должно быть JSON-объектом')
+    return body
+
+
+REQUEST_METRICS = os.environ.get('REQUEST_METRICS', 'false').lower() == 'true'
+REQUEST_METRICS_HISTOGRAM = os.environ.get('REQUEST_METRICS_HISTOGRAM', 'false').lower() == 'true'
+REQUEST_METRICS_FLUSH_EVERY = int(os.environ.get('REQUEST_METRICS_FLUSH_EVERY', '100'))
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_latency_histogram = {}
+_histogram_requests = 0
+
+
+class MetricsCursor(psycopg2.extensions.cursor):
+    """Курсор, который считает запросы, время в БД и строки результата.
+
+    Выдаётся роутером только при REQUEST_METRICS=true; без него обработчики
+    получают обычный курсор и не платят за учёт.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queries = 0
+        self.db_time = 0.0
+        self.rows = 0
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            if self.description is not None and self.rowcount > 0:
+                self.rows += self.rowcount
+
+
+def observe_latency(action: str, wall_ms: float) -> None:
+    """Кладёт время запроса в гистограмму контейнера и раз в
+    REQUEST_METRICS_FLUSH_EVERY запросов пишет её в лог и обнуляет"""
+    global _histogram_requests
+    buckets = _latency_histogram.get(action)
+    if buckets is None:
+        buckets = _latency_histogram[action] = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+    buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, wall_ms)] += 1
+    _histogram_requests += 1
+    
+    if _histogram_requests >= REQUEST_METRICS_FLUSH_EVERY:
+        print(dump_json({
+            'metric': 'latency_histogram',
+            'buckets_ms': LATENCY_BUCKETS_MS,
+            'actions': _latency_histogram
+        }))
+        _latency_histogram.clear()
+        _histogram_requests = 0
+
+
+def record_request(action: str, cur, response, elapsed: float) -> None:
+    """Пишет структурированную строку метрик запроса в лог функции"""
+    body = (response.get('body') or '') if response else ''
+    wall_ms = elapsed * 1000
+    print(dump_json({
+        'metric': 'request',
+        'action': action,
+        'status': response['statusCode'] if response else 500,
+        'wall_ms': round(wall_ms, 2),
+        'db_ms': round(cur.db_time * 1000, 2),
+        'queries': cur.queries,
+        'rows': cur.rows,
+        'response_bytes': len(body.encode('utf-8'))
+    }))
+    if REQUEST_METRICS_HISTOGRAM:
+        observe_latency(action, wall_ms)
+
+
+class Router:
+    """Диспетчер функции: (метод, action) запроса → обработчик действия.
+
+    routes — {метод: {action: обработчик}}, ключ '*' принимает остальные
+    action метода; default_actions — action для запросов без него.
+    Обработчик получает (cur, session, args), где args — параметры строки
+    запроса для GET и JSON-тело для остальных методов. Preflight и ответ 405
+    собираются один раз при создании роутера.
+    """
+
+    def __init__(self, routes: dict, default_actions: dict):
+        self.routes = routes
+        self.default_actions = default_actions
+        self.preflight = {
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Methods': ', '.join([*routes, 'OPTIONS']),
+                'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Auth-Token, X-User-Id',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
             'isBase64Encoded': False
         }
+        self.not_allowed = respond({'error': 'Метод не поддерживается'}, 405)
+
+    def resolve(self, method: str, args: dict):
+        """Находит (action, обработчик) для метода и action; None, если такого нет.
+
+        Запрос, попавший в '*', получает action по умолчанию для метода, чтобы
+        метрики не размножались по произвольным значениям из запроса.
+        """
+        actions = self.routes.get(method)
+        if actions is None:
+            return None
+        action = args.get('action') or self.default_actions.get(method)
+        if isinstance(action, str) and action in actions:
+            return action, actions[action]
+        if '*' in actions:
+            return self.default_actions.get(method, '*'), actions['*']
+        return None
+
+    def __call__(self, event: dict) -> dict:
+        # Время запроса включает разбор тела и получение соединения из пула
+        started = time.perf_counter()
+        method = event.get('httpMethod', 'GET')
+        if method == 'OPTIONS':
+            return self.preflight
+        if method not in self.routes:
+            return self.not_allowed
+        
+        try:
+            args = (event.get('queryStringParameters') or {}) if method == 'GET' else parse_body(event)
+        except ApiError as e:
+            return respond({'error': e.message}, e.status)
+        
+        resolved = self.resolve(method, args)
+        if resolved is None:
+            return self.not_allowed
+        action, route = resolved
+        
+        conn = get_connection()
+        cur = conn.cursor(cursor_factory=MetricsCursor) if REQUEST_METRICS else conn.cursor()
+        response = None
+        
+        try:
+            session = read_session(event, cur)
+            response = route(cur, session, args)
+        
+        except ApiError as e:
+            response = respond({'error': e.message}, e.status)
+        
+        except InvalidSession:
+            response = respond({'error': 'Сессия недействительна, войдите заново'}, 401)
+        
+        except psycopg2.DataError:
+            # Значение из запроса не приводится к типу колонки, например id='abc'
+            response = respond({'error': 'Некорректные параметры запроса'}, 400)
+        
+        finally:
+            cur.close()
+            release_connection(conn)
+            if REQUEST_METRICS:
+                record_request(action, cur, response, time.perf_counter() - started)
+        
+        return response
+
+
+def encode_cursor(created_at, user_id: int) -> str:
+    """Упаковывает позицию (created_at, id) последнего пользователя в непрозрачный курсор"""
+    raw = f"{created_at.isoformat()}|{user_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Распаковывает курсор списка; ValueError, если курсор повреждён"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        created_at, user_id = raw.split('|')
+        return datetime.fromisoformat(created_at), int(user_id)
+    except (UnicodeError, ValueError) as e:
+        raise ValueError('Некорректный курсор') from e
+
+
+def parse_limit(value, default: int, maximum: int) -> int:
+    """Приводит параметр limit к числу в пределах [1, maximum]"""
+    try:
+        limit = int(value) if value is not None else default
+    except (TypeError, ValueError):
+        limit = default
+    return max(1, min(limit, maximum))
+
+
+def require_admin(cur, session, body: dict) -> None:
+    """ApiError 403, если запрос пришёл не от администратора.
+
+    С токеном решает его claim adm; без токена, пока REQUIRE_SESSION_TOKEN
+    выключен, флаг is_admin читается по admin_id из тела запроса.
+    """
+    if session:
+        is_admin = session['adm']
+    else:
+        admin_id = session_user_id(session, body.get('admin_id'))
+        cur.execute("SELECT is_admin FROM users WHERE id = %s", (admin_id,))
+        admin = cur.fetchone()
+        is_admin = bool(admin and admin[0])
+    
+    if not is_admin:
+        raise ApiError(403, 'Доступ запрещён')
+
+
+def parse_user_ids(body: dict) -> list:
+    """Достаёт из тела список user_ids (или одиночный user_id) без повторов"""
+    raw = body.get('user_ids')
+    if raw is None:
+        raw = [body.get('user_id')]
+    if not isinstance(raw, list):
+        raise ValueError('user_ids должен быть списком')
+    try:
+        ids = list(dict.fromkeys(int(value) for value in raw))
+    except (TypeError, ValueError) as e:
+        raise ValueError('Некорректный список id') from e
+    if not ids:
+        raise ValueError('Не указаны пользователи')
+    if len(ids) > MODERATION_MAX_IDS:
+        raise ValueError(f'Не больше {MODERATION_MAX_IDS} пользователей за запрос')
+    return ids
+
+
+def moderate_users(cur, action: str, ids: list) -> dict:
+    """Применяет действие модерации ко всем ids одним UPDATE.
+
+    Возвращает статус по каждому id: updated, unchanged (флаг уже стоял)
+    или not_found. Сессии отзываются у всех найденных пользователей.
+    """
+    column, value, revoke, _ = MODERATION_ACTIONS[action]
+    revoke_sql = """
+        , revoked AS (
+            INSERT INTO session_revocations (user_id)
+            SELECT id FROM existing
+            ON CONFLICT (user_id) DO UPDATE SET revoked_at = CURRENT_TIMESTAMP
+        )
+    """ if revoke else ""
+    
+    cur.execute(f"""
+        WITH existing AS (
+            SELECT id FROM users WHERE id = ANY(%s)
+        ), updated AS (
+            UPDATE users SET {column} = %s
+            WHERE id = ANY(%s) AND {column} IS DISTINCT FROM %s
+            RETURNING id
+        ){revoke_sql}
+        SELECT t.id, u.id IS NOT NULL, e.id IS NOT NULL
+        FROM unnest(%s::INTEGER[]) t(id)
+        LEFT JOIN updated u ON u.id = t.id
+        LEFT JOIN existing e ON e.id = t.id
+    """, (ids, value, ids, value, ids))
+    
+    return {
+        user_id: 'updated' if changed else 'unchanged' if found else 'not_found'
+        for user_id, changed, found in cur.fetchall()
+    }
+
+
+def purge_user_content(cur, ids: list) -> dict:
+    """Удаляет посты и комментарии пользователей вместе с зависимыми строками.
+
+    Счётчики comments_count чужих постов уменьшаются на число удалённых
+    комментариев. Возвращает {user_id: (постов удалено, комментариев удалено)}.
+    """
+    cur.execute("""
+        WITH removed AS (
+            DELETE FROM comments WHERE user_id = ANY(%s)
+            RETURNING post_id, user_id
+        ), per_post AS (
+            SELECT post_id, COUNT(*) AS n FROM removed GROUP BY post_id
+        ), adjusted AS (
+            UPDATE posts p SET comments_count = GREATEST(p.comments_count - pp.n, 0)
+            FROM per_post pp
+            WHERE p.id = pp.post_id
+        )
+        SELECT user_id, COUNT(*) FROM removed GROUP BY user_id
+    """, (ids,))
+    comments_deleted = dict(cur.fetchall())
+    
+    cur.execute("""
+        WITH doomed AS (
+            SELECT id FROM posts WHERE user_id = ANY(%s)
+        ), c AS (
+            DELETE FROM comments WHERE post_id IN (SELECT id FROM doomed)
+        ), l AS (
+            DELETE FROM post_likes WHERE post_id IN (SELECT id FROM doomed)
+        ), t AS (
+            DELETE FROM home_timeline WHERE post_id IN (SELECT id FROM doomed)
+        ), n AS (
+            DELETE FROM notifications WHERE related_post_id IN (SELECT id FROM doomed)
+        ), o AS (
+            DELETE FROM notification_outbox WHERE related_post_id IN (SELECT id FROM doomed)
+        ), removed AS (
+            DELETE FROM posts WHERE id IN (SELECT id FROM doomed)
+            RETURNING user_id
+        )
+        SELECT user_id, COUNT(*) FROM removed GROUP BY user_id
+    """, (ids,))
+    posts_deleted = dict(cur.fetchall())
+    
+    return {
+        user_id: (posts_deleted.get(user_id, 0), comments_deleted.get(user_id, 0))
+        for user_id in ids
+    }
+
+
+def load_stats(cur, days: int) -> dict:
+    """Читает счётчики и дневные ряды из stats_counters и daily_stats.
+
+    Обе таблицы поддерживаются триггерами (V0017), поэтому стоимость не
+    зависит от числа пользователей и постов: суммируются 16 слотов на счётчик
+    и по одной строке на день и метрику.
+    """
+    cur.execute("""
+        SELECT name, SUM(value) FROM stats_counters
+        WHERE name = ANY(%s)
+        GROUP BY name
+    """, (list(STATS_COUNTERS),))
+    stats = dict.fromkeys(STATS_COUNTERS, 0)
+    stats.update({name: int(value) for name, value in cur.fetchall()})
+    
+    cur.execute("""
+        SELECT d::DATE, m.metric, COALESCE(SUM(s.value), 0)
+        FROM generate_series(CURRENT_DATE - (%s - 1), CURRENT_DATE, INTERVAL '1 day') d
+        CROSS JOIN unnest(%s::VARCHAR[]) m(metric)
+        LEFT JOIN daily_stats s ON s.day = d::DATE AND s.metric = m.metric
+        GROUP BY 1, 2
+        ORDER BY 1
+    """, (days, list(STATS_SERIES)))
+    series = {metric: [] for metric in STATS_SERIES}
+    for day, metric, value in cur.fetchall():
+        series[metric].append({'date': day.isoformat(), 'value': int(value)})
+    
+    stats['series'] = series
+    return stats
+
+
+def user_list_filters(params: dict) -> tuple:
+    """Собирает WHERE для списка пользователей из параметров запроса.
+
+    Поддерживает banned, admin (true/false), created_from, created_to (ISO-дата)
+    и q — подстроку имени или username (триграммные индексы). Возвращает
+    (список условий, параметры); ValueError при некорректном значении.
+    """
+    conditions = []
+    values = []
+    
+    for param, column in (('banned', 'is_banned'), ('admin', 'is_admin')):
+        flag = params.get(param)
+        if flag is None or flag == '':
+            continue
+        if flag not in ('true', 'false'):
+            raise ValueError(f'Параметр {param} должен быть true или false')
+        conditions.append(f"{column} = %s")
+        values.append(flag == 'true')
+    
+    for param, operator in (('created_from', '>='), ('created_to', '<')):
+        if params.get(param):
+            try:
+                moment = datetime.fromisoformat(params[param])
+            except ValueError as e:
+                raise ValueError(f'Некорректная дата в параметре {param}') from e
+            conditions.append(f"created_at {operator} %s")
+            values.append(moment)
+    
+    query = (params.get('q') or '').strip()
+    if query:
+        if len(query) < USERS_MIN_QUERY_LENGTH:
+            raise ValueError(f'Запрос q должен быть не короче {USERS_MIN_QUERY_LENGTH} символов')
+        pattern = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        conditions.append("(full_name ILIKE %s OR username ILIKE %s)")
+        values.extend([pattern, pattern])
+    
+    return conditions, values
+
+
+def admin_user_item(row) -> dict:
+    """Собирает пользователя админ-списка из строки в порядке USERS_EXPORT_COLUMNS"""
+    return {
+        'id': row[0],
+        'full_name': row[1],
+        'username': row[2],
+        'phone': row[3],
+        'is_admin': row[4],
+        'is_banned': row[5],
+        'avatar_url': row[6],
+        'created_at': row[7].isoformat() if row[7] else None
+    }
+
+
+def export_users(cur, conditions: list, values: list, export_format: str, after_id) -> tuple:
+    """Выгружает часть отфильтрованных пользователей в NDJSON или CSV.
+
+    Выгрузка идёт по id по возрастанию, не больше USERS_EXPORT_MAX_ROWS строк
+    за вызов. Возвращает (текст, id для следующей части или None).
+    """
+    conditions = list(conditions)
+    values = list(values)
+    if after_id is not None:
+        conditions.append("id > %s")
+        values.append(after_id)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    
+    cur.execute(f"""
+        SELECT {', '.join(USERS_EXPORT_COLUMNS)}
+        FROM users
+        {where}
+        ORDER BY id
+        LIMIT %s
+    """, (*values, USERS_EXPORT_MAX_ROWS + 1))
+    
+    rows = cur.fetchall()
+    has_more = len(rows) > USERS_EXPORT_MAX_ROWS
+    rows = rows[:USERS_EXPORT_MAX_ROWS]
+    
+    out = io.StringIO()
+    writer = None
+    if export_format == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(USERS_EXPORT_COLUMNS)
+    
+    for row in rows:
+        item = admin_user_item(row)
+        if writer:
+            writer.writerow([item[column] for column in USERS_EXPORT_COLUMNS])
+        else:
+            out.write(dump_json(item))
+            out.write('\n')
     
-    db_url = os.environ['DATABASE_URL']
+    return out.getvalue(), rows[-1][0] if has_more else None
+
+
+def get_stats(cur, session, params) -> dict:
+    """Счётчики и дневные ряды для дашборда"""
+    days = parse_limit(params.get('days'), STATS_SERIES_DAYS, STATS_MAX_SERIES_DAYS)
     
-    conn = psycopg2.connect(db_url)
-    conn.set_session(autocommit=True)
-    cur = conn.cursor()
+    return respond(load_stats(cur, days))
+
+
+def list_users(cur, session, params) -> dict:
+    """Список пользователей по курсору с фильтрами или выгрузка в NDJSON/CSV"""
+    export_format = params.get('format', 'json')
     
     try:
+        conditions, values = user_list_filters(params)
+        if export_format not in ('json', 'ndjson', 'csv'):
+            raise ValueError('Поддерживаются форматы json, ndjson и csv')
+    except ValueError as e:
+        raise ApiError(400, str(e)) from e
+    
+    if export_format != 'json':
+        # Массовая выгрузка с телефонами доступна только по токену администратора
+        if not session or not session['adm']:
+            raise ApiError(403, 'Доступ запрещён')
         
-        if method == 'GET':
-            action = event.get('queryStringParameters', {}).get('action', 'stats')
-            
-            if action == 'stats':
-                cur.execute("SELECT COUNT(*) FROM users")
-                users_count = cur.fetchone()[0]
-                
-                cur.execute("SELECT COUNT(*) FROM posts")
-                posts_count = cur.fetchone()[0]
-                
-                cur.execute("SELECT COUNT(*) FROM users WHERE is_banned = TRUE")
-                banned_count = cur.fetchone()[0]
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'users_count': users_count,
-                        'posts_count': posts_count,
-                        'banned_count': banned_count
-                    }),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'users':
-                cur.execute("""
-                    SELECT id, full_name, username, phone, is_admin, is_banned, avatar_url, created_at
-                    FROM users
-                    ORDER BY created_at DESC
-                """)
-                
-                users = []
-                for row in cur.fetchall():
-                    users.append({
-                        'id': row[0],
-                        'full_name': row[1],
-                        'username': row[2],
-                        'phone': row[3],
-                        'is_admin': row[4],
-                        'is_banned': row[5],
-                        'avatar_url': row[6],
-                        'created_at': row[7].isoformat() if row[7] else None
-                    })
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'users': users}),
-                    'isBase64Encoded': False
-                }
-        
-        elif method == 'PUT':
-            body = json.loads(event.get('body', '{}'))
-            action = body.get('action')
-            user_id = body.get('user_id')
-            admin_id = body.get('admin_id')
-            
-            cur.execute("SELECT is_admin FROM users WHERE id = %s", (admin_id,))
-            admin = cur.fetchone()
-            
-            if not admin or not admin[0]:
-                return {
-                    'statusCode': 403,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Доступ запрещён'}),
-                    'isBase64Encoded': False
-                }
-            
-            if action == 'ban':
-                cur.execute(
-                    "UPDATE users SET is_banned = TRUE WHERE id = %s",
-                    (user_id,)
-                )
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'message': 'Пользователь заблокирован'}),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'unban':
-                cur.execute(
-                    "UPDATE users SET is_banned = FALSE WHERE id = %s",
-                    (user_id,)
-                )
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'message': 'Пользователь разблокирован'}),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'grant_admin':
-                cur.execute(
-                    "UPDATE users SET is_admin = TRUE WHERE id = %s",
-                    (user_id,)
-                )
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'message': 'Права администратора выданы'}),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'revoke_admin':
-                cur.execute(
-                    "UPDATE users SET is_admin = FALSE WHERE id = %s",
-                    (user_id,)
-                )
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'message': 'Права администратора отозваны'}),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'update_user':
-                updates = []
-                params = []
-                
-                if 'full_name' in body:
-                    updates.append('full_name = %s')
-                    params.append(body['full_name'])
-                
-                if 'username' in body:
-                    updates.append('username = %s')
-                    params.append(body['username'])
-                
-                if updates:
-                    params.append(user_id)
-                    cur.execute(
-                        f"UPDATE users SET {', '.join(updates)} WHERE id = %s",
-                        params
-                    )
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': True, 'message': 'Данные пользователя обновлены'}),
-                        'isBase64Encoded': False
-                    }
+        try:
+            after_id = int(params['after_id']) if params.get('after_id') else None
+        except ValueError as e:
+            raise ApiError(400, 'Некорректный after_id') from e
         
+        # Следующая часть запрашивается с after_id из X-Export-Next-After-Id;
+        # заголовка нет, если выгружено всё
+        body, next_after_id = export_users(cur, conditions, values, export_format, after_id)
+        content_type = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+        headers = {
+            'Content-Type': f'{content_type}; charset=utf-8',
+            'Content-Disposition': f'attachment; filename="users.{export_format}"',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'X-Export-Next-After-Id'
+        }
+        if next_after_id is not None:
+            headers['X-Export-Next-After-Id'] = str(next_after_id)
         return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Метод не поддерживается'}),
+            'statusCode': 200,
+            'headers': headers,
+            'body': body,
             'isBase64Encoded': False
         }
     
+    limit = parse_limit(params.get('limit'), USERS_PAGE_SIZE, USERS_MAX_PAGE_SIZE)
+    if params.get('cursor'):
+        try:
+            cursor_created_at, cursor_id = decode_cursor(params['cursor'])
+        except ValueError as e:
+            raise ApiError(400, str(e)) from e
+        conditions.append("(created_at, id) < (%s, %s)")
+        values.extend([cursor_created_at, cursor_id])
+    
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    cur.execute(f"""
+        SELECT {', '.join(USERS_EXPORT_COLUMNS)}
+        FROM users
+        {where}
+        ORDER BY created_at DESC, id DESC
+        LIMIT %s
+    """, (*values, limit + 1))
+    
+    rows = cur.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    users = [admin_user_item(row) for row in rows]
+    # Телефоны, как и выгрузка, — только по токену администратора
+    if not session or not session['adm']:
+        for user in users:
+            del user['phone']
+    next_cursor = encode_cursor(rows[-1][7], rows[-1][0]) if has_more else None
+    
+    return respond({'users': users, 'next_cursor': next_cursor})
+
+
+def update_user(cur, session, body) -> dict:
+    """Меняет имя и username пользователя"""
+    require_admin(cur, session, body)
+    updates = []
+    params = []
+    
+    if 'full_name' in body:
+        updates.append('full_name = %s')
+        params.append(body['full_name'])
+    
+    if 'username' in body:
+        updates.append('username = %s')
+        params.append(body['username'])
+    
+    if updates:
+        params.append(body.get('user_id'))
+        cur.execute(
+            f"UPDATE users SET {', '.join(updates)} WHERE id = %s",
+            params
+        )
+        
+        return respond({'success': True, 'message': 'Данные пользователя обновлены'})
+    
+    raise ApiError(405, 'Метод не поддерживается')
+
+
+def reconcile_counters(cur, session, body) -> dict:
+    """Сверяет likes_count и comments_count постов пачкой по id"""
+    require_admin(cur, session, body)
+    try:
+        after_id = int(body.get('after_id') or 0)
+    except (TypeError, ValueError) as e:
+        raise ApiError(400, 'Некорректный after_id') from e
+    batch_size = parse_limit(body.get('batch_size'), RECONCILE_BATCH_SIZE, RECONCILE_MAX_BATCH_SIZE)
+    
+    # Счётчики и строки читаются из снимка запроса, а лайк меняет их в одной
+    # транзакции, так что разница между ними — накопленное расхождение.
+    # Пишется именно разница: если строку поста держит конкурентный лайк,
+    # UPDATE после ожидания прибавит её к свежему значению, а не затрёт его.
+    cur.execute("""
+        WITH batch AS (
+            SELECT id, likes_count, comments_count FROM posts
+            WHERE id > %s
+            ORDER BY id
+            LIMIT %s
+        ), drift AS (
+            SELECT
+                b.id,
+                (SELECT COUNT(*) FROM post_likes pl WHERE pl.post_id = b.id) - b.likes_count AS likes_delta,
+                (SELECT COUNT(*) FROM comments c WHERE c.post_id = b.id) - b.comments_count AS comments_delta
+            FROM batch b
+        ), fixed AS (
+            UPDATE posts p
+            SET likes_count = p.likes_count + d.likes_delta,
+                comments_count = p.comments_count + d.comments_delta
+            FROM drift d
+            WHERE p.id = d.id
+              AND (d.likes_delta <> 0 OR d.comments_delta <> 0)
+            RETURNING p.id
+        )
+        SELECT (SELECT MAX(id) FROM batch), (SELECT COUNT(*) FROM fixed)
+    """, (after_id, batch_size))
+    last_id, fixed_count = cur.fetchone()
+    
+    return respond({
+        'success': True,
+        'fixed': fixed_count,
+        'next_after_id': last_id,
+        'done': last_id is None
+    })
+
+
+def refresh_stats(cur, session, body) -> dict:
+    """Пересчитывает итоговые счётчики статистики"""
+    require_admin(cur, session, body)
+    # Точный пересчёт счётчиков на случай расхождения с триггерами. Подсчёт
+    # строк и сумма слотов читаются одним запросом, то есть из одного снимка:
+    # триггер меняет счётчик в той же транзакции, что и строку, поэтому их
+    # разница — это ровно накопленное расхождение. Оно прибавляется к слоту 0
+    # как обычное приращение, и вставки, закоммиченные во время долгих
+    # COUNT(*), не ждут блокировки и не теряются.
+    cur.execute("""
+        WITH actual (name, value) AS (
+            VALUES
+                ('users_count', (SELECT COUNT(*) FROM users)),
+                ('banned_count', (SELECT COUNT(*) FROM users WHERE is_banned)),
+                ('posts_count', (SELECT COUNT(*) FROM posts)),
+                ('messages_count', (SELECT COUNT(*) FROM messages))
+        ), stored AS (
+            SELECT name, SUM(value) AS value
+            FROM stats_counters
+            WHERE name = ANY(%s)
+            GROUP BY name
+        )
+        INSERT INTO stats_counters (name, slot, value)
+        SELECT a.name, 0, a.value - COALESCE(s.value, 0)
+        FROM actual a
+        LEFT JOIN stored s ON s.name = a.name
+        WHERE a.value <> COALESCE(s.value, 0)
+        ON CONFLICT (name, slot) DO UPDATE SET value = stats_counters.value + EXCLUDED.value
+    """, (list(STATS_COUNTERS),))
+    cur.execute(
+        "DELETE FROM daily_active_users WHERE day < CURRENT_DATE - %s",
+        (STATS_ACTIVITY_RETENTION_DAYS,)
+    )
+    
+    return respond({'success': True, **load_stats(cur, STATS_SERIES_DAYS)})
+
+
+def moderate(cur, session, body) -> dict:
+    """ban, unban, grant_admin и revoke_admin для user_id или списка user_ids"""
+    require_admin(cur, session, body)
+    conn = cur.connection
+    action = body['action']
+    try:
+        ids = parse_user_ids(body)
+    except ValueError as e:
+        raise ApiError(400, str(e)) from e
+    cascade = action == 'ban' and bool(body.get('cascade'))
+    
+    conn.autocommit = False
+    try:
+        statuses = moderate_users(cur, action, ids)
+        purged = purge_user_content(cur, ids) if cascade else {}
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
     finally:
-        cur.close()
-        conn.close()
\ No newline at end of file
+        conn.autocommit = True
+    
+    if 'user_ids' not in body:
+        return respond({'success': True, 'message': MODERATION_ACTIONS[action][3]})
+    
+    results = []
+    for target_id in ids:
+        result = {'user_id': target_id, 'status': statuses.get(target_id, 'not_found')}
+        if cascade:
+            result['posts_deleted'], result['comments_deleted'] = purged[target_id]
+        results.append(result)
+    
+    return respond({'success': True, 'results': results})
+
+
+ROUTER = Router(
+    {
+        'GET': {
+            'stats': get_stats,
+            'users': list_users
+        },
+        'PUT': {
+            'ban': moderate,
+            'unban': moderate,
+            'grant_admin': moderate,
+            'revoke_admin': moderate,
+            'update_user': update_user,
+            'reconcile_counters': reconcile_counters,
+            'refresh_stats': refresh_stats
+        }
+    },
+    {'GET': 'stats'}
+)
+
+
+def handler(event: dict, context) -> dict:
+    """API для админ-панели: управление пользователями, модерация"""
+    return ROUTER(event)
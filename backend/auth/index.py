@@ -1,241 +1,990 @@
+import base64
+import bisect
+import hashlib
+import hmac
 import json
 import os
+import threading
+import time
 import psycopg2
+from psycopg2 import pool
 import bcrypt
 import secrets
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime, timedelta
 
-def handler(event: dict, context) -> dict:
-    """API для регистрации, авторизации и управления пользователями"""
-    method = event.get('httpMethod', 'GET')
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', '30'))
+
+_pool = None
+_last_used = {}
+
+
+def get_connection():
+    """Выдаёт соединение из пула контейнера, переживающего тёплые вызовы.
+
+    Соединение, простаивавшее дольше DB_POOL_CHECK_AFTER секунд, проверяется
+    запросом SELECT 1; закрытые и отвалившиеся соединения выбрасываются
+    из пула и заменяются новыми.
+    """
+    global _pool
+    if _pool is None:
+        _pool = pool.ThreadedConnectionPool(DB_POOL_SIZE, DB_POOL_MAX_SIZE, os.environ['DATABASE_URL'])
+    
+    for _ in range(DB_POOL_MAX_SIZE + 1):
+        conn = _pool.getconn()
+        last_used = _last_used.pop(id(conn), None)
+        
+        if not conn.closed and last_used is not None and time.monotonic() - last_used > DB_POOL_CHECK_AFTER:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+            except psycopg2.Error:
+                conn.close()
+        
+        if conn.closed:
+            _pool.putconn(conn, close=True)
+            continue
+        
+        if not conn.autocommit:
+            conn.set_session(autocommit=True)
+        return conn
+    
+    raise psycopg2.OperationalError('Не удалось получить рабочее соединение с базой данных')
+
+
+def release_connection(conn) -> None:
+    """Возвращает соединение в пул; пул сам откатывает незавершённые транзакции"""
+    _pool.putconn(conn)
+    if not conn.closed:
+        _last_used[id(conn)] = time.monotonic()
+
+
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS', '2'))
+BCRYPT_MAX_QUEUE = int(os.environ.get('BCRYPT_MAX_QUEUE', '8'))
+BCRYPT_WAIT_TIMEOUT = float(os.environ.get('BCRYPT_WAIT_TIMEOUT', '5'))
+
+_hash_executor = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix='bcrypt')
+_hash_slots = threading.BoundedSemaphore(BCRYPT_WORKERS + BCRYPT_MAX_QUEUE)
+_hash_lock = threading.Lock()
+_hash_in_flight = 0
+
+
+class HashingOverloaded(Exception):
+    """Очередь хеширования паролей переполнена или ожидание истекло"""
+
+
+def log_hash_metric(event: str, **fields) -> None:
+    """Пишет структурированную строку метрики хеширования в лог функции"""
+    print(json.dumps({'metric': 'bcrypt', 'event': event, **fields}))
+
+
+def run_hashing(func, *args):
+    """Выполняет bcrypt-операцию в ограниченном пуле потоков.
+
+    Одновременно в работе и в очереди не больше BCRYPT_WORKERS + BCRYPT_MAX_QUEUE
+    операций; лишние сразу отклоняются, а ожидание дольше BCRYPT_WAIT_TIMEOUT
+    секунд прерывается. В обоих случаях поднимается HashingOverloaded.
+    """
+    global _hash_in_flight
+    if not _hash_slots.acquire(blocking=False):
+        log_hash_metric('rejected', in_flight=_hash_in_flight)
+        raise HashingOverloaded()
+    
+    with _hash_lock:
+        _hash_in_flight += 1
+        in_flight = _hash_in_flight
+    submitted_at = time.monotonic()
+    
+    def job():
+        global _hash_in_flight
+        started_at = time.monotonic()
+        try:
+            return func(*args), started_at - submitted_at
+        finally:
+            with _hash_lock:
+                _hash_in_flight -= 1
+            _hash_slots.release()
+    
+    future = _hash_executor.submit(job)
+    try:
+        result, queued = future.result(timeout=BCRYPT_WAIT_TIMEOUT)
+    except FutureTimeoutError:
+        log_hash_metric('timed_out', in_flight=in_flight)
+        raise HashingOverloaded()
+    
+    log_hash_metric(
+        func.__name__,
+        in_flight=in_flight,
+        queued_ms=round(queued * 1000, 2),
+        total_ms=round((time.monotonic() - submitted_at) * 1000, 2)
+    )
+    return result
+
+
+def hash_password(password: str) -> str:
+    """Хеширует пароль с текущей стоимостью BCRYPT_ROUNDS"""
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
+
+
+def check_password(password: str, password_hash: str) -> bool:
+    """Сверяет пароль с bcrypt-хешем"""
+    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+
+
+def hash_rounds(password_hash: str) -> int:
+    """Достаёт стоимость из хеша вида $2b$12$..."""
+    try:
+        return int(password_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return 0
+
+
+def overloaded_response() -> dict:
+    """Ответ 503 для запросов, не попавших в пул хеширования"""
+    return {
+        'statusCode': 503,
+        'headers': {**JSON_HEADERS, 'Retry-After': '1'},
+        'body': dump_json({'error': 'Сервер перегружен, попробуйте позже'}),
+        'isBase64Encoded': False
+    }
+
+
+SESSION_TTL = int(os.environ.get('SESSION_TTL', '900'))
+SESSION_REVOCATION_REFRESH = float(os.environ.get('SESSION_REVOCATION_REFRESH', '30'))
+REQUIRE_SESSION_TOKEN = os.environ.get('REQUIRE_SESSION_TOKEN', 'false').lower() == 'true'
+
+_revoked_sessions = {}
+_revocations_loaded_at = None
+
+
+class InvalidSession(Exception):
+    """Токен сессии подделан, просрочен, отозван или отсутствует там, где обязателен"""
+
+
+def b64url_encode(data: bytes) -> str:
+    """base64url без выравнивающих '='"""
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def b64url_decode(value: str) -> bytes:
+    """Декодирует base64url, дополняя срезанные '='"""
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+
+def sign_session(payload: str) -> bytes:
+    """HMAC-SHA256 подпись полезной нагрузки токена ключом SESSION_SECRET"""
+    return hmac.new(os.environ['SESSION_SECRET'].encode('utf-8'), payload.encode('ascii'), hashlib.sha256).digest()
+
+
+def load_revocations(cur) -> None:
+    """Обновляет кеш отзывов сессий не чаще раза в SESSION_REVOCATION_REFRESH секунд.
+
+    Хранятся только отзывы моложе SESSION_TTL: более старые токены
+    к этому моменту уже истекли сами.
+    """
+    global _revoked_sessions, _revocations_loaded_at
+    now = time.monotonic()
+    if _revocations_loaded_at is not None and now - _revocations_loaded_at < SESSION_REVOCATION_REFRESH:
+        return
+    cur.execute(
+        "SELECT user_id, EXTRACT(EPOCH FROM revoked_at) FROM session_revocations WHERE revoked_at > CURRENT_TIMESTAMP - make_interval(secs => %s)",
+        (SESSION_TTL,)
+    )
+    _revoked_sessions = {row[0]: float(row[1]) for row in cur.fetchall()}
+    _revocations_loaded_at = now
+
+
+def read_session(event: dict, cur):
+    """Проверяет токен из X-Auth-Token или Authorization: Bearer без запроса к users.
+
+    Возвращает claims токена ({'uid', 'adm', 'ban', 'iat', 'exp'}) или None,
+    если токен не передан; InvalidSession — если токен недействителен.
+    """
+    headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+    token = headers.get('x-auth-token')
+    if not token and headers.get('authorization', '').startswith('Bearer '):
+        token = headers['authorization'][len('Bearer '):]
+    if not token:
+        return None
     
-    if method == 'OPTIONS':
-        return {
+    try:
+        payload, signature = token.split('.')
+        if not hmac.compare_digest(sign_session(payload), b64url_decode(signature)):
+            raise InvalidSession()
+        claims = json.loads(b64url_decode(payload))
+    except (ValueError, UnicodeError) as e:
+        raise InvalidSession() from e
+    
+    if claims.get('exp', 0) < time.time() or claims.get('ban'):
+        raise InvalidSession()
+    
+    load_revocations(cur)
+    revoked_at = _revoked_sessions.get(claims['uid'])
+    if revoked_at is not None and claims['iat'] <= revoked_at:
+        raise InvalidSession()
+    return claims
+
+
+def issue_token(user_id: int, is_admin: bool, is_banned: bool, issued_at) -> str:
+    """Выпускает подписанный токен сессии со сроком жизни SESSION_TTL секунд.
+
+    issued_at — EXTRACT(EPOCH FROM CURRENT_TIMESTAMP) из базы: revoked_at
+    тоже ставит база, и iat сравнивается с ним по одним часам.
+    """
+    issued_at = float(issued_at)
+    claims = {'uid': user_id, 'adm': bool(is_admin), 'ban': bool(is_banned), 'iat': issued_at, 'exp': int(issued_at) + SESSION_TTL}
+    payload = b64url_encode(json.dumps(claims, separators=(',', ':')).encode('utf-8'))
+    return f"{payload}.{b64url_encode(sign_session(payload))}"
+
+
+def session_user_id(session, fallback):
+    """id пользователя из токена; без токена — id из запроса, пока REQUIRE_SESSION_TOKEN выключен"""
+    if session:
+        return session['uid']
+    if REQUIRE_SESSION_TOKEN:
+        raise InvalidSession()
+    return fallback
+
+
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+
+class ApiError(Exception):
+    """Ошибка запроса: отдаётся клиенту со статусом status и телом {'error': message}"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def dump_json(data) -> str:
+    """Сериализует тело ответа: orjson, если он установлен, иначе стандартный json"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return json.dumps(data)
+
+
+def respond(data, status: int = 200) -> dict:
+    """JSON-ответ функции с общими заголовками"""
+    return {'statusCode': status, 'headers': JSON_HEADERS, 'body': dump_json(data), 'isBase64Encoded': False}
+
+
+def parse_body(event: dict) -> dict:
+    """Разбирает JSON-тело запроса; ApiError 400, если это не JSON-объект"""
+    raw = event.get('body') or '{}'
+    try:
+        body = orjson.loads(raw) if orjson is not None else json.loads(raw)
+    except ValueError as e:
+        raise ApiError(400, 'Некорректный JSON в теле запроса') from e
+    if not isinstance(body, dict):
+        raise ApiError(400, 'Тело запроса должно быть JSON-объектом')
+    return body
+
+
+REQUEST_METRICS = os.environ.get('REQUEST_METRICS', 'false').lower() == 'true'
+REQUEST_METRICS_HISTOGRAM = os.environ.get('REQUEST_METRICS_HISTOGRAM', 'false').lower() == 'true'
+REQUEST_METRICS_FLUSH_EVERY = int(os.environ.get('REQUEST_METRICS_FLUSH_EVERY', '100'))
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_latency_histogram = {}
+_histogram_requests = 0
+
+
+class MetricsCursor(psycopg2.extensions.cursor):
+    """Курсор, который считает запросы, время в БД и строки результата.
+
+    Выдаётся роутером только при REQUEST_METRICS=true; без него обработчики
+    получают обычный курсор и не платят за учёт.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queries = 0
+        self.db_time = 0.0
+        self.rows = 0
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            if self.description is not None and self.rowcount > 0:
+                self.rows += self.rowcount
+
+
+def observe_latency(action: str, wall_ms: float) -> None:
+    """Кладёт время запроса в гистограмму контейнера и раз в
+    REQUEST_METRICS_FLUSH_EVERY запросов пишет её в лог и обнуляет"""
+    global _histogram_requests
+    buckets = _latency_histogram.get(action)
+    if buckets is None:
+        buckets = _latency_histogram[action] = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+    buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, wall_ms)] += 1
+    _histogram_requests += 1
+    
+    if _histogram_requests >= REQUEST_METRICS_FLUSH_EVERY:
+        print(dump_json({
+            'metric': 'latency_histogram',
+            'buckets_ms': LATENCY_BUCKETS_MS,
+            'actions': _latency_histogram
+        }))
+        _latency_histogram.clear()
+        _histogram_requests = 0
+
+
+def record_request(action: str, cur, response, elapsed: float) -> None:
+    """Пишет структурированную строку метрик запроса в лог функции"""
+    body = (response.get('body') or '') if response else ''
+    wall_ms = elapsed * 1000
+    print(dump_json({
+        'metric': 'request',
+        'action': action,
+        'status': response['statusCode'] if response else 500,
+        'wall_ms': round(wall_ms, 2),
+        'db_ms': round(cur.db_time * 1000, 2),
+        'queries': cur.queries,
+        'rows': cur.rows,
+        'response_bytes': len(body.encode('utf-8'))
+    }))
+    if REQUEST_METRICS_HISTOGRAM:
+        observe_latency(action, wall_ms)
+
+
+class Router:
+    """Диспетчер функции: (метод, action) запроса → обработчик действия.
+
+    routes — {метод: {action: обработчик}}, ключ '*' принимает остальные
+    action метода; default_actions — action для запросов без него.
+    Обработчик получает (cur, session, args), где args — параметры строки
+    запроса для GET и JSON-тело для остальных методов. Preflight и ответ 405
+    собираются один раз при создании роутера.
+    """
+
+    def __init__(self, routes: dict, default_actions: dict):
+        self.routes = routes
+        self.default_actions = default_actions
+        self.preflight = {
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-User-Id',
+                'Access-Control-Allow-Methods': ', '.join([*routes, 'OPTIONS']),
+                'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Auth-Token, X-User-Id',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
             'isBase64Encoded': False
         }
+        self.not_allowed = respond({'error': 'Метод не поддерживается'}, 405)
+
+    def resolve(self, method: str, args: dict):
+        """Находит (action, обработчик) для метода и action; None, если такого нет.
+
+        Запрос, попавший в '*', получает action по умолчанию для метода, чтобы
+        метрики не размножались по произвольным значениям из запроса.
+        """
+        actions = self.routes.get(method)
+        if actions is None:
+            return None
+        action = args.get('action') or self.default_actions.get(method)
+        if isinstance(action, str) and action in actions:
+            return action, actions[action]
+        if '*' in actions:
+            return self.default_actions.get(method, '*'), actions['*']
+        return None
+
+    def __call__(self, event: dict) -> dict:
+        # Время запроса включает разбор тела и получение соединения из пула
+        started = time.perf_counter()
+        method = event.get('httpMethod', 'GET')
+        if method == 'OPTIONS':
+            return self.preflight
+        if method not in self.routes:
+            return self.not_allowed
+        
+        try:
+            args = (event.get('queryStringParameters') or {}) if method == 'GET' else parse_body(event)
+        except ApiError as e:
+            return respond({'error': e.message}, e.status)
+        
+        resolved = self.resolve(method, args)
+        if resolved is None:
+            return self.not_allowed
+        action, route = resolved
+        
+        conn = get_connection()
+        cur = conn.cursor(cursor_factory=MetricsCursor) if REQUEST_METRICS else conn.cursor()
+        response = None
+        
+        try:
+            session = read_session(event, cur)
+            response = route(cur, session, args)
+        
+        except ApiError as e:
+            response = respond({'error': e.message}, e.status)
+        
+        except InvalidSession:
+            response = respond({'error': 'Сессия недействительна, войдите заново'}, 401)
+        
+        except psycopg2.DataError:
+            # Значение из запроса не приводится к типу колонки, например id='abc'
+            response = respond({'error': 'Некорректные параметры запроса'}, 400)
+        
+        finally:
+            cur.close()
+            release_connection(conn)
+            if REQUEST_METRICS:
+                record_request(action, cur, response, time.perf_counter() - started)
+        
+        return response
+
+
+PROFILE_CACHE_SIZE = int(os.environ.get('PROFILE_CACHE_SIZE', '1024'))
+PROFILE_CACHE_TTL = float(os.environ.get('PROFILE_CACHE_TTL', '60'))
+PROFILE_INVALIDATE_CHANNEL = 'profile_invalidate'
+
+_profile_cache = OrderedDict()
+_profile_listener = None
+_profile_listener_retry_at = 0.0
+
+
+def sync_profile_cache() -> None:
+    """Применяет к кешу профилей пришедшие NOTIFY profile_invalidate.
+
+    Уведомления шлёт триггер на UPDATE users, поэтому кеш сбрасывается и после
+    правок из других функций (бан и update_user в админке, счётчики подписок).
+    Слушающее соединение одно на контейнер, берётся из пула и занимает его
+    навсегда, так что запросам остаётся DB_POOL_MAX_SIZE - 1 соединений, а
+    всего контейнер держит не больше DB_POOL_MAX_SIZE. Соединение
+    опрашивается без блокировки; если оно оборвалось, кеш очищается целиком.
+    После неудачного подключения следующая попытка — не раньше чем через
+    PROFILE_CACHE_TTL, а до тех пор профили читаются из базы без кеша.
+    """
+    global _profile_listener, _profile_listener_retry_at
+    if _profile_listener is not None and not _profile_listener.closed:
+        try:
+            _profile_listener.poll()
+        except psycopg2.Error:
+            _profile_listener.close()
+        else:
+            for notify in _profile_listener.notifies:
+                try:
+                    _profile_cache.pop(int(notify.payload), None)
+                except ValueError:
+                    continue
+            del _profile_listener.notifies[:]
+            return
     
-    db_url = os.environ['DATABASE_URL']
+    if _profile_listener is not None:
+        release_connection(_profile_listener)
+    _profile_cache.clear()
+    _profile_listener = None
+    if time.monotonic() < _profile_listener_retry_at:
+        return
+    listener = None
+    try:
+        # Пул исчерпан запросами — PoolError, тоже psycopg2.Error
+        listener = get_connection()
+        with listener.cursor() as listen_cur:
+            listen_cur.execute(f"LISTEN {PROFILE_INVALIDATE_CHANNEL}")
+    except psycopg2.Error:
+        if listener is not None:
+            listener.close()
+            release_connection(listener)
+        _profile_listener_retry_at = time.monotonic() + PROFILE_CACHE_TTL
+        return
+    _profile_listener = listener
+
+
+def cached_profile(user_id: int):
+    """Готовое JSON-тело профиля из кеша или None, если записи нет или она устарела"""
+    entry = _profile_cache.get(user_id)
+    if entry is None:
+        return None
+    if entry[0] < time.monotonic():
+        del _profile_cache[user_id]
+        return None
+    _profile_cache.move_to_end(user_id)
+    return entry[1]
+
+
+def store_profile(user_id: int, body: str) -> None:
+    """Кладёт профиль в LRU-кеш; без живого слушателя инвалидаций кеш не используется"""
+    if _profile_listener is None:
+        return
+    _profile_cache[user_id] = (time.monotonic() + PROFILE_CACHE_TTL, body)
+    _profile_cache.move_to_end(user_id)
+    while len(_profile_cache) > PROFILE_CACHE_SIZE:
+        _profile_cache.popitem(last=False)
+
+
+FOLLOWS_PAGE_SIZE = 50
+FOLLOWS_MAX_PAGE_SIZE = 200
+FOLLOW_STATE_MAX_IDS = 500
+FOLLOW_BACKFILL_POSTS = 50
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 50
+SEARCH_MAX_OFFSET = 500
+# Короче трёх символов у запроса нет ни одной триграммы, и GIN-индекс
+# не может обслужить ни %, ни ILIKE — остался бы полный просмотр
+SEARCH_MIN_QUERY_LENGTH = 3
+
+
+def parse_limit(value, default: int, maximum: int) -> int:
+    """Приводит параметр limit к числу в пределах [1, maximum]"""
+    try:
+        limit = int(value) if value is not None else default
+    except (TypeError, ValueError):
+        limit = default
+    return max(1, min(limit, maximum))
+
+
+def parse_ids(value: str, maximum: int) -> list:
+    """Разбирает список id вида '1,2,3'; ValueError, если он длиннее maximum"""
+    try:
+        ids = list(dict.fromkeys(int(part) for part in (value or '').split(',') if part.strip()))
+    except ValueError as e:
+        raise ValueError('Некорректный список id') from e
+    if len(ids) > maximum:
+        raise ValueError(f'Не больше {maximum} id за запрос')
+    return ids
+
+
+def register(cur, session, body) -> dict:
+    """Регистрирует пользователя и выдаёт токен сессии"""
+    phone = body.get('phone', '').strip()
+    password = body.get('password', '').strip()
+    full_name = body.get('full_name', '').strip()
+    
+    if not phone or not password or not full_name:
+        raise ApiError(400, 'Заполните все поля')
     
-    conn = psycopg2.connect(db_url)
-    conn.set_session(autocommit=True)
-    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM users WHERE phone = %s", (phone,))
+    if cur.fetchone():
+        raise ApiError(400, 'Номер телефона уже зарегистрирован')
+    
+    username = full_name.lower().replace(' ', '_') + '_' + secrets.token_hex(3)
+    
+    try:
+        password_hash = run_hashing(hash_password, password)
+    except HashingOverloaded:
+        return overloaded_response()
     
     try:
+        cur.execute(
+            "INSERT INTO users (phone, password_hash, full_name, username) VALUES (%s, %s, %s, %s) RETURNING id, username, full_name, is_admin, EXTRACT(EPOCH FROM CURRENT_TIMESTAMP)",
+            (phone, password_hash, full_name, username)
+        )
+        user = cur.fetchone()
         
-        if method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            action = body.get('action')
-            
-            if action == 'register':
-                phone = body.get('phone', '').strip()
-                password = body.get('password', '').strip()
-                full_name = body.get('full_name', '').strip()
-                
-                if not phone or not password or not full_name:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Заполните все поля'}),
-                        'isBase64Encoded': False
-                    }
-                
-                username = full_name.lower().replace(' ', '_') + '_' + secrets.token_hex(3)
-                
-                password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-                
-                try:
-                    cur.execute(
-                        "INSERT INTO users (phone, password_hash, full_name, username) VALUES (%s, %s, %s, %s) RETURNING id, username, full_name, is_admin",
-                        (phone, password_hash, full_name, username)
-                    )
-                    user = cur.fetchone()
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({
-                            'success': True,
-                            'user': {
-                                'id': user[0],
-                                'username': user[1],
-                                'full_name': user[2],
-                                'is_admin': user[3]
-                            }
-                        }),
-                        'isBase64Encoded': False
-                    }
-                except psycopg2.IntegrityError:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Номер телефона уже зарегистрирован'}),
-                        'isBase64Encoded': False
-                    }
-            
-            elif action == 'login':
-                phone = body.get('phone', '').strip()
-                password = body.get('password', '').strip()
-                
-                if not phone or not password:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Введите телефон и пароль'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute(
-                    "SELECT id, password_hash, username, full_name, is_admin, is_banned, avatar_url, bio FROM users WHERE phone = %s",
-                    (phone,)
-                )
-                user = cur.fetchone()
-                
-                if not user:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Неверный номер телефона или пароль'}),
-                        'isBase64Encoded': False
-                    }
-                
-                if user[5]:
-                    return {
-                        'statusCode': 403,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Ваш аккаунт заблокирован администратором'}),
-                        'isBase64Encoded': False
-                    }
-                
-                if bcrypt.checkpw(password.encode('utf-8'), user[1].encode('utf-8')):
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({
-                            'success': True,
-                            'user': {
-                                'id': user[0],
-                                'username': user[2],
-                                'full_name': user[3],
-                                'is_admin': user[4],
-                                'avatar_url': user[6],
-                                'bio': user[7]
-                            }
-                        }),
-                        'isBase64Encoded': False
-                    }
-                else:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Неверный номер телефона или пароль'}),
-                        'isBase64Encoded': False
-                    }
-        
-        elif method == 'GET':
-            user_id = event.get('queryStringParameters', {}).get('user_id')
-            
-            if user_id:
-                cur.execute(
-                    "SELECT id, username, full_name, avatar_url, bio, is_admin, is_banned FROM users WHERE id = %s",
-                    (user_id,)
-                )
-                user = cur.fetchone()
-                
-                if user:
-                    cur.execute(
-                        "SELECT COUNT(*) FROM follows WHERE follower_id = %s",
-                        (user_id,)
-                    )
-                    following_count = cur.fetchone()[0]
-                    
-                    cur.execute(
-                        "SELECT COUNT(*) FROM follows WHERE following_id = %s",
-                        (user_id,)
-                    )
-                    followers_count = cur.fetchone()[0]
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({
-                            'id': user[0],
-                            'username': user[1],
-                            'full_name': user[2],
-                            'avatar_url': user[3],
-                            'bio': user[4],
-                            'is_admin': user[5],
-                            'is_banned': user[6],
-                            'followers_count': followers_count,
-                            'following_count': following_count
-                        }),
-                        'isBase64Encoded': False
-                    }
+        return respond({
+            'success': True,
+            'user': {
+                'id': user[0],
+                'username': user[1],
+                'full_name': user[2],
+                'is_admin': user[3]
+            },
+            'token': issue_token(user[0], user[3], False, user[4]),
+            'expires_in': SESSION_TTL
+        })
+    except psycopg2.IntegrityError:
+        raise ApiError(400, 'Номер телефона уже зарегистрирован')
+
+
+def login(cur, session, body) -> dict:
+    """Вход по телефону и паролю; пересчитывает хеш, если сменилась стоимость bcrypt"""
+    phone = body.get('phone', '').strip()
+    password = body.get('password', '').strip()
+    
+    if not phone or not password:
+        raise ApiError(400, 'Введите телефон и пароль')
+    
+    cur.execute(
+        "SELECT id, password_hash, username, full_name, is_admin, is_banned, avatar_url, bio, EXTRACT(EPOCH FROM CURRENT_TIMESTAMP) FROM users WHERE phone = %s",
+        (phone,)
+    )
+    user = cur.fetchone()
+    
+    if not user:
+        raise ApiError(400, 'Неверный номер телефона или пароль')
+    
+    if user[5]:
+        raise ApiError(403, 'Ваш аккаунт заблокирован администратором')
+    
+    try:
+        password_ok = run_hashing(check_password, password, user[1])
+    except HashingOverloaded:
+        return overloaded_response()
+    
+    if password_ok and hash_rounds(user[1]) != BCRYPT_ROUNDS:
+        try:
+            new_hash = run_hashing(hash_password, password)
+        except HashingOverloaded:
+            new_hash = None
+        if new_hash:
+            cur.execute(
+                "UPDATE users SET password_hash = %s WHERE id = %s AND password_hash = %s",
+                (new_hash, user[0], user[1])
+            )
+            log_hash_metric('rehashed', from_rounds=hash_rounds(user[1]), to_rounds=BCRYPT_ROUNDS)
+    
+    if password_ok:
+        return respond({
+            'success': True,
+            'user': {
+                'id': user[0],
+                'username': user[2],
+                'full_name': user[3],
+                'is_admin': user[4],
+                'avatar_url': user[6],
+                'bio': user[7]
+            },
+            'token': issue_token(user[0], user[4], user[5], user[8]),
+            'expires_in': SESSION_TTL
+        })
+    else:
+        raise ApiError(400, 'Неверный номер телефона или пароль')
+
+
+def refresh_session(cur, session, body) -> dict:
+    """Выдаёт новый токен взамен ещё действующего"""
+    if not session:
+        raise InvalidSession()
+    
+    cur.execute("SELECT is_admin, is_banned, EXTRACT(EPOCH FROM CURRENT_TIMESTAMP) FROM users WHERE id = %s", (session['uid'],))
+    user = cur.fetchone()
+    
+    if not user or user[1]:
+        raise InvalidSession()
+    
+    return respond({
+        'success': True,
+        'token': issue_token(session['uid'], user[0], user[1], user[2]),
+        'expires_in': SESSION_TTL
+    })
+
+
+def follow_user(cur, session, body) -> dict:
+    """Подписка на пользователя с догрузкой его постов в домашнюю ленту"""
+    try:
+        follower_id = int(session_user_id(session, body.get('user_id')))
+        following_id = int(body.get('following_id'))
+    except (TypeError, ValueError) as e:
+        raise ApiError(400, 'Укажите user_id и following_id') from e
+    
+    if following_id == follower_id:
+        raise ApiError(400, 'Нельзя подписаться на этого пользователя')
+    
+    # Подписка, подкачка последних постов автора в домашнюю ленту
+    # и уведомление автору выполняются одним запросом
+    try:
+        cur.execute("""
+            WITH new_follow AS (
+                INSERT INTO follows (follower_id, following_id)
+                VALUES (%s, %s)
+                ON CONFLICT (follower_id, following_id) DO NOTHING
+                RETURNING follower_id, following_id
+            ), backfill AS (
+                INSERT INTO home_timeline (user_id, post_id, created_at)
+                SELECT nf.follower_id, p.id, p.created_at
+                FROM new_follow nf
+                JOIN users a ON a.id = nf.following_id AND NOT a.fanout_on_read
+                CROSS JOIN LATERAL (
+                    SELECT id, created_at FROM posts
+                    WHERE user_id = nf.following_id
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT %s
+                ) p
+                ON CONFLICT DO NOTHING
+            ), queued AS (
+                INSERT INTO notification_outbox (user_id, type, content, related_user_id, group_key)
+                SELECT following_id, 'follow', 'подписался на вас', follower_id, 'follow'
+                FROM new_follow
+            )
+            SELECT COUNT(*) FROM new_follow
+        """, (follower_id, following_id, FOLLOW_BACKFILL_POSTS))
+    except psycopg2.IntegrityError as e:
+        # Подписчик или автор удалён или никогда не существовал
+        if e.diag.constraint_name not in ('follows_follower_id_fkey', 'follows_following_id_fkey'):
+            raise
+        raise ApiError(404, 'Пользователь не найден') from e
+    created = cur.fetchone()[0] > 0
+    
+    return respond({'success': True, 'following': True, 'created': created})
+
+
+def unfollow_user(cur, session, body) -> dict:
+    """Отписка от пользователя"""
+    follower_id = session_user_id(session, body.get('user_id'))
+    following_id = body.get('following_id')
+    
+    cur.execute("""
+        WITH removed AS (
+            DELETE FROM follows
+            WHERE follower_id = %s AND following_id = %s
+            RETURNING follower_id, following_id
+        ), pruned AS (
+            DELETE FROM home_timeline ht
+            USING removed r, posts p
+            WHERE ht.user_id = r.follower_id
+              AND ht.post_id = p.id
+              AND p.user_id = r.following_id
+        )
+        SELECT COUNT(*) FROM removed
+    """, (follower_id, following_id))
+    removed = cur.fetchone()[0] > 0
+    
+    return respond({'success': True, 'following': False, 'removed': removed})
+
+
+def logout(cur, session, body) -> dict:
+    """Отзывает все выданные пользователю токены"""
+    if session:
+        cur.execute(
+            "INSERT INTO session_revocations (user_id) VALUES (%s) ON CONFLICT (user_id) DO UPDATE SET revoked_at = CURRENT_TIMESTAMP",
+            (session['uid'],)
+        )
+    
+    return respond({'success': True})
+
+
+def search_users(cur, session, params) -> dict:
+    """Поиск пользователей по имени и username через pg_trgm"""
+    query = (params.get('q') or '').strip()
+    limit = parse_limit(params.get('limit'), SEARCH_PAGE_SIZE, SEARCH_MAX_PAGE_SIZE)
+    try:
+        offset = min(max(int(params.get('offset') or 0), 0), SEARCH_MAX_OFFSET)
+    except ValueError:
+        offset = 0
+    
+    if len(query) < SEARCH_MIN_QUERY_LENGTH:
+        raise ApiError(400, 'Слишком короткий запрос')
+    
+    # Триграммные GIN-индексы обслуживают и нечёткое совпадение (%),
+    # и поиск подстроки в имени, и префикс username
+    pattern = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    cur.execute("""
+        SELECT
+            id, full_name, username, avatar_url,
+            GREATEST(similarity(full_name, %s), similarity(username, %s)) AS score
+        FROM users
+        WHERE NOT is_banned
+          AND (full_name %% %s OR username %% %s
+               OR full_name ILIKE %s OR username ILIKE %s)
+        ORDER BY score DESC, id
+        LIMIT %s OFFSET %s
+    """, (query, query, query, query, f'%{pattern}%', f'{pattern}%', limit + 1, offset))
+    
+    rows = cur.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    users = []
+    for row in rows:
+        users.append({
+            'id': row[0],
+            'full_name': row[1],
+            'username': row[2],
+            'avatar_url': row[3]
+        })
+    
+    return respond({
+        'users': users,
+        'next_offset': offset + limit if has_more and offset + limit <= SEARCH_MAX_OFFSET else None
+    })
+
+
+def get_follow_state(cur, session, params) -> dict:
+    """Состояние подписок текущего пользователя для списка id"""
+    viewer_id = session_user_id(session, params.get('user_id'))
+    try:
+        ids = parse_ids(params.get('ids'), FOLLOW_STATE_MAX_IDS)
+    except ValueError as e:
+        raise ApiError(400, str(e)) from e
+    
+    # Обе проверки идут по уникальному индексу (follower_id, following_id)
+    cur.execute("""
+        SELECT
+            t.id,
+            EXISTS (SELECT 1 FROM follows WHERE follower_id = %s AND following_id = t.id),
+            EXISTS (SELECT 1 FROM follows WHERE follower_id = t.id AND following_id = %s)
+        FROM unnest(%s::int[]) AS t(id)
+    """, (viewer_id, viewer_id, ids))
+    
+    states = {}
+    for row in cur.fetchall():
+        states[str(row[0])] = {
+            'following': row[1],
+            'followed_by': row[2],
+            'mutual': row[1] and row[2]
+        }
+    
+    return respond({'states': states})
+
+
+def get_follows(cur, session, params) -> dict:
+    """Подписчики (followers) или подписки (following) пользователя по курсору follows.id"""
+    limit = parse_limit(params.get('limit'), FOLLOWS_PAGE_SIZE, FOLLOWS_MAX_PAGE_SIZE)
+    try:
+        cursor = int(params['cursor']) if params.get('cursor') else None
+    except ValueError as e:
+        raise ApiError(400, 'Некорректный курсор') from e
+    
+    # followers: кто подписан на user_id; following: на кого подписан user_id
+    if params.get('action') == 'followers':
+        owner_column, other_column = 'following_id', 'follower_id'
+    else:
+        owner_column, other_column = 'follower_id', 'following_id'
+    page_filter = "AND f.id < %s" if cursor else ""
+    page_params = (cursor,) if cursor else ()
+    
+    cur.execute(f"""
+        SELECT f.id, u.id, u.full_name, u.username, u.avatar_url
+        FROM follows f
+        JOIN users u ON u.id = f.{other_column}
+        WHERE f.{owner_column} = %s {page_filter}
+        ORDER BY f.id DESC
+        LIMIT %s
+    """, (params.get('user_id'), *page_params, limit + 1))
+    
+    rows = cur.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    users = []
+    for row in rows:
+        users.append({
+            'id': row[1],
+            'full_name': row[2],
+            'username': row[3],
+            'avatar_url': row[4]
+        })
+    
+    return respond({'users': users, 'next_cursor': str(rows[-1][0]) if has_more else None})
+
+
+def get_profile(cur, session, params) -> dict:
+    """Профиль пользователя; тело ответа кешируется между вызовами"""
+    try:
+        user_id = int(params.get('user_id'))
+    except (TypeError, ValueError):
+        user_id = None
+    
+    if user_id:
+        sync_profile_cache()
+        body = cached_profile(user_id)
+        
+        if body is None:
+            cur.execute(
+                "SELECT id, username, full_name, avatar_url, bio, is_admin, is_banned, followers_count, following_count FROM users WHERE id = %s",
+                (user_id,)
+            )
+            user = cur.fetchone()
             
+            if user:
+                body = dump_json({
+                    'id': user[0],
+                    'username': user[1],
+                    'full_name': user[2],
+                    'avatar_url': user[3],
+                    'bio': user[4],
+                    'is_admin': user[5],
+                    'is_banned': user[6],
+                    'followers_count': user[7],
+                    'following_count': user[8]
+                })
+                store_profile(user_id, body)
+        
+        if body is not None:
             return {
-                'statusCode': 404,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Пользователь не найден'}),
+                'statusCode': 200,
+                'headers': JSON_HEADERS,
+                'body': body,
                 'isBase64Encoded': False
             }
+    
+    raise ApiError(404, 'Пользователь не найден')
+
+
+def update_profile(cur, session, body) -> dict:
+    """Обновляет имя, био и аватар текущего пользователя"""
+    user_id = session_user_id(session, body.get('user_id'))
+    
+    updates = []
+    params = []
+    
+    if 'full_name' in body:
+        updates.append('full_name = %s')
+        params.append(body['full_name'])
+    
+    if 'bio' in body:
+        updates.append('bio = %s')
+        params.append(body['bio'])
+    
+    if 'avatar_url' in body:
+        updates.append('avatar_url = %s')
+        params.append(body['avatar_url'])
+    
+    if updates:
+        params.append(user_id)
+        cur.execute(
+            f"UPDATE users SET {', '.join(updates)}, updated_at = CURRENT_TIMESTAMP WHERE id = %s RETURNING id, username, full_name, avatar_url, bio",
+            params
+        )
+        user = cur.fetchone()
+        _profile_cache.pop(user[0], None)
         
-        elif method == 'PUT':
-            body = json.loads(event.get('body', '{}'))
-            user_id = body.get('user_id')
-            
-            updates = []
-            params = []
-            
-            if 'full_name' in body:
-                updates.append('full_name = %s')
-                params.append(body['full_name'])
-            
-            if 'bio' in body:
-                updates.append('bio = %s')
-                params.append(body['bio'])
-            
-            if 'avatar_url' in body:
-                updates.append('avatar_url = %s')
-                params.append(body['avatar_url'])
-            
-            if updates:
-                params.append(user_id)
-                cur.execute(
-                    f"UPDATE users SET {', '.join(updates)}, updated_at = CURRENT_TIMESTAMP WHERE id = %s RETURNING id, username, full_name, avatar_url, bio",
-                    params
-                )
-                user = cur.fetchone()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'success': True,
-                        'user': {
-                            'id': user[0],
-                            'username': user[1],
-                            'full_name': user[2],
-                            'avatar_url': user[3],
-                            'bio': user[4]
-                        }
-                    }),
-                    'isBase64Encoded': False
-                }
-        
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Метод не поддерживается'}),
-            'isBase64Encoded': False
-        }
+        return respond({
+            'success': True,
+            'user': {
+                'id': user[0],
+                'username': user[1],
+                'full_name': user[2],
+                'avatar_url': user[3],
+                'bio': user[4]
+            }
+        })
     
-    finally:
-        cur.close()
-        conn.close()
\ No newline at end of file
+    raise ApiError(405, 'Метод не поддерживается')
+
+
+ROUTER = Router(
+    {
+        'GET': {
+            'followers': get_follows,
+            'following': get_follows,
+            'search': search_users,
+            'follow_state': get_follow_state,
+            '*': get_profile
+        },
+        'POST': {
+            'register': register,
+            'login': login,
+            'refresh': refresh_session,
+            'follow': follow_user,
+            'unfollow': unfollow_user,
+            'logout': logout
+        },
+        'PUT': {
+            '*': update_profile
+        }
+    },
+    {'GET': 'profile', 'PUT': 'update_profile'}
+)
+
+
+def handler(event: dict, context) -> dict:
+    """API для регистрации, авторизации и управления пользователями"""
+    return ROUTER(event)
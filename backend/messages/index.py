@@ -1,211 +1,615 @@
+import base64
+import bisect
+import hashlib
+import hmac
 import json
 import os
+import time
 import psycopg2
+from psycopg2 import pool
+from datetime import datetime
 
-def handler(event: dict, context) -> dict:
-    """API для управления сообщениями и чатами"""
-    method = event.get('httpMethod', 'GET')
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', '30'))
+
+_pool = None
+_last_used = {}
+
+
+def get_connection():
+    """Выдаёт соединение из пула контейнера, переживающего тёплые вызовы.
+
+    Соединение, простаивавшее дольше DB_POOL_CHECK_AFTER секунд, проверяется
+    запросом SELECT 1; закрытые и отвалившиеся соединения выбрасываются
+    из пула и заменяются новыми.
+    """
+    global _pool
+    if _pool is None:
+        _pool = pool.ThreadedConnectionPool(DB_POOL_SIZE, DB_POOL_MAX_SIZE, os.environ['DATABASE_URL'])
+    
+    for _ in range(DB_POOL_MAX_SIZE + 1):
+        conn = _pool.getconn()
+        last_used = _last_used.pop(id(conn), None)
+        
+        if not conn.closed and last_used is not None and time.monotonic() - last_used > DB_POOL_CHECK_AFTER:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+            except psycopg2.Error:
+                conn.close()
+        
+        if conn.closed:
+            _pool.putconn(conn, close=True)
+            continue
+        
+        if not conn.autocommit:
+            conn.set_session(autocommit=True)
+        return conn
+    
+    raise psycopg2.OperationalError('Не удалось получить рабочее соединение с базой данных')
+
+
+def release_connection(conn) -> None:
+    """Возвращает соединение в пул; пул сам откатывает незавершённые транзакции"""
+    _pool.putconn(conn)
+    if not conn.closed:
+        _last_used[id(conn)] = time.monotonic()
+
+
+CHATS_PAGE_SIZE = 50
+CHATS_MAX_PAGE_SIZE = 100
+MESSAGES_PAGE_SIZE = 50
+MESSAGES_MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(moment, item_id: int) -> str:
+    """Упаковывает позицию (время, id) последнего элемента в непрозрачный курсор"""
+    raw = f"{moment.isoformat()}|{item_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Распаковывает курсор списка; ValueError, если курсор повреждён"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        moment, item_id = raw.split('|')
+        return datetime.fromisoformat(moment), int(item_id)
+    except (UnicodeError, ValueError) as e:
+        raise ValueError('Некорректный курсор') from e
+
+
+def parse_limit(value, default: int, maximum: int) -> int:
+    """Приводит параметр limit к числу в пределах [1, maximum]"""
+    try:
+        limit = int(value) if value is not None else default
+    except (TypeError, ValueError):
+        limit = default
+    return max(1, min(limit, maximum))
+
+
+# Канал LISTEN/NOTIFY пользователя: префикс + id получателя
+EVENT_CHANNEL_PREFIX = 'user_events_'
+
+
+SESSION_TTL = int(os.environ.get('SESSION_TTL', '900'))
+SESSION_REVOCATION_REFRESH = float(os.environ.get('SESSION_REVOCATION_REFRESH', '30'))
+REQUIRE_SESSION_TOKEN = os.environ.get('REQUIRE_SESSION_TOKEN', 'false').lower() == 'true'
+
+_revoked_sessions = {}
+_revocations_loaded_at = None
+
+
+class InvalidSession(Exception):
+    """Токен сессии подделан, просрочен, отозван или отсутствует там, где обязателен"""
+
+
+def b64url_decode(value: str) -> bytes:
+    """Декодирует base64url, дополняя срезанные '='"""
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+
+def sign_session(payload: str) -> bytes:
+    """HMAC-SHA256 подпись полезной нагрузки токена ключом SESSION_SECRET"""
+    return hmac.new(os.environ['SESSION_SECRET'].encode('utf-8'), payload.encode('ascii'), hashlib.sha256).digest()
+
+
+def load_revocations(cur) -> None:
+    """Обновляет кеш отзывов сессий не чаще раза в SESSION_REVOCATION_REFRESH секунд.
+
+    Хранятся только отзывы моложе SESSION_TTL: более старые токены
+    к этому моменту уже истекли сами.
+    """
+    global _revoked_sessions, _revocations_loaded_at
+    now = time.monotonic()
+    if _revocations_loaded_at is not None and now - _revocations_loaded_at < SESSION_REVOCATION_REFRESH:
+        return
+    cur.execute(
+        "SELECT user_id, EXTRACT(EPOCH FROM revoked_at) FROM session_revocations WHERE revoked_at > CURRENT_TIMESTAMP - make_interval(secs => %s)",
+        (SESSION_TTL,)
+    )
+    _revoked_sessions = {row[0]: float(row[1]) for row in cur.fetchall()}
+    _revocations_loaded_at = now
+
+
+def read_session(event: dict, cur):
+    """Проверяет токен из X-Auth-Token или Authorization: Bearer без запроса к users.
+
+    Возвращает claims токена ({'uid', 'adm', 'ban', 'iat', 'exp'}) или None,
+    если токен не передан; InvalidSession — если токен недействителен.
+    """
+    headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+    token = headers.get('x-auth-token')
+    if not token and headers.get('authorization', '').startswith('Bearer '):
+        token = headers['authorization'][len('Bearer '):]
+    if not token:
+        return None
+    
+    try:
+        payload, signature = token.split('.')
+        if not hmac.compare_digest(sign_session(payload), b64url_decode(signature)):
+            raise InvalidSession()
+        claims = json.loads(b64url_decode(payload))
+    except (ValueError, UnicodeError) as e:
+        raise InvalidSession() from e
+    
+    if claims.get('exp', 0) < time.time() or claims.get('ban'):
+        raise InvalidSession()
+    
+    load_revocations(cur)
+    revoked_at = _revoked_sessions.get(claims['uid'])
+    if revoked_at is not None and claims['iat'] <= revoked_at:
+        raise InvalidSession()
+    return claims
+
+
+def session_user_id(session, fallback):
+    """id пользователя из токена; без токена — id из запроса, пока REQUIRE_SESSION_TOKEN выключен"""
+    if session:
+        return session['uid']
+    if REQUIRE_SESSION_TOKEN:
+        raise InvalidSession()
+    return fallback
+
+
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+
+class ApiError(Exception):
+    """Ошибка запроса: отдаётся клиенту со статусом status и телом {'error': message}"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def dump_json(data) -> str:
+    """Сериализует тело ответа: orjson, если он установлен, иначе стандартный json"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return json.dumps(data)
+
+
+def respond(data, status: int = 200) -> dict:
+    """JSON-ответ функции с общими заголовками"""
+    return {'statusCode': status, 'headers': JSON_HEADERS, 'body': dump_json(data), 'isBase64Encoded': False}
+
+
+def parse_body(event: dict) -> dict:
+    """Разбирает JSON-тело запроса; ApiError 400, если это не JSON-объект"""
+    raw = event.get('body') or '{}'
+    try:
+        body = orjson.loads(raw) if orjson is not None else json.loads(raw)
+    except ValueError as e:
+        raise ApiError(400, 'Некорректный JSON в теле запроса') from e
+    if not isinstance(body, dict):
+        raise ApiError(400, 'Тело запроса должно быть JSON-объектом')
+    return body
+
+
+REQUEST_METRICS = os.environ.get('REQUEST_METRICS', 'false').lower() == 'true'
+REQUEST_METRICS_HISTOGRAM = os.environ.get('REQUEST_METRICS_HISTOGRAM', 'false').lower() == 'true'
+REQUEST_METRICS_FLUSH_EVERY = int(os.environ.get('REQUEST_METRICS_FLUSH_EVERY', '100'))
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_latency_histogram = {}
+_histogram_requests = 0
+
+
+class MetricsCursor(psycopg2.extensions.cursor):
+    """Курсор, который считает запросы, время в БД и строки результата.
+
+    Выдаётся роутером только при REQUEST_METRICS=true; без него обработчики
+    получают обычный курсор и не платят за учёт.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queries = 0
+        self.db_time = 0.0
+        self.rows = 0
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            if self.description is not None and self.rowcount > 0:
+                self.rows += self.rowcount
+
+
+def observe_latency(action: str, wall_ms: float) -> None:
+    """Кладёт время запроса в гистограмму контейнера и раз в
+    REQUEST_METRICS_FLUSH_EVERY запросов пишет её в лог и обнуляет"""
+    global _histogram_requests
+    buckets = _latency_histogram.get(action)
+    if buckets is None:
+        buckets = _latency_histogram[action] = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+    buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, wall_ms)] += 1
+    _histogram_requests += 1
     
-    if method == 'OPTIONS':
-        return {
+    if _histogram_requests >= REQUEST_METRICS_FLUSH_EVERY:
+        print(dump_json({
+            'metric': 'latency_histogram',
+            'buckets_ms': LATENCY_BUCKETS_MS,
+            'actions': _latency_histogram
+        }))
+        _latency_histogram.clear()
+        _histogram_requests = 0
+
+
+def record_request(action: str, cur, response, elapsed: float) -> None:
+    """Пишет структурированную строку метрик запроса в лог функции"""
+    body = (response.get('body') or '') if response else ''
+    wall_ms = elapsed * 1000
+    print(dump_json({
+        'metric': 'request',
+        'action': action,
+        'status': response['statusCode'] if response else 500,
+        'wall_ms': round(wall_ms, 2),
+        'db_ms': round(cur.db_time * 1000, 2),
+        'queries': cur.queries,
+        'rows': cur.rows,
+        'response_bytes': len(body.encode('utf-8'))
+    }))
+    if REQUEST_METRICS_HISTOGRAM:
+        observe_latency(action, wall_ms)
+
+
+class Router:
+    """Диспетчер функции: (метод, action) запроса → обработчик действия.
+
+    routes — {метод: {action: обработчик}}, ключ '*' принимает остальные
+    action метода; default_actions — action для запросов без него.
+    Обработчик получает (cur, session, args), где args — параметры строки
+    запроса для GET и JSON-тело для остальных методов. Preflight и ответ 405
+    собираются один раз при создании роутера.
+    """
+
+    def __init__(self, routes: dict, default_actions: dict):
+        self.routes = routes
+        self.default_actions = default_actions
+        self.preflight = {
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Methods': ', '.join([*routes, 'OPTIONS']),
+                'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Auth-Token, X-User-Id',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
             'isBase64Encoded': False
         }
-    
-    db_url = os.environ['DATABASE_URL']
-    
-    conn = psycopg2.connect(db_url)
-    conn.set_session(autocommit=True)
-    cur = conn.cursor()
-    
-    try:
+        self.not_allowed = respond({'error': 'Метод не поддерживается'}, 405)
+
+    def resolve(self, method: str, args: dict):
+        """Находит (action, обработчик) для метода и action; None, если такого нет.
+
+        Запрос, попавший в '*', получает action по умолчанию для метода, чтобы
+        метрики не размножались по произвольным значениям из запроса.
+        """
+        actions = self.routes.get(method)
+        if actions is None:
+            return None
+        action = args.get('action') or self.default_actions.get(method)
+        if isinstance(action, str) and action in actions:
+            return action, actions[action]
+        if '*' in actions:
+            return self.default_actions.get(method, '*'), actions['*']
+        return None
+
+    def __call__(self, event: dict) -> dict:
+        # Время запроса включает разбор тела и получение соединения из пула
+        started = time.perf_counter()
+        method = event.get('httpMethod', 'GET')
+        if method == 'OPTIONS':
+            return self.preflight
+        if method not in self.routes:
+            return self.not_allowed
         
-        if method == 'GET':
-            action = event.get('queryStringParameters', {}).get('action', 'chats')
-            user_id = event.get('queryStringParameters', {}).get('user_id')
-            
-            if action == 'chats':
-                cur.execute("""
-                    SELECT DISTINCT
-                        c.id,
-                        u.id, u.full_name, u.username, u.avatar_url,
-                        m.content, m.created_at,
-                        COUNT(CASE WHEN m2.is_read = FALSE AND m2.sender_id != %s THEN 1 END) as unread_count
-                    FROM chats c
-                    JOIN chat_participants cp1 ON c.id = cp1.chat_id
-                    JOIN chat_participants cp2 ON c.id = cp2.chat_id AND cp2.user_id != cp1.user_id
-                    JOIN users u ON cp2.user_id = u.id
-                    LEFT JOIN LATERAL (
-                        SELECT content, created_at, sender_id
-                        FROM messages
-                        WHERE chat_id = c.id
-                        ORDER BY created_at DESC
-                        LIMIT 1
-                    ) m ON TRUE
-                    LEFT JOIN messages m2 ON c.id = m2.chat_id
-                    WHERE cp1.user_id = %s
-                    GROUP BY c.id, u.id, m.content, m.created_at
-                    ORDER BY m.created_at DESC NULLS LAST
-                """, (user_id, user_id))
-                
-                chats = []
-                for row in cur.fetchall():
-                    chats.append({
-                        'id': row[0],
-                        'user': {
-                            'id': row[1],
-                            'full_name': row[2],
-                            'username': row[3],
-                            'avatar_url': row[4]
-                        },
-                        'last_message': row[5],
-                        'last_message_time': row[6].isoformat() if row[6] else None,
-                        'unread_count': row[7]
-                    })
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'chats': chats}),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'messages':
-                chat_id = event.get('queryStringParameters', {}).get('chat_id')
-                
-                cur.execute("""
-                    SELECT 
-                        m.id, m.content, m.created_at, m.is_read,
-                        u.id, u.full_name, u.avatar_url
-                    FROM messages m
-                    JOIN users u ON m.sender_id = u.id
-                    WHERE m.chat_id = %s
-                    ORDER BY m.created_at ASC
-                """, (chat_id,))
-                
-                messages = []
-                for row in cur.fetchall():
-                    messages.append({
-                        'id': row[0],
-                        'content': row[1],
-                        'created_at': row[2].isoformat() if row[2] else None,
-                        'is_read': row[3],
-                        'sender': {
-                            'id': row[4],
-                            'full_name': row[5],
-                            'avatar_url': row[6]
-                        }
-                    })
-                
-                cur.execute(
-                    "UPDATE messages SET is_read = TRUE WHERE chat_id = %s AND sender_id != %s",
-                    (chat_id, user_id)
-                )
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'messages': messages}),
-                    'isBase64Encoded': False
-                }
+        try:
+            args = (event.get('queryStringParameters') or {}) if method == 'GET' else parse_body(event)
+        except ApiError as e:
+            return respond({'error': e.message}, e.status)
         
-        elif method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            action = body.get('action')
-            
-            if action == 'create_chat':
-                user1_id = body.get('user1_id')
-                user2_id = body.get('user2_id')
-                
-                cur.execute("""
-                    SELECT c.id 
-                    FROM chats c
-                    JOIN chat_participants cp1 ON c.id = cp1.chat_id AND cp1.user_id = %s
-                    JOIN chat_participants cp2 ON c.id = cp2.chat_id AND cp2.user_id = %s
-                """, (user1_id, user2_id))
-                
-                existing_chat = cur.fetchone()
-                
-                if existing_chat:
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'chat_id': existing_chat[0]}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute("INSERT INTO chats DEFAULT VALUES RETURNING id")
-                chat_id = cur.fetchone()[0]
-                
-                cur.execute(
-                    "INSERT INTO chat_participants (chat_id, user_id) VALUES (%s, %s), (%s, %s)",
-                    (chat_id, user1_id, chat_id, user2_id)
-                )
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'chat_id': chat_id}),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'send':
-                chat_id = body.get('chat_id')
-                sender_id = body.get('sender_id')
-                content = body.get('content', '').strip()
-                
-                if not content:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Сообщение не может быть пустым'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute(
-                    "INSERT INTO messages (chat_id, sender_id, content) VALUES (%s, %s, %s) RETURNING id, created_at",
-                    (chat_id, sender_id, content)
-                )
-                message = cur.fetchone()
-                
-                cur.execute("""
-                    SELECT user_id 
-                    FROM chat_participants 
-                    WHERE chat_id = %s AND user_id != %s
-                """, (chat_id, sender_id))
-                
-                recipient = cur.fetchone()
-                if recipient:
-                    cur.execute(
-                        "INSERT INTO notifications (user_id, type, content, related_user_id) VALUES (%s, %s, %s, %s)",
-                        (recipient[0], 'message', 'отправил вам сообщение', sender_id)
-                    )
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'success': True,
-                        'message_id': message[0],
-                        'created_at': message[1].isoformat() if message[1] else None
-                    }),
-                    'isBase64Encoded': False
-                }
+        resolved = self.resolve(method, args)
+        if resolved is None:
+            return self.not_allowed
+        action, route = resolved
         
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Метод не поддерживается'}),
-            'isBase64Encoded': False
-        }
+        conn = get_connection()
+        cur = conn.cursor(cursor_factory=MetricsCursor) if REQUEST_METRICS else conn.cursor()
+        response = None
+        
+        try:
+            session = read_session(event, cur)
+            response = route(cur, session, args)
+        
+        except ApiError as e:
+            response = respond({'error': e.message}, e.status)
+        
+        except InvalidSession:
+            response = respond({'error': 'Сессия недействительна, войдите заново'}, 401)
+        
+        except psycopg2.DataError:
+            # Значение из запроса не приводится к типу колонки, например id='abc'
+            response = respond({'error': 'Некорректные параметры запроса'}, 400)
+        
+        finally:
+            cur.close()
+            release_connection(conn)
+            if REQUEST_METRICS:
+                record_request(action, cur, response, time.perf_counter() - started)
+        
+        return response
+
+
+def get_chats(cur, session, params) -> dict:
+    """Чаты пользователя по курсору (last_message_at, id) с последним сообщением и числом непрочитанных"""
+    user_id = session_user_id(session, params.get('user_id'))
+    limit = parse_limit(params.get('limit'), CHATS_PAGE_SIZE, CHATS_MAX_PAGE_SIZE)
+    cursor = params.get('cursor')
+    
+    if cursor:
+        try:
+            cursor_at, cursor_id = decode_cursor(cursor)
+        except ValueError as e:
+            raise ApiError(400, str(e)) from e
+        page_filter = "AND (cp1.last_message_at, cp1.chat_id) < (%s, %s)"
+        page_params = (cursor_at, cursor_id)
+    else:
+        page_filter = ""
+        page_params = ()
+    
+    # Страница берётся прямо из индекса участника (user_id, last_message_at, chat_id),
+    # собеседник, последнее сообщение и счётчик — только для неё
+    cur.execute(f"""
+        WITH page AS (
+            SELECT c.id, c.last_message_id, cp1.last_message_at, cp1.user_id, cp1.last_read_message_id
+            FROM (
+                SELECT cp1.chat_id, cp1.user_id, cp1.last_message_at, cp1.last_read_message_id
+                FROM chat_participants cp1
+                WHERE cp1.user_id = %s {page_filter}
+                ORDER BY cp1.last_message_at DESC, cp1.chat_id DESC
+                LIMIT %s
+            ) cp1
+            JOIN chats c ON c.id = cp1.chat_id
+        )
+        SELECT
+            pg.id,
+            u.id, u.full_name, u.username, u.avatar_url,
+            m.content, m.created_at,
+            unread.unread_count,
+            pg.last_message_at
+        FROM page pg
+        JOIN chat_participants cp2 ON cp2.chat_id = pg.id AND cp2.user_id != pg.user_id
+        JOIN users u ON cp2.user_id = u.id
+        LEFT JOIN messages m ON m.id = pg.last_message_id
+        CROSS JOIN LATERAL (
+            SELECT COUNT(*) AS unread_count
+            FROM messages
+            WHERE chat_id = pg.id
+              AND id > pg.last_read_message_id
+              AND sender_id != pg.user_id
+        ) unread
+        ORDER BY pg.last_message_at DESC, pg.id DESC
+    """, (user_id, *page_params, limit + 1))
+    
+    rows = cur.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
     
-    finally:
-        cur.close()
-        conn.close()
\ No newline at end of file
+    chats = []
+    for row in rows:
+        chats.append({
+            'id': row[0],
+            'user': {
+                'id': row[1],
+                'full_name': row[2],
+                'username': row[3],
+                'avatar_url': row[4]
+            },
+            'last_message': row[5],
+            'last_message_time': row[6].isoformat() if row[6] else None,
+            'unread_count': row[7]
+        })
+    
+    next_cursor = encode_cursor(rows[-1][8], rows[-1][0]) if has_more else None
+    
+    return respond({'chats': chats, 'next_cursor': next_cursor})
+
+
+def get_messages(cur, session, params) -> dict:
+    """Сообщения чата после since_id или до before_id; сдвигает курсор прочтения"""
+    user_id = session_user_id(session, params.get('user_id'))
+    chat_id = params.get('chat_id')
+    since_id = params.get('since_id')
+    before_id = params.get('before_id')
+    limit = parse_limit(params.get('limit'), MESSAGES_PAGE_SIZE, MESSAGES_MAX_PAGE_SIZE)
+    
+    if since_id:
+        page_filter, page_order, page_params = "AND m.id > %s", "ASC", (since_id,)
+    elif before_id:
+        page_filter, page_order, page_params = "AND m.id < %s", "DESC", (before_id,)
+    else:
+        page_filter, page_order, page_params = "", "DESC", ()
+    
+    # Сообщение прочитано, если его id не больше курсора прочтения получателя
+    cur.execute(f"""
+        SELECT 
+            m.id, m.content, m.created_at,
+            m.id <= CASE WHEN m.sender_id = %s THEN r.other_read ELSE r.my_read END,
+            u.id, u.full_name, u.avatar_url
+        FROM messages m
+        JOIN users u ON m.sender_id = u.id
+        CROSS JOIN (
+            SELECT
+                COALESCE(MAX(last_read_message_id) FILTER (WHERE user_id = %s), 0) AS my_read,
+                COALESCE(MAX(last_read_message_id) FILTER (WHERE user_id != %s), 0) AS other_read
+            FROM chat_participants
+            WHERE chat_id = %s
+        ) r
+        WHERE m.chat_id = %s {page_filter}
+        ORDER BY m.id {page_order}
+        LIMIT %s
+    """, (user_id, user_id, user_id, chat_id, chat_id, *page_params, limit + 1))
+    
+    rows = cur.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if page_order == "DESC":
+        rows.reverse()
+    
+    messages = []
+    for row in rows:
+        messages.append({
+            'id': row[0],
+            'content': row[1],
+            'created_at': row[2].isoformat() if row[2] else None,
+            'is_read': row[3],
+            'sender': {
+                'id': row[4],
+                'full_name': row[5],
+                'avatar_url': row[6]
+            }
+        })
+    
+    if rows:
+        cur.execute(
+            "UPDATE chat_participants SET last_read_message_id = %s WHERE chat_id = %s AND user_id = %s AND last_read_message_id < %s",
+            (rows[-1][0], chat_id, user_id, rows[-1][0])
+        )
+    
+    return respond({'messages': messages, 'has_more': has_more})
+
+
+def create_chat(cur, session, body) -> dict:
+    """Возвращает существующий чат двух пользователей или создаёт новый"""
+    user1_id = session_user_id(session, body.get('user1_id'))
+    user2_id = body.get('user2_id')
+    
+    cur.execute("""
+        SELECT c.id 
+        FROM chats c
+        JOIN chat_participants cp1 ON c.id = cp1.chat_id AND cp1.user_id = %s
+        JOIN chat_participants cp2 ON c.id = cp2.chat_id AND cp2.user_id = %s
+    """, (user1_id, user2_id))
+    
+    existing_chat = cur.fetchone()
+    
+    if existing_chat:
+        return respond({'chat_id': existing_chat[0]})
+    
+    cur.execute("INSERT INTO chats DEFAULT VALUES RETURNING id")
+    chat_id = cur.fetchone()[0]
+    
+    cur.execute(
+        "INSERT INTO chat_participants (chat_id, user_id) VALUES (%s, %s), (%s, %s)",
+        (chat_id, user1_id, chat_id, user2_id)
+    )
+    
+    return respond({'chat_id': chat_id})
+
+
+def send_message(cur, session, body) -> dict:
+    """Отправляет сообщение и кладёт уведомление собеседнику в очередь"""
+    chat_id = body.get('chat_id')
+    sender_id = session_user_id(session, body.get('sender_id'))
+    content = body.get('content', '').strip()
+    
+    if not content:
+        raise ApiError(400, 'Сообщение не может быть пустым')
+    
+    event = {'type': 'message', 'chat_id': chat_id, 'sender_id': sender_id}
+    cur.execute("""
+        WITH new_message AS (
+            INSERT INTO messages (chat_id, sender_id, content)
+            VALUES (%s, %s, %s)
+            RETURNING id, chat_id, created_at
+        ), touched_chat AS (
+            UPDATE chats c
+            SET last_message_id = nm.id, last_message_at = nm.created_at
+            FROM new_message nm
+            WHERE c.id = nm.chat_id
+              -- При конкурентной отправке в один чат более раннее сообщение,
+              -- дождавшись блокировки строки, не должно затереть более позднее
+              AND (c.last_message_id IS NULL OR c.last_message_id < nm.id)
+            RETURNING c.id, nm.created_at
+        ), touched_participants AS (
+            -- Копия last_message_at для списка чатов; двигается только вслед за
+            -- чатом, строку которого запрос уже держит
+            UPDATE chat_participants cp
+            SET last_message_at = tc.created_at
+            FROM touched_chat tc
+            WHERE cp.chat_id = tc.id
+        ), queued AS (
+            INSERT INTO notification_outbox (user_id, type, content, related_user_id, group_key)
+            SELECT cp.user_id, 'message', 'отправил вам сообщение', %s, %s
+            FROM chat_participants cp
+            JOIN new_message nm ON cp.chat_id = nm.chat_id
+            WHERE cp.user_id != %s
+            RETURNING user_id
+        )
+        SELECT nm.id, nm.created_at, (
+            SELECT pg_notify(%s || q.user_id, (%s::jsonb || jsonb_build_object('message_id', nm.id))::text)
+            FROM queued q
+            LIMIT 1
+        )
+        FROM new_message nm
+    """, (chat_id, sender_id, content, sender_id, f'message:{chat_id}', sender_id,
+          EVENT_CHANNEL_PREFIX, json.dumps(event)))
+    message = cur.fetchone()
+    
+    return respond({
+        'success': True,
+        'message_id': message[0],
+        'created_at': message[1].isoformat() if message[1] else None
+    })
+
+
+ROUTER = Router(
+    {
+        'GET': {
+            'chats': get_chats,
+            'messages': get_messages
+        },
+        'POST': {
+            'create_chat': create_chat,
+            'send': send_message
+        }
+    },
+    {'GET': 'chats'}
+)
+
+
+def handler(event: dict, context) -> dict:
+    """API для управления сообщениями и чатами"""
+    return ROUTER(event)
@@ -1,109 +1,875 @@
+import base64
+import bisect
+import hashlib
+import hmac
 import json
 import os
+import re
+import select
+import time
 import psycopg2
+from psycopg2 import pool, sql
+from datetime import date, datetime, timedelta
 
-def handler(event: dict, context) -> dict:
-    """API для управления уведомлениями"""
-    method = event.get('httpMethod', 'GET')
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', '30'))
+
+_pool = None
+_last_used = {}
+
+
+def get_connection():
+    """Выдаёт соединение из пула контейнера, переживающего тёплые вызовы.
+
+    Соединение, простаивавшее дольше DB_POOL_CHECK_AFTER секунд, проверяется
+    запросом SELECT 1; закрытые и отвалившиеся соединения выбрасываются
+    из пула и заменяются новыми.
+    """
+    global _pool
+    if _pool is None:
+        _pool = pool.ThreadedConnectionPool(DB_POOL_SIZE, DB_POOL_MAX_SIZE, os.environ['DATABASE_URL'])
+    
+    for _ in range(DB_POOL_MAX_SIZE + 1):
+        conn = _pool.getconn()
+        last_used = _last_used.pop(id(conn), None)
+        
+        if not conn.closed and last_used is not None and time.monotonic() - last_used > DB_POOL_CHECK_AFTER:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+            except psycopg2.Error:
+                conn.close()
+        
+        if conn.closed:
+            _pool.putconn(conn, close=True)
+            continue
+        
+        if not conn.autocommit:
+            conn.set_session(autocommit=True)
+        return conn
+    
+    raise psycopg2.OperationalError('Не удалось получить рабочее соединение с базой данных')
+
+
+def release_connection(conn) -> None:
+    """Возвращает соединение в пул; пул сам откатывает незавершённые транзакции"""
+    _pool.putconn(conn)
+    if not conn.closed:
+        _last_used[id(conn)] = time.monotonic()
+
+
+POLL_DEFAULT_TIMEOUT = 25.0
+POLL_MAX_TIMEOUT = float(os.environ.get('POLL_MAX_TIMEOUT', '25'))
+POLL_BATCH_WINDOW = 0.05
+POLL_CATCHUP_LIMIT = 50
+
+
+NOTIFICATIONS_PAGE_SIZE = 50
+NOTIFICATIONS_MAX_PAGE_SIZE = 100
+OUTBOX_BATCH_SIZE = 500
+OUTBOX_MAX_BATCH_SIZE = 5000
+OUTBOX_USER_BATCH_SIZE = 200
+# Первый ключ advisory-блокировки получателя на время слияния его событий
+OUTBOX_MERGE_LOCK = 1
+NOTIFICATIONS_RETENTION_DAYS = int(os.environ.get('NOTIFICATIONS_RETENTION_DAYS', '90'))
+NOTIFICATIONS_ARCHIVE = os.environ.get('NOTIFICATIONS_ARCHIVE', 'false').lower() == 'true'
+NOTIFICATIONS_MONTHS_AHEAD = 3
+PARTITION_NAME = re.compile(r'^notifications_(\d{4})_(\d{2})$')
+
+# Канал LISTEN/NOTIFY пользователя: префикс + id получателя
+EVENT_CHANNEL_PREFIX = 'user_events_'
+
+
+def event_channel(user_id) -> str:
+    """Канал LISTEN/NOTIFY, в который публикуются события пользователя"""
+    return f"{EVENT_CHANNEL_PREFIX}{int(user_id)}"
+
+
+def encode_cursor(created_at, notification_id: int) -> str:
+    """Упаковывает позицию (created_at, id) последнего уведомления в непрозрачный курсор"""
+    raw = f"{created_at.isoformat()}|{notification_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Распаковывает курсор списка; ValueError, если курсор повреждён"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        created_at, notification_id = raw.split('|')
+        return datetime.fromisoformat(created_at), int(notification_id)
+    except (UnicodeError, ValueError) as e:
+        raise ValueError('Некорректный курсор') from e
+
+
+def parse_limit(value, default: int, maximum: int) -> int:
+    """Приводит параметр limit к числу в пределах [1, maximum]"""
+    try:
+        limit = int(value) if value is not None else default
+    except (TypeError, ValueError):
+        limit = default
+    return max(1, min(limit, maximum))
+
+
+def merge_outbox_events(cur, batch_query: str, batch_params: tuple) -> tuple:
+    """Переносит события очереди, выбранные batch_query, в notifications.
+
+    События одной группы (group_key: лайки одного поста, сообщения одного
+    чата) схлопываются в одно уведомление, а если у получателя уже есть
+    непрочитанное уведомление этой группы, увеличивается его group_count.
+    Вызывается в транзакции, держащей advisory-блокировку каждого получателя
+    пачки: иначе два разбора разных событий одной группы не видели бы
+    незакоммиченных вставок друг друга и создали бы два непрочитанных
+    уведомления группы. Уникальный индекс тут не помог бы: на секционированной
+    таблице он обязан включать created_at.
+    Возвращает (обработано событий, обновлено уведомлений, создано уведомлений).
+    """
+    cur.execute(f"""
+        WITH batch AS (
+            DELETE FROM notification_outbox
+            WHERE id IN ({batch_query})
+            RETURNING *
+        ), grouped AS (
+            SELECT
+                user_id, type, group_key,
+                COUNT(*) AS event_count,
+                (array_agg(content ORDER BY id DESC))[1] AS content,
+                (array_agg(related_user_id ORDER BY id DESC))[1] AS related_user_id,
+                (array_agg(related_post_id ORDER BY id DESC))[1] AS related_post_id,
+                MAX(created_at) AS created_at
+            FROM batch
+            GROUP BY user_id, type, group_key
+        ), merged AS (
+            -- created_at и id не меняются, чтобы строка не сдвигалась относительно
+            -- курсора списка; для догоняющего poll слияние получает новый номер
+            -- из последовательности id в update_seq
+            UPDATE notifications n
+            SET group_count = n.group_count + g.event_count,
+                content = g.content,
+                related_user_id = g.related_user_id,
+                update_seq = nextval('notifications_id_seq')
+            FROM grouped g
+            WHERE n.user_id = g.user_id AND n.group_key = g.group_key AND n.is_read = FALSE
+            RETURNING n.user_id, n.group_key
+        ), inserted AS (
+            INSERT INTO notifications (user_id, type, content, related_user_id, related_post_id, group_key, group_count, created_at)
+            SELECT g.user_id, g.type, g.content, g.related_user_id, g.related_post_id, g.group_key, g.event_count, g.created_at
+            FROM grouped g
+            WHERE NOT EXISTS (
+                SELECT 1 FROM merged m
+                WHERE m.user_id = g.user_id AND m.group_key = g.group_key
+            )
+            RETURNING id
+        )
+        SELECT (SELECT COUNT(*) FROM batch), (SELECT COUNT(*) FROM merged), (SELECT COUNT(*) FROM inserted)
+    """, batch_params)
+    return cur.fetchone()
+
+
+def drain_outbox(cur, batch_size: int, user_id: int) -> tuple:
+    """Переносит в notifications пачку событий одного получателя перед чтением его уведомлений.
+
+    Пустая очередь получателя проверяется одним чтением индекса
+    idx_notification_outbox_user_id, без транзакции и блокировки.
+    """
+    cur.execute("SELECT EXISTS (SELECT 1 FROM notification_outbox WHERE user_id = %s)", (user_id,))
+    if not cur.fetchone()[0]:
+        return 0, 0, 0
+    
+    conn = cur.connection
+    conn.autocommit = False
+    try:
+        cur.execute("SELECT pg_advisory_xact_lock(%s, %s)", (OUTBOX_MERGE_LOCK, user_id))
+        counts = merge_outbox_events(cur, """
+            SELECT id FROM notification_outbox
+            WHERE user_id = %s
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (user_id, batch_size))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = True
+    return counts
+
+
+def drain_outbox_batch(cur, batch_size: int) -> tuple:
+    """Переносит в notifications пачку событий всех получателей — работа воркера очереди"""
+    conn = cur.connection
+    conn.autocommit = False
+    try:
+        cur.execute("""
+            SELECT id, user_id FROM notification_outbox
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (batch_size,))
+        rows = cur.fetchall()
+        # Блокировки берутся по возрастанию user_id, чтобы воркеры не ждали друг друга по кругу
+        recipients = sorted({row[1] for row in rows})
+        cur.execute(
+            "SELECT pg_advisory_xact_lock(%s, user_id) FROM unnest(%s::int[]) AS user_id",
+            (OUTBOX_MERGE_LOCK, recipients)
+        )
+        counts = merge_outbox_events(cur, "SELECT unnest(%s::bigint[])", ([row[0] for row in rows],))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = True
+    return counts
+
+
+def notification_item(row) -> dict:
+    """Собирает уведомление из строки (id, type, content, is_read, created_at, автор..., group_count)"""
+    return {
+        'id': row[0],
+        'type': row[1],
+        'content': row[2],
+        'is_read': row[3],
+        'created_at': row[4].isoformat() if row[4] else None,
+        'user': {
+            'id': row[5],
+            'full_name': row[6],
+            'avatar_url': row[7]
+        },
+        'group_count': row[8]
+    }
+
+
+def wait_for_events(conn, timeout: float) -> list:
+    """Ждёт NOTIFY на уже подписанном соединении не дольше timeout секунд.
+
+    После первого события ещё POLL_BATCH_WINDOW секунд дочитывает пачку,
+    чтобы серия событий ушла клиенту одним ответом.
+    """
+    deadline = time.monotonic() + timeout
+    while not conn.notifies:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        if select.select([conn], [], [], remaining)[0]:
+            conn.poll()
+    
+    if conn.notifies and select.select([conn], [], [], POLL_BATCH_WINDOW)[0]:
+        conn.poll()
+    
+    events = []
+    for notify in conn.notifies:
+        try:
+            events.append(json.loads(notify.payload))
+        except ValueError:
+            continue
+    del conn.notifies[:]
+    return events
+
+
+def expire_notification_partitions(conn, retention_days: int, archive: bool) -> list:
+    """Снимает месячные секции notifications, целиком вышедшие за срок хранения.
+
+    Секция отсоединяется (DETACH PARTITION) и удаляется либо переносится
+    в схему notifications_archive; её непрочитанные уведомления
+    перекладываются в секцию по умолчанию. Каждая секция обрабатывается
+    в отдельной транзакции. Возвращает имена снятых секций.
+    """
+    cutoff = date.today() - timedelta(days=retention_days)
+    
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'notifications'::regclass
+        """)
+        partitions = [row[0] for row in cur.fetchall()]
+    
+    expired = []
+    for name in sorted(partitions):
+        match = PARTITION_NAME.match(name)
+        if not match:
+            continue
+        year, month = int(match.group(1)), int(match.group(2))
+        month_end = date(year + month // 12, month % 12 + 1, 1)
+        if month_end > cutoff:
+            continue
+        
+        conn.autocommit = False
+        try:
+            with conn.cursor() as cur:
+                partition = sql.Identifier(name)
+                cur.execute(sql.SQL("ALTER TABLE notifications DETACH PARTITION {}").format(partition))
+                cur.execute(sql.SQL("""
+                    INSERT INTO notifications (id, user_id, type, content, related_user_id, related_post_id, is_read, created_at, group_key, group_count, update_seq)
+                    SELECT id, user_id, type, content, related_user_id, related_post_id, is_read, created_at, group_key, group_count, update_seq
+                    FROM {} WHERE is_read = FALSE
+                """).format(partition))
+                if archive:
+                    # Отсоединённая партиция сохраняет внешние ключи на users и posts,
+                    # и архив мешал бы удалять пользователей и их посты
+                    cur.execute(
+                        "SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+                        (name,)
+                    )
+                    for (constraint,) in cur.fetchall():
+                        cur.execute(sql.SQL("ALTER TABLE {} DROP CONSTRAINT {}").format(
+                            partition, sql.Identifier(constraint)
+                        ))
+                    cur.execute(sql.SQL("ALTER TABLE {} SET SCHEMA notifications_archive").format(partition))
+                else:
+                    cur.execute(sql.SQL("DROP TABLE {}").format(partition))
+            conn.commit()
+        except psycopg2.Error:
+            conn.rollback()
+            raise
+        finally:
+            conn.autocommit = True
+        expired.append(name)
     
-    if method == 'OPTIONS':
-        return {
+    return expired
+
+
+SESSION_TTL = int(os.environ.get('SESSION_TTL', '900'))
+SESSION_REVOCATION_REFRESH = float(os.environ.get('SESSION_REVOCATION_REFRESH', '30'))
+REQUIRE_SESSION_TOKEN = os.environ.get('REQUIRE_SESSION_TOKEN', 'false').lower() == 'true'
+
+_revoked_sessions = {}
+_revocations_loaded_at = None
+
+
+class InvalidSession(Exception):
+    """Токен сессии подделан, просрочен, отозван или отсутствует там, где обязателен"""
+
+
+def b64url_decode(value: str) -> bytes:
+    """Декодирует base64url, дополняя срезанные '='"""
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+
+def sign_session(payload: str) -> bytes:
+    """HMAC-SHA256 подпись полезной нагрузки токена ключом SESSION_SECRET"""
+    return hmac.new(os.environ['SESSION_SECRET'].encode('utf-8'), payload.encode('ascii'), hashlib.sha256).digest()
+
+
+def load_revocations(cur) -> None:
+    """Обновляет кеш отзывов сессий не чаще раза в SESSION_REVOCATION_REFRESH секунд.
+
+    Хранятся только отзывы моложе SESSION_TTL: более старые токены
+    к этому моменту уже истекли сами.
+    """
+    global _revoked_sessions, _revocations_loaded_at
+    now = time.monotonic()
+    if _revocations_loaded_at is not None and now - _revocations_loaded_at < SESSION_REVOCATION_REFRESH:
+        return
+    cur.execute(
+        "SELECT user_id, EXTRACT(EPOCH FROM revoked_at) FROM session_revocations WHERE revoked_at > CURRENT_TIMESTAMP - make_interval(secs => %s)",
+        (SESSION_TTL,)
+    )
+    _revoked_sessions = {row[0]: float(row[1]) for row in cur.fetchall()}
+    _revocations_loaded_at = now
+
+
+def read_session(event: dict, cur):
+    """Проверяет токен из X-Auth-Token или Authorization: Bearer без запроса к users.
+
+    Возвращает claims токена ({'uid', 'adm', 'ban', 'iat', 'exp'}) или None,
+    если токен не передан; InvalidSession — если токен недействителен.
+    """
+    headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+    token = headers.get('x-auth-token')
+    if not token and headers.get('authorization', '').startswith('Bearer '):
+        token = headers['authorization'][len('Bearer '):]
+    if not token:
+        return None
+    
+    try:
+        payload, signature = token.split('.')
+        if not hmac.compare_digest(sign_session(payload), b64url_decode(signature)):
+            raise InvalidSession()
+        claims = json.loads(b64url_decode(payload))
+    except (ValueError, UnicodeError) as e:
+        raise InvalidSession() from e
+    
+    if claims.get('exp', 0) < time.time() or claims.get('ban'):
+        raise InvalidSession()
+    
+    load_revocations(cur)
+    revoked_at = _revoked_sessions.get(claims['uid'])
+    if revoked_at is not None and claims['iat'] <= revoked_at:
+        raise InvalidSession()
+    return claims
+
+
+def session_user_id(session, fallback):
+    """id пользователя из токена; без токена — id из запроса, пока REQUIRE_SESSION_TOKEN выключен"""
+    if session:
+        return session['uid']
+    if REQUIRE_SESSION_TOKEN:
+        raise InvalidSession()
+    return fallback
+
+
+def recipient_id(session, args: dict) -> int:
+    """id получателя уведомлений из токена или user_id; ApiError 400, если его нет"""
+    try:
+        return int(session_user_id(session, args.get('user_id')))
+    except (TypeError, ValueError) as e:
+        raise ApiError(400, 'Не указан пользователь') from e
+
+
+def require_admin(cur, session, body: dict) -> None:
+    """ApiError 403, если запрос пришёл не от администратора.
+
+    С токеном решает его claim adm; без токена, пока REQUIRE_SESSION_TOKEN
+    выключен, флаг is_admin читается по admin_id из тела запроса.
+    """
+    if session:
+        is_admin = session['adm']
+    else:
+        admin_id = session_user_id(session, body.get('admin_id'))
+        cur.execute("SELECT is_admin FROM users WHERE id = %s", (admin_id,))
+        admin = cur.fetchone()
+        is_admin = bool(admin and admin[0])
+    
+    if not is_admin:
+        raise ApiError(403, 'Доступ запрещён')
+
+
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+
+class ApiError(Exception):
+    """Ошибка запроса: отдаётся клиенту со статусом status и телом {'error': message}"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def dump_json(data) -> str:
+    """Сериализует тело ответа: orjson, если он установлен, иначе стандартный json"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return json.dumps(data)
+
+
+def respond(data, status: int = 200) -> dict:
+    """JSON-ответ функции с общими заголовками"""
+    return {'statusCode': status, 'headers': JSON_HEADERS, 'body': dump_json(data), 'isBase64Encoded': False}
+
+
+def parse_body(event: dict) -> dict:
+    """Разбирает JSON-тело запроса; ApiError 400, если это не JSON-объект"""
+    raw = event.get('body') or '{}'
+    try:
+        body = orjson.loads(raw) if orjson is not None else json.loads(raw)
+    except ValueError as e:
+        raise ApiError(400, 'Некорректный JSON в теле запроса') from e
+    if not isinstance(body, dict):
+        raise ApiError(400, 'Тело запроса должно быть JSON-объектом')
+    return body
+
+
+REQUEST_METRICS = os.environ.get('REQUEST_METRICS', 'false').lower() == 'true'
+REQUEST_METRICS_HISTOGRAM = os.environ.get('REQUEST_METRICS_HISTOGRAM', 'false').lower() == 'true'
+REQUEST_METRICS_FLUSH_EVERY = int(os.environ.get('REQUEST_METRICS_FLUSH_EVERY', '100'))
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_latency_histogram = {}
+_histogram_requests = 0
+
+
+class MetricsCursor(psycopg2.extensions.cursor):
+    """Курсор, который считает запросы, время в БД и строки результата.
+
+    Выдаётся роутером только при REQUEST_METRICS=true; без него обработчики
+    получают обычный курсор и не платят за учёт.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queries = 0
+        self.db_time = 0.0
+        self.rows = 0
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            if self.description is not None and self.rowcount > 0:
+                self.rows += self.rowcount
+
+
+def observe_latency(action: str, wall_ms: float) -> None:
+    """Кладёт время запроса в гистограмму контейнера и раз в
+    REQUEST_METRICS_FLUSH_EVERY запросов пишет её в лог и обнуляет"""
+    global _histogram_requests
+    buckets = _latency_histogram.get(action)
+    if buckets is None:
+        buckets = _latency_histogram[action] = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+    buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, wall_ms)] += 1
+    _histogram_requests += 1
+    
+    if _histogram_requests >= REQUEST_METRICS_FLUSH_EVERY:
+        print(dump_json({
+            'metric': 'latency_histogram',
+            'buckets_ms': LATENCY_BUCKETS_MS,
+            'actions': _latency_histogram
+        }))
+        _latency_histogram.clear()
+        _histogram_requests = 0
+
+
+def record_request(action: str, cur, response, elapsed: float) -> None:
+    """Пишет структурированную строку метрик запроса в лог функции"""
+    body = (response.get('body') or '') if response else ''
+    wall_ms = elapsed * 1000
+    print(dump_json({
+        'metric': 'request',
+        'action': action,
+        'status': response['statusCode'] if response else 500,
+        'wall_ms': round(wall_ms, 2),
+        'db_ms': round(cur.db_time * 1000, 2),
+        'queries': cur.queries,
+        'rows': cur.rows,
+        'response_bytes': len(body.encode('utf-8'))
+    }))
+    if REQUEST_METRICS_HISTOGRAM:
+        observe_latency(action, wall_ms)
+
+
+class Router:
+    """Диспетчер функции: (метод, action) запроса → обработчик действия.
+
+    routes — {метод: {action: обработчик}}, ключ '*' принимает остальные
+    action метода; default_actions — action для запросов без него.
+    Обработчик получает (cur, session, args), где args — параметры строки
+    запроса для GET и JSON-тело для остальных методов. Preflight и ответ 405
+    собираются один раз при создании роутера.
+    """
+
+    def __init__(self, routes: dict, default_actions: dict):
+        self.routes = routes
+        self.default_actions = default_actions
+        self.preflight = {
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Methods': ', '.join([*routes, 'OPTIONS']),
+                'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Auth-Token, X-User-Id',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
             'isBase64Encoded': False
         }
+        self.not_allowed = respond({'error': 'Метод не поддерживается'}, 405)
+
+    def resolve(self, method: str, args: dict):
+        """Находит (action, обработчик) для метода и action; None, если такого нет.
+
+        Запрос, попавший в '*', получает action по умолчанию для метода, чтобы
+        метрики не размножались по произвольным значениям из запроса.
+        """
+        actions = self.routes.get(method)
+        if actions is None:
+            return None
+        action = args.get('action') or self.default_actions.get(method)
+        if isinstance(action, str) and action in actions:
+            return action, actions[action]
+        if '*' in actions:
+            return self.default_actions.get(method, '*'), actions['*']
+        return None
+
+    def __call__(self, event: dict) -> dict:
+        # Время запроса включает разбор тела и получение соединения из пула
+        started = time.perf_counter()
+        method = event.get('httpMethod', 'GET')
+        if method == 'OPTIONS':
+            return self.preflight
+        if method not in self.routes:
+            return self.not_allowed
+        
+        try:
+            args = (event.get('queryStringParameters') or {}) if method == 'GET' else parse_body(event)
+        except ApiError as e:
+            return respond({'error': e.message}, e.status)
+        
+        resolved = self.resolve(method, args)
+        if resolved is None:
+            return self.not_allowed
+        action, route = resolved
+        
+        conn = get_connection()
+        cur = conn.cursor(cursor_factory=MetricsCursor) if REQUEST_METRICS else conn.cursor()
+        response = None
+        
+        try:
+            session = read_session(event, cur)
+            response = route(cur, session, args)
+        
+        except ApiError as e:
+            response = respond({'error': e.message}, e.status)
+        
+        except InvalidSession:
+            response = respond({'error': 'Сессия недействительна, войдите заново'}, 401)
+        
+        except psycopg2.DataError:
+            # Значение из запроса не приводится к типу колонки, например id='abc'
+            response = respond({'error': 'Некорректные параметры запроса'}, 400)
+        
+        finally:
+            cur.close()
+            release_connection(conn)
+            if REQUEST_METRICS:
+                record_request(action, cur, response, time.perf_counter() - started)
+        
+        return response
+
+
+def poll_events(cur, session, params) -> dict:
+    """Long-poll: новые уведомления после since_id или события канала пользователя.
+
+    Догоняющий запрос возвращает и новые уведомления, и непрочитанные группы,
+    в которые после since_id слились события, от старых к новым; since_id
+    для следующего запроса приходит в ответе. has_more означает, что
+    пропущенное не уместилось в ответ и опрашивать нужно сразу, без ожидания.
+    """
+    conn = cur.connection
+    user_id = recipient_id(session, params)
+    try:
+        since_id = int(params['since_id']) if params.get('since_id') else None
+    except ValueError as e:
+        raise ApiError(400, 'Некорректный since_id') from e
+    try:
+        timeout = float(params.get('timeout', POLL_DEFAULT_TIMEOUT))
+    except (TypeError, ValueError):
+        timeout = POLL_DEFAULT_TIMEOUT
+    timeout = max(0.0, min(timeout, POLL_MAX_TIMEOUT))
     
-    db_url = os.environ['DATABASE_URL']
-    
-    conn = psycopg2.connect(db_url)
-    conn.set_session(autocommit=True)
-    cur = conn.cursor()
-    
+    # Подписываемся до проверки пропущенного, чтобы не потерять
+    # события, пришедшие между проверкой и ожиданием
+    del conn.notifies[:]
+    cur.execute(sql.SQL("LISTEN {}").format(sql.Identifier(event_channel(user_id))))
     try:
-        
-        if method == 'GET':
-            user_id = event.get('queryStringParameters', {}).get('user_id')
-            
+        notifications = []
+        next_since_id = since_id
+        has_more = False
+        if since_id is not None:
+            drain_outbox(cur, OUTBOX_USER_BATCH_SIZE, user_id)
+            # Слияние трогает только непрочитанные строки, так что вторая
+            # половина читается по частичному индексу непрочитанных
             cur.execute("""
                 SELECT 
                     n.id, n.type, n.content, n.is_read, n.created_at,
-                    u.id, u.full_name, u.avatar_url
+                    u.id, u.full_name, u.avatar_url, n.group_count,
+                    GREATEST(n.id, n.update_seq) AS seq
                 FROM notifications n
                 JOIN users u ON n.related_user_id = u.id
-                WHERE n.user_id = %s
-                ORDER BY n.created_at DESC
-                LIMIT 50
-            """, (user_id,))
-            
-            notifications = []
-            for row in cur.fetchall():
-                notifications.append({
-                    'id': row[0],
-                    'type': row[1],
-                    'content': row[2],
-                    'is_read': row[3],
-                    'created_at': row[4].isoformat() if row[4] else None,
-                    'user': {
-                        'id': row[5],
-                        'full_name': row[6],
-                        'avatar_url': row[7]
-                    }
-                })
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'notifications': notifications}),
-                'isBase64Encoded': False
-            }
-        
-        elif method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            action = body.get('action')
-            
-            if action == 'mark_read':
-                notification_id = body.get('notification_id')
-                
-                cur.execute(
-                    "UPDATE notifications SET is_read = TRUE WHERE id = %s",
-                    (notification_id,)
-                )
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'mark_all_read':
-                user_id = body.get('user_id')
-                
-                cur.execute(
-                    "UPDATE notifications SET is_read = TRUE WHERE user_id = %s",
-                    (user_id,)
-                )
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
-                    'isBase64Encoded': False
-                }
+                WHERE n.user_id = %s AND n.id > %s
+                UNION
+                SELECT 
+                    n.id, n.type, n.content, n.is_read, n.created_at,
+                    u.id, u.full_name, u.avatar_url, n.group_count,
+                    GREATEST(n.id, n.update_seq) AS seq
+                FROM notifications n
+                JOIN users u ON n.related_user_id = u.id
+                WHERE n.user_id = %s AND n.is_read = FALSE AND n.update_seq > %s
+                ORDER BY seq ASC
+                LIMIT %s
+            """, (user_id, since_id, user_id, since_id, POLL_CATCHUP_LIMIT + 1))
+            rows = cur.fetchall()
+            has_more = len(rows) > POLL_CATCHUP_LIMIT
+            rows = rows[:POLL_CATCHUP_LIMIT]
+            notifications = [notification_item(row) for row in rows]
+            if rows:
+                next_since_id = rows[-1][9]
         
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Метод не поддерживается'}),
-            'isBase64Encoded': False
-        }
-    
+        events = [] if notifications else wait_for_events(conn, timeout)
     finally:
-        cur.close()
-        conn.close()
\ No newline at end of file
+        cur.execute("UNLISTEN *")
+        del conn.notifies[:]
+    
+    return respond({
+        'events': events,
+        'notifications': notifications,
+        'since_id': next_since_id,
+        'has_more': has_more
+    })
+
+
+def get_unread_count(cur, session, params) -> dict:
+    """Число непрочитанных уведомлений по частичному индексу.
+
+    Сначала разбирается очередь самого получателя, иначе новые события
+    не попали бы в счётчик без отдельного воркера.
+    """
+    user_id = recipient_id(session, params)
+    drain_outbox(cur, OUTBOX_USER_BATCH_SIZE, user_id)
+    cur.execute(
+        "SELECT COUNT(*) FROM notifications WHERE user_id = %s AND is_read = FALSE",
+        (user_id,)
+    )
+    
+    return respond({'unread_count': cur.fetchone()[0]})
+
+
+def mark_read(cur, session, body) -> dict:
+    """Отмечает прочитанным одно уведомление получателя; чужое или несуществующее — 404"""
+    user_id = recipient_id(session, body)
+    try:
+        notification_id = int(body['notification_id'])
+    except (KeyError, TypeError, ValueError) as e:
+        raise ApiError(400, 'Укажите notification_id') from e
+    
+    # Уже прочитанное уведомление не переписывается, но и не считается ненайденным
+    cur.execute("""
+        WITH target AS (
+            SELECT id, created_at, is_read FROM notifications
+            WHERE id = %s AND user_id = %s
+        ), updated AS (
+            UPDATE notifications n SET is_read = TRUE
+            FROM target t
+            WHERE n.id = t.id AND n.created_at = t.created_at AND n.user_id = %s AND NOT t.is_read
+        )
+        SELECT EXISTS (SELECT 1 FROM target)
+    """, (notification_id, user_id, user_id))
+    if not cur.fetchone()[0]:
+        raise ApiError(404, 'Уведомление не найдено')
+    
+    return respond({'success': True})
+
+
+def mark_all_read(cur, session, body) -> dict:
+    """Отмечает прочитанными все уведомления пользователя"""
+    user_id = session_user_id(session, body.get('user_id'))
+    
+    cur.execute(
+        "UPDATE notifications SET is_read = TRUE WHERE user_id = %s AND is_read = FALSE",
+        (user_id,)
+    )
+    
+    return respond({'success': True})
+
+
+def maintain_partitions(cur, session, body) -> dict:
+    """Создаёт партиции уведомлений наперёд и убирает устаревшие"""
+    require_admin(cur, session, body)
+    conn = cur.connection
+    cur.execute(
+        "SELECT ensure_notification_partitions(CURRENT_DATE, %s)",
+        (NOTIFICATIONS_MONTHS_AHEAD,)
+    )
+    created_count = cur.fetchone()[0]
+    
+    expired = expire_notification_partitions(conn, NOTIFICATIONS_RETENTION_DAYS, NOTIFICATIONS_ARCHIVE)
+    
+    cur.execute(
+        "DELETE FROM notifications_default WHERE is_read = TRUE AND created_at < CURRENT_TIMESTAMP - make_interval(days => %s)",
+        (NOTIFICATIONS_RETENTION_DAYS,)
+    )
+    
+    return respond({
+        'success': True,
+        'created_partitions': created_count,
+        'expired_partitions': expired,
+        'archived': NOTIFICATIONS_ARCHIVE,
+        'purged_default_rows': cur.rowcount
+    })
+
+
+def process_outbox(cur, session, body) -> dict:
+    """Разбирает пачку очереди уведомлений"""
+    require_admin(cur, session, body)
+    try:
+        batch_size = int(body.get('batch_size') or OUTBOX_BATCH_SIZE)
+    except (TypeError, ValueError):
+        batch_size = OUTBOX_BATCH_SIZE
+    batch_size = max(1, min(batch_size, OUTBOX_MAX_BATCH_SIZE))
+    
+    processed, merged, created = drain_outbox_batch(cur, batch_size)
+    
+    return respond({
+        'success': True,
+        'processed': processed,
+        'merged': merged,
+        'created': created,
+        'done': processed < batch_size
+    })
+
+
+def list_notifications(cur, session, params) -> dict:
+    """Уведомления пользователя по курсору (created_at, id).
+
+    Первая страница сначала разбирает очередь самого получателя; следующие
+    страницы листают уже перенесённое.
+    """
+    user_id = recipient_id(session, params)
+    limit = parse_limit(params.get('limit'), NOTIFICATIONS_PAGE_SIZE, NOTIFICATIONS_MAX_PAGE_SIZE)
+    cursor = params.get('cursor')
+    
+    if cursor:
+        try:
+            cursor_created_at, cursor_id = decode_cursor(cursor)
+        except ValueError as e:
+            raise ApiError(400, str(e)) from e
+        page_filter = "AND (n.created_at, n.id) < (%s, %s)"
+        page_params = (cursor_created_at, cursor_id)
+    else:
+        drain_outbox(cur, OUTBOX_USER_BATCH_SIZE, user_id)
+        page_filter = ""
+        page_params = ()
+    
+    cur.execute(f"""
+        SELECT 
+            n.id, n.type, n.content, n.is_read, n.created_at,
+            u.id, u.full_name, u.avatar_url, n.group_count
+        FROM notifications n
+        JOIN users u ON n.related_user_id = u.id
+        WHERE n.user_id = %s {page_filter}
+        ORDER BY n.created_at DESC, n.id DESC
+        LIMIT %s
+    """, (user_id, *page_params, limit + 1))
+    
+    rows = cur.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    notifications = [notification_item(row) for row in rows]
+    next_cursor = encode_cursor(rows[-1][4], rows[-1][0]) if has_more else None
+    
+    return respond({'notifications': notifications, 'next_cursor': next_cursor})
+
+
+ROUTER = Router(
+    {
+        'GET': {
+            'poll': poll_events,
+            'unread_count': get_unread_count,
+            '*': list_notifications
+        },
+        'POST': {
+            'mark_read': mark_read,
+            'mark_all_read': mark_all_read,
+            'maintain_partitions': maintain_partitions,
+            'process_outbox': process_outbox
+        }
+    },
+    {'GET': 'list'}
+)
+
+
+def handler(event: dict, context) -> dict:
+    """API для управления уведомлениями"""
+    return ROUTER(event)
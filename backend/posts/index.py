@@ -1,223 +1,916 @@
+import base64
+import bisect
+import hashlib
+import hmac
 import json
 import os
+import time
 import psycopg2
+from psycopg2 import pool
+from datetime import datetime
 
-def handler(event: dict, context) -> dict:
-    """API для управления постами, лайками и комментариями"""
-    method = event.get('httpMethod', 'GET')
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', '30'))
+
+_pool = None
+_last_used = {}
+
+
+def get_connection():
+    """Выдаёт соединение из пула контейнера, переживающего тёплые вызовы.
+
+    Соединение, простаивавшее дольше DB_POOL_CHECK_AFTER секунд, проверяется
+    запросом SELECT 1; закрытые и отвалившиеся соединения выбрасываются
+    из пула и заменяются новыми.
+    """
+    global _pool
+    if _pool is None:
+        _pool = pool.ThreadedConnectionPool(DB_POOL_SIZE, DB_POOL_MAX_SIZE, os.environ['DATABASE_URL'])
+    
+    for _ in range(DB_POOL_MAX_SIZE + 1):
+        conn = _pool.getconn()
+        last_used = _last_used.pop(id(conn), None)
+        
+        if not conn.closed and last_used is not None and time.monotonic() - last_used > DB_POOL_CHECK_AFTER:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+            except psycopg2.Error:
+                conn.close()
+        
+        if conn.closed:
+            _pool.putconn(conn, close=True)
+            continue
+        
+        if not conn.autocommit:
+            conn.set_session(autocommit=True)
+        return conn
+    
+    raise psycopg2.OperationalError('Не удалось получить рабочее соединение с базой данных')
+
+
+def release_connection(conn) -> None:
+    """Возвращает соединение в пул; пул сам откатывает незавершённые транзакции"""
+    _pool.putconn(conn)
+    if not conn.closed:
+        _last_used[id(conn)] = time.monotonic()
+
+
+FEED_PAGE_SIZE = 50
+FEED_MAX_PAGE_SIZE = 100
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 50
+SEARCH_MAX_OFFSET = 500
+# Сколько самых свежих совпадений ранжируется; не меньше SEARCH_MAX_OFFSET + SEARCH_MAX_PAGE_SIZE
+SEARCH_MAX_CANDIDATES = 1000
+SEARCH_MIN_QUERY_LENGTH = 2
+COMMENTS_PAGE_SIZE = 20
+COMMENTS_MAX_PAGE_SIZE = 100
+COMMENTS_BATCH_MAX_POSTS = 100
+COMMENTS_BATCH_PER_POST = 3
+COMMENTS_BATCH_MAX_PER_POST = 20
+
+
+def encode_cursor(created_at, post_id: int) -> str:
+    """Упаковывает позицию (created_at, id) последнего поста в непрозрачный курсор"""
+    raw = f"{created_at.isoformat()}|{post_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Распаковывает курсор ленты; ValueError, если курсор повреждён"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        created_at, post_id = raw.split('|')
+        return datetime.fromisoformat(created_at), int(post_id)
+    except (UnicodeError, ValueError) as e:
+        raise ValueError('Некорректный курсор') from e
+
+
+def parse_limit(value, default: int, maximum: int) -> int:
+    """Приводит параметр limit к числу в пределах [1, maximum]"""
+    try:
+        limit = int(value) if value is not None else default
+    except (TypeError, ValueError):
+        limit = default
+    return max(1, min(limit, maximum))
+
+
+def parse_ids(value: str, maximum: int) -> list:
+    """Разбирает список id вида '1,2,3'; ValueError, если он длиннее maximum"""
+    try:
+        ids = list(dict.fromkeys(int(part) for part in (value or '').split(',') if part.strip()))
+    except ValueError as e:
+        raise ValueError('Некорректный список id') from e
+    if len(ids) > maximum:
+        raise ValueError(f'Не больше {maximum} id за запрос')
+    return ids
+
+
+HOME_FANOUT_MAX_FOLLOWERS = int(os.environ.get('HOME_FANOUT_MAX_FOLLOWERS', '5000'))
+
+
+def feed_post(row) -> dict:
+    """Собирает пост ленты из строки (id, content, created_at, автор..., счётчики)"""
+    return {
+        'id': row[0],
+        'content': row[1],
+        'created_at': row[2].isoformat() if row[2] else None,
+        'author': {
+            'id': row[3],
+            'full_name': row[4],
+            'username': row[5],
+            'avatar_url': row[6]
+        },
+        'likes': row[7],
+        'comments': row[8]
+    }
+
+
+def viewer_id(session, params: dict):
+    """Кто смотрит ленту: id из токена, без него — viewer_id из запроса; None для гостя.
+
+    Как и session_user_id, при REQUIRE_SESSION_TOKEN смотрящего определяет
+    только токен: иначе по viewer_id можно было бы узнать чужие лайки.
+    """
+    if session:
+        return session['uid']
+    if REQUIRE_SESSION_TOKEN:
+        return None
+    try:
+        return int(params.get('viewer_id'))
+    except (TypeError, ValueError):
+        return None
+
+
+def add_like_state(cur, user_id, posts: list) -> list:
+    """Проставляет постам liked_by_me одним запросом по post_likes(user_id, post_id)"""
+    liked = set()
+    if user_id and posts:
+        cur.execute(
+            "SELECT post_id FROM post_likes WHERE user_id = %s AND post_id = ANY(%s)",
+            (user_id, [post['id'] for post in posts])
+        )
+        liked = {row[0] for row in cur.fetchall()}
+    for post in posts:
+        post['liked_by_me'] = post['id'] in liked
+    return posts
+
+
+def comment_item(row) -> dict:
+    """Собирает комментарий из строки (id, post_id, content, created_at, автор...)"""
+    return {
+        'id': row[0],
+        'post_id': row[1],
+        'content': row[2],
+        'created_at': row[3].isoformat() if row[3] else None,
+        'author': {
+            'id': row[4],
+            'full_name': row[5],
+            'username': row[6],
+            'avatar_url': row[7]
+        }
+    }
+
+
+def fan_out_post(cur, author_id, post_id: int, created_at) -> None:
+    """Раскладывает новый пост по домашним лентам автора и его подписчиков.
+
+    Авторы, у которых подписчиков больше HOME_FANOUT_MAX_FOLLOWERS, помечаются
+    fanout_on_read: их посты в чужие ленты не копируются, а дочитываются
+    при чтении ленты action=home.
+    """
+    cur.execute("SELECT fanout_on_read, followers_count FROM users WHERE id = %s", (author_id,))
+    author = cur.fetchone()
+    if not author:
+        return
+    
+    fanout_on_read = author[0] or author[1] > HOME_FANOUT_MAX_FOLLOWERS
+    if fanout_on_read and not author[0]:
+        cur.execute("UPDATE users SET fanout_on_read = TRUE WHERE id = %s", (author_id,))
     
-    if method == 'OPTIONS':
-        return {
+    cur.execute("""
+        INSERT INTO home_timeline (user_id, post_id, created_at)
+        SELECT %s, %s, %s
+        UNION ALL
+        SELECT follower_id, %s, %s FROM follows
+        WHERE following_id = %s AND NOT %s
+        ON CONFLICT DO NOTHING
+    """, (author_id, post_id, created_at, post_id, created_at, author_id, fanout_on_read))
+
+
+# Канал LISTEN/NOTIFY пользователя: префикс + id получателя
+EVENT_CHANNEL_PREFIX = 'user_events_'
+
+
+SESSION_TTL = int(os.environ.get('SESSION_TTL', '900'))
+SESSION_REVOCATION_REFRESH = float(os.environ.get('SESSION_REVOCATION_REFRESH', '30'))
+REQUIRE_SESSION_TOKEN = os.environ.get('REQUIRE_SESSION_TOKEN', 'false').lower() == 'true'
+
+_revoked_sessions = {}
+_revocations_loaded_at = None
+
+
+class InvalidSession(Exception):
+    """Токен сессии подделан, просрочен, отозван или отсутствует там, где обязателен"""
+
+
+def b64url_decode(value: str) -> bytes:
+    """Декодирует base64url, дополняя срезанные '='"""
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+
+def sign_session(payload: str) -> bytes:
+    """HMAC-SHA256 подпись полезной нагрузки токена ключом SESSION_SECRET"""
+    return hmac.new(os.environ['SESSION_SECRET'].encode('utf-8'), payload.encode('ascii'), hashlib.sha256).digest()
+
+
+def load_revocations(cur) -> None:
+    """Обновляет кеш отзывов сессий не чаще раза в SESSION_REVOCATION_REFRESH секунд.
+
+    Хранятся только отзывы моложе SESSION_TTL: более старые токены
+    к этому моменту уже истекли сами.
+    """
+    global _revoked_sessions, _revocations_loaded_at
+    now = time.monotonic()
+    if _revocations_loaded_at is not None and now - _revocations_loaded_at < SESSION_REVOCATION_REFRESH:
+        return
+    cur.execute(
+        "SELECT user_id, EXTRACT(EPOCH FROM revoked_at) FROM session_revocations WHERE revoked_at > CURRENT_TIMESTAMP - make_interval(secs => %s)",
+        (SESSION_TTL,)
+    )
+    _revoked_sessions = {row[0]: float(row[1]) for row in cur.fetchall()}
+    _revocations_loaded_at = now
+
+
+def read_session(event: dict, cur):
+    """Проверяет токен из X-Auth-Token или Authorization: Bearer без запроса к users.
+
+    Возвращает claims токена ({'uid', 'adm', 'ban', 'iat', 'exp'}) или None,
+    если токен не передан; InvalidSession — если токен недействителен.
+    """
+    headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+    token = headers.get('x-auth-token')
+    if not token and headers.get('authorization', '').startswith('Bearer '):
+        token = headers['authorization'][len('Bearer '):]
+    if not token:
+        return None
+    
+    try:
+        payload, signature = token.split('.')
+        if not hmac.compare_digest(sign_session(payload), b64url_decode(signature)):
+            raise InvalidSession()
+        claims = json.loads(b64url_decode(payload))
+    except (ValueError, UnicodeError) as e:
+        raise InvalidSession() from e
+    
+    if claims.get('exp', 0) < time.time() or claims.get('ban'):
+        raise InvalidSession()
+    
+    load_revocations(cur)
+    revoked_at = _revoked_sessions.get(claims['uid'])
+    if revoked_at is not None and claims['iat'] <= revoked_at:
+        raise InvalidSession()
+    return claims
+
+
+def session_user_id(session, fallback):
+    """id пользователя из токена; без токена — id из запроса, пока REQUIRE_SESSION_TOKEN выключен"""
+    if session:
+        return session['uid']
+    if REQUIRE_SESSION_TOKEN:
+        raise InvalidSession()
+    return fallback
+
+
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+
+class ApiError(Exception):
+    """Ошибка запроса: отдаётся клиенту со статусом status и телом {'error': message}"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def dump_json(data) -> str:
+    """Сериализует тело ответа: orjson, если он установлен, иначе стандартный json"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return json.dumps(data)
+
+
+def respond(data, status: int = 200) -> dict:
+    """JSON-ответ функции с общими заголовками"""
+    return {'statusCode': status, 'headers': JSON_HEADERS, 'body': dump_json(data), 'isBase64Encoded': False}
+
+
+def parse_body(event: dict) -> dict:
+    """Разбирает JSON-тело запроса; ApiError 400, если это не JSON-объект"""
+    raw = event.get('body') or '{}'
+    try:
+        body = orjson.loads(raw) if orjson is not None else json.loads(raw)
+    except ValueError as e:
+        raise ApiError(400, 'Некорректный JSON в теле запроса') from e
+    if not isinstance(body, dict):
+        raise ApiError(400, 'Тело запроса должно быть JSON-объектом')
+    return body
+
+
+REQUEST_METRICS = os.environ.get('REQUEST_METRICS', 'false').lower() == 'true'
+REQUEST_METRICS_HISTOGRAM = os.environ.get('REQUEST_METRICS_HISTOGRAM', 'false').lower() == 'true'
+REQUEST_METRICS_FLUSH_EVERY = int(os.environ.get('REQUEST_METRICS_FLUSH_EVERY', '100'))
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_latency_histogram = {}
+_histogram_requests = 0
+
+
+class MetricsCursor(psycopg2.extensions.cursor):
+    """Курсор, который считает запросы, время в БД и строки результата.
+
+    Выдаётся роутером только при REQUEST_METRICS=true; без него обработчики
+    получают обычный курсор и не платят за учёт.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queries = 0
+        self.db_time = 0.0
+        self.rows = 0
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            if self.description is not None and self.rowcount > 0:
+                self.rows += self.rowcount
+
+
+def observe_latency(action: str, wall_ms: float) -> None:
+    """Кладёт время запроса в гистограмму контейнера и раз в
+    REQUEST_METRICS_FLUSH_EVERY запросов пишет её в лог и обнуляет"""
+    global _histogram_requests
+    buckets = _latency_histogram.get(action)
+    if buckets is None:
+        buckets = _latency_histogram[action] = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+    buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, wall_ms)] += 1
+    _histogram_requests += 1
+    
+    if _histogram_requests >= REQUEST_METRICS_FLUSH_EVERY:
+        print(dump_json({
+            'metric': 'latency_histogram',
+            'buckets_ms': LATENCY_BUCKETS_MS,
+            'actions': _latency_histogram
+        }))
+        _latency_histogram.clear()
+        _histogram_requests = 0
+
+
+def record_request(action: str, cur, response, elapsed: float) -> None:
+    """Пишет структурированную строку метрик запроса в лог функции"""
+    body = (response.get('body') or '') if response else ''
+    wall_ms = elapsed * 1000
+    print(dump_json({
+        'metric': 'request',
+        'action': action,
+        'status': response['statusCode'] if response else 500,
+        'wall_ms': round(wall_ms, 2),
+        'db_ms': round(cur.db_time * 1000, 2),
+        'queries': cur.queries,
+        'rows': cur.rows,
+        'response_bytes': len(body.encode('utf-8'))
+    }))
+    if REQUEST_METRICS_HISTOGRAM:
+        observe_latency(action, wall_ms)
+
+
+class Router:
+    """Диспетчер функции: (метод, action) запроса → обработчик действия.
+
+    routes — {метод: {action: обработчик}}, ключ '*' принимает остальные
+    action метода; default_actions — action для запросов без него.
+    Обработчик получает (cur, session, args), где args — параметры строки
+    запроса для GET и JSON-тело для остальных методов. Preflight и ответ 405
+    собираются один раз при создании роутера.
+    """
+
+    def __init__(self, routes: dict, default_actions: dict):
+        self.routes = routes
+        self.default_actions = default_actions
+        self.preflight = {
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Methods': ', '.join([*routes, 'OPTIONS']),
+                'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Auth-Token, X-User-Id',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
             'isBase64Encoded': False
         }
+        self.not_allowed = respond({'error': 'Метод не поддерживается'}, 405)
+
+    def resolve(self, method: str, args: dict):
+        """Находит (action, обработчик) для метода и action; None, если такого нет.
+
+        Запрос, попавший в '*', получает action по умолчанию для метода, чтобы
+        метрики не размножались по произвольным значениям из запроса.
+        """
+        actions = self.routes.get(method)
+        if actions is None:
+            return None
+        action = args.get('action') or self.default_actions.get(method)
+        if isinstance(action, str) and action in actions:
+            return action, actions[action]
+        if '*' in actions:
+            return self.default_actions.get(method, '*'), actions['*']
+        return None
+
+    def __call__(self, event: dict) -> dict:
+        # Время запроса включает разбор тела и получение соединения из пула
+        started = time.perf_counter()
+        method = event.get('httpMethod', 'GET')
+        if method == 'OPTIONS':
+            return self.preflight
+        if method not in self.routes:
+            return self.not_allowed
+        
+        try:
+            args = (event.get('queryStringParameters') or {}) if method == 'GET' else parse_body(event)
+        except ApiError as e:
+            return respond({'error': e.message}, e.status)
+        
+        resolved = self.resolve(method, args)
+        if resolved is None:
+            return self.not_allowed
+        action, route = resolved
+        
+        conn = get_connection()
+        cur = conn.cursor(cursor_factory=MetricsCursor) if REQUEST_METRICS else conn.cursor()
+        response = None
+        
+        try:
+            session = read_session(event, cur)
+            response = route(cur, session, args)
+        
+        except ApiError as e:
+            response = respond({'error': e.message}, e.status)
+        
+        except InvalidSession:
+            response = respond({'error': 'Сессия недействительна, войдите заново'}, 401)
+        
+        except psycopg2.DataError:
+            # Значение из запроса не приводится к типу колонки, например id='abc'
+            response = respond({'error': 'Некорректные параметры запроса'}, 400)
+        
+        finally:
+            cur.close()
+            release_connection(conn)
+            if REQUEST_METRICS:
+                record_request(action, cur, response, time.perf_counter() - started)
+        
+        return response
+
+
+def get_feed(cur, session, params) -> dict:
+    """Общая лента: страница постов по курсору (created_at, id)"""
+    limit = parse_limit(params.get('limit'), FEED_PAGE_SIZE, FEED_MAX_PAGE_SIZE)
+    cursor = params.get('cursor')
     
-    db_url = os.environ['DATABASE_URL']
+    if cursor:
+        try:
+            cursor_created_at, cursor_id = decode_cursor(cursor)
+        except ValueError as e:
+            raise ApiError(400, str(e)) from e
+        page_filter = "WHERE (created_at, id) < (%s, %s)"
+        page_params = (cursor_created_at, cursor_id, limit + 1)
+    else:
+        page_filter = ""
+        page_params = (limit + 1,)
     
-    conn = psycopg2.connect(db_url)
-    conn.set_session(autocommit=True)
-    cur = conn.cursor()
+    cur.execute(f"""
+        WITH page AS (
+            SELECT id, user_id, content, created_at, likes_count, comments_count
+            FROM posts
+            {page_filter}
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        )
+        SELECT 
+            p.id, p.content, p.created_at,
+            u.id, u.full_name, u.username, u.avatar_url,
+            p.likes_count, p.comments_count
+        FROM page p
+        JOIN users u ON p.user_id = u.id
+        ORDER BY p.created_at DESC, p.id DESC
+    """, page_params)
     
+    rows = cur.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    posts = add_like_state(cur, viewer_id(session, params), [feed_post(row) for row in rows])
+    next_cursor = encode_cursor(rows[-1][2], rows[-1][0]) if has_more else None
+    
+    return respond({'posts': posts, 'next_cursor': next_cursor})
+
+
+def get_home(cur, session, params) -> dict:
+    """Домашняя лента: home_timeline плюс посты авторов с fanout_on_read"""
+    user_id = session_user_id(session, params.get('user_id'))
+    limit = parse_limit(params.get('limit'), FEED_PAGE_SIZE, FEED_MAX_PAGE_SIZE)
+    cursor = params.get('cursor')
+    
+    if cursor:
+        try:
+            cursor_created_at, cursor_id = decode_cursor(cursor)
+        except ValueError as e:
+            raise ApiError(400, str(e)) from e
+        timeline_filter = "AND (created_at, post_id) < (%s, %s)"
+        pull_filter = "AND (created_at, id) < (%s, %s)"
+        timeline_params = (cursor_created_at, cursor_id)
+    else:
+        timeline_filter = ""
+        pull_filter = ""
+        timeline_params = ()
+    
+    # Посты обычных авторов уже разложены по home_timeline при создании,
+    # посты авторов с fanout_on_read дочитываются из posts по индексу автора
+    cur.execute(f"""
+        WITH page AS (
+            (
+                SELECT post_id, created_at
+                FROM home_timeline
+                WHERE user_id = %s {timeline_filter}
+                ORDER BY created_at DESC, post_id DESC
+                LIMIT %s
+            )
+            UNION
+            (
+                SELECT p.id, p.created_at
+                FROM users a
+                CROSS JOIN LATERAL (
+                    SELECT id, created_at
+                    FROM posts
+                    WHERE user_id = a.id {pull_filter}
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT %s
+                ) p
+                WHERE a.fanout_on_read
+                  AND EXISTS (
+                      SELECT 1 FROM follows f
+                      WHERE f.follower_id = %s AND f.following_id = a.id
+                  )
+            )
+            ORDER BY created_at DESC, post_id DESC
+            LIMIT %s
+        )
+        SELECT 
+            p.id, p.content, p.created_at,
+            u.id, u.full_name, u.username, u.avatar_url,
+            p.likes_count, p.comments_count
+        FROM page pg
+        JOIN posts p ON p.id = pg.post_id
+        JOIN users u ON p.user_id = u.id
+        ORDER BY pg.created_at DESC, pg.post_id DESC
+    """, (user_id, *timeline_params, limit + 1, *timeline_params, limit + 1, user_id, limit + 1))
+    
+    rows = cur.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    posts = add_like_state(cur, user_id, [feed_post(row) for row in rows])
+    next_cursor = encode_cursor(rows[-1][2], rows[-1][0]) if has_more else None
+    
+    return respond({'posts': posts, 'next_cursor': next_cursor})
+
+
+def search_posts(cur, session, params) -> dict:
+    """Полнотекстовый поиск по постам с ранжированием.
+
+    Ранжируются не все совпадения, а SEARCH_MAX_CANDIDATES самых свежих из них.
+    """
+    query = (params.get('q') or '').strip()
+    limit = parse_limit(params.get('limit'), SEARCH_PAGE_SIZE, SEARCH_MAX_PAGE_SIZE)
     try:
+        offset = min(max(int(params.get('offset') or 0), 0), SEARCH_MAX_OFFSET)
+    except ValueError:
+        offset = 0
+    
+    if len(query) < SEARCH_MIN_QUERY_LENGTH:
+        raise ApiError(400, 'Слишком короткий запрос')
+    
+    # ts_rank_cd читает search_vector каждой ранжируемой строки, поэтому
+    # ранжируются только SEARCH_MAX_CANDIDATES самых свежих совпадений:
+    # редкие слова находятся по GIN-индексу, частые — обходом
+    # idx_posts_created_at_id до нужного числа строк. Авторы подтягиваются
+    # только для страницы
+    cur.execute("""
+        WITH candidates AS (
+            SELECT p.id, p.search_vector, q
+            FROM posts p, websearch_to_tsquery('russian', %s) q
+            WHERE p.search_vector @@ q
+            ORDER BY p.created_at DESC, p.id DESC
+            LIMIT %s
+        ),
+        matches AS (
+            SELECT id, ts_rank_cd(search_vector, q) AS rank
+            FROM candidates
+            ORDER BY rank DESC, id DESC
+            LIMIT %s OFFSET %s
+        )
+        SELECT 
+            p.id, p.content, p.created_at,
+            u.id, u.full_name, u.username, u.avatar_url,
+            p.likes_count, p.comments_count
+        FROM matches m
+        JOIN posts p ON p.id = m.id
+        JOIN users u ON p.user_id = u.id
+        ORDER BY m.rank DESC, m.id DESC
+    """, (query, SEARCH_MAX_CANDIDATES, limit + 1, offset))
+    
+    rows = cur.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    return respond({
+        'posts': add_like_state(cur, viewer_id(session, params), [feed_post(row) for row in rows]),
+        'next_offset': offset + limit if has_more and offset + limit <= SEARCH_MAX_OFFSET else None
+    })
+
+
+def get_user_posts(cur, session, params) -> dict:
+    """Посты одного пользователя"""
+    user_id = params.get('user_id')
+    
+    cur.execute("""
+        SELECT id, content, created_at, likes_count, comments_count
+        FROM posts
+        WHERE user_id = %s
+        ORDER BY created_at DESC
+    """, (user_id,))
+    
+    posts = []
+    for row in cur.fetchall():
+        posts.append({
+            'id': row[0],
+            'content': row[1],
+            'created_at': row[2].isoformat() if row[2] else None,
+            'likes': row[3],
+            'comments': row[4]
+        })
+    
+    return respond({'posts': add_like_state(cur, viewer_id(session, params), posts)})
+
+
+def create_post(cur, session, body) -> dict:
+    """Создаёт пост и раскладывает его по лентам подписчиков"""
+    user_id = session_user_id(session, body.get('user_id'))
+    content = body.get('content', '').strip()
+    
+    if not content:
+        raise ApiError(400, 'Контент не может быть пустым')
+    
+    cur.execute(
+        "INSERT INTO posts (user_id, content) VALUES (%s, %s) RETURNING id, created_at",
+        (user_id, content)
+    )
+    post = cur.fetchone()
+    
+    fan_out_post(cur, user_id, post[0], post[1])
+    
+    return respond({
+        'success': True,
+        'post': {
+            'id': post[0],
+            'created_at': post[1].isoformat() if post[1] else None
+        }
+    })
+
+
+def post_action_ids(session, body) -> tuple:
+    """(user_id, post_id) лайка или комментария; ApiError 400, если это не числа"""
+    try:
+        return int(session_user_id(session, body.get('user_id'))), int(body.get('post_id'))
+    except (TypeError, ValueError) as e:
+        raise ApiError(400, 'Укажите user_id и post_id') from e
+
+
+def like_post(cur, session, body) -> dict:
+    """Ставит лайк и кладёт уведомление автору в очередь"""
+    user_id, post_id = post_action_ids(session, body)
+    
+    event = {'type': 'like', 'post_id': post_id, 'user_id': user_id}
+    try:
+        cur.execute("""
+            WITH new_like AS (
+                INSERT INTO post_likes (post_id, user_id)
+                VALUES (%s, %s)
+                ON CONFLICT (post_id, user_id) DO NOTHING
+                RETURNING post_id
+            ), liked_post AS (
+                UPDATE posts SET likes_count = likes_count + 1
+                WHERE id IN (SELECT post_id FROM new_like)
+                RETURNING user_id
+            ), queued AS (
+                INSERT INTO notification_outbox (user_id, type, content, related_user_id, related_post_id, group_key)
+                SELECT user_id, 'like', 'лайкнул ваш пост', %s, %s, %s
+                FROM liked_post
+                WHERE user_id IS DISTINCT FROM %s
+                RETURNING user_id
+            )
+            SELECT lp.user_id, (SELECT pg_notify(%s || q.user_id, %s) FROM queued q)
+            FROM liked_post lp
+        """, (post_id, user_id, user_id, post_id, f'like:{post_id}', user_id,
+              EVENT_CHANNEL_PREFIX, json.dumps(event)))
+    except psycopg2.IntegrityError as e:
+        # Пост удалён или никогда не существовал: лайк упирается во внешний ключ
+        if e.diag.constraint_name != 'post_likes_post_id_fkey':
+            raise
+        raise ApiError(404, 'Пост не найден') from e
+    post_author = cur.fetchone()
+    
+    if not post_author:
+        return respond({'success': True, 'message': 'Уже лайкнуто'})
+    
+    return respond({'success': True})
+
+
+def unlike_post(cur, session, body) -> dict:
+    """Снимает лайк и уменьшает счётчик поста в одном запросе"""
+    user_id, post_id = post_action_ids(session, body)
+    
+    cur.execute("""
+        WITH removed AS (
+            DELETE FROM post_likes
+            WHERE post_id = %s AND user_id = %s
+            RETURNING post_id
+        )
+        UPDATE posts SET likes_count = GREATEST(likes_count - 1, 0)
+        WHERE id IN (SELECT post_id FROM removed)
+        RETURNING likes_count
+    """, (post_id, user_id))
+    post = cur.fetchone()
+    
+    if not post:
+        return respond({'success': True, 'message': 'Лайка не было'})
+    
+    return respond({'success': True, 'likes': post[0]})
+
+
+def comment_post(cur, session, body) -> dict:
+    """Добавляет комментарий и кладёт уведомление автору в очередь"""
+    user_id, post_id = post_action_ids(session, body)
+    content = body.get('content', '').strip()
+    
+    if not content:
+        raise ApiError(400, 'Комментарий не может быть пустым')
+    
+    event = {'type': 'comment', 'post_id': post_id, 'user_id': user_id}
+    try:
+        cur.execute("""
+            WITH new_comment AS (
+                INSERT INTO comments (post_id, user_id, content)
+                VALUES (%s, %s, %s)
+                RETURNING id, post_id
+            ), commented_post AS (
+                UPDATE posts p SET comments_count = p.comments_count + 1
+                FROM new_comment nc
+                WHERE p.id = nc.post_id
+                RETURNING nc.id AS comment_id, p.user_id
+            ), queued AS (
+                INSERT INTO notification_outbox (user_id, type, content, related_user_id, related_post_id, group_key)
+                SELECT user_id, 'comment', 'прокомментировал ваш пост', %s, %s, %s
+                FROM commented_post
+                WHERE user_id IS DISTINCT FROM %s
+                RETURNING user_id
+            )
+            SELECT cp.comment_id, cp.user_id, (
+                SELECT pg_notify(%s || q.user_id, (%s::jsonb || jsonb_build_object('comment_id', cp.comment_id))::text)
+                FROM queued q
+            )
+            FROM commented_post cp
+        """, (post_id, user_id, content, user_id, post_id, f'comment:{post_id}', user_id,
+              EVENT_CHANNEL_PREFIX, json.dumps(event)))
+    except psycopg2.IntegrityError as e:
+        if e.diag.constraint_name != 'comments_post_id_fkey':
+            raise
+        raise ApiError(404, 'Пост не найден') from e
+    comment = cur.fetchone()
+    
+    return respond({'success': True, 'comment_id': comment[0]})
+
+
+def get_comments(cur, session, params) -> dict:
+    """Комментарии поста по курсору id или первые комментарии сразу для списка постов.
+
+    С post_id возвращает страницу от старых к новым; с post_ids='1,2,3' —
+    по per_post первых комментариев каждого поста одним запросом. Авторы
+    подтягиваются тем же запросом.
+    """
+    if params.get('post_ids') is not None:
+        try:
+            post_ids = parse_ids(params.get('post_ids'), COMMENTS_BATCH_MAX_POSTS)
+        except ValueError as e:
+            raise ApiError(400, str(e)) from e
+        per_post = parse_limit(params.get('per_post'), COMMENTS_BATCH_PER_POST, COMMENTS_BATCH_MAX_PER_POST)
         
-        if method == 'GET':
-            action = event.get('queryStringParameters', {}).get('action', 'feed')
-            
-            if action == 'feed':
-                cur.execute("""
-                    SELECT 
-                        p.id, p.content, p.created_at,
-                        u.id, u.full_name, u.username, u.avatar_url,
-                        COUNT(DISTINCT pl.id) as likes_count,
-                        COUNT(DISTINCT c.id) as comments_count
-                    FROM posts p
-                    JOIN users u ON p.user_id = u.id
-                    LEFT JOIN post_likes pl ON p.id = pl.post_id
-                    LEFT JOIN comments c ON p.id = c.post_id
-                    GROUP BY p.id, u.id
-                    ORDER BY p.created_at DESC
-                    LIMIT 50
-                """)
-                
-                posts = []
-                for row in cur.fetchall():
-                    posts.append({
-                        'id': row[0],
-                        'content': row[1],
-                        'created_at': row[2].isoformat() if row[2] else None,
-                        'author': {
-                            'id': row[3],
-                            'full_name': row[4],
-                            'username': row[5],
-                            'avatar_url': row[6]
-                        },
-                        'likes': row[7],
-                        'comments': row[8]
-                    })
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'posts': posts}),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'user_posts':
-                user_id = event.get('queryStringParameters', {}).get('user_id')
-                
-                cur.execute("""
-                    SELECT 
-                        p.id, p.content, p.created_at,
-                        COUNT(DISTINCT pl.id) as likes_count,
-                        COUNT(DISTINCT c.id) as comments_count
-                    FROM posts p
-                    LEFT JOIN post_likes pl ON p.id = pl.post_id
-                    LEFT JOIN comments c ON p.id = c.post_id
-                    WHERE p.user_id = %s
-                    GROUP BY p.id
-                    ORDER BY p.created_at DESC
-                """, (user_id,))
-                
-                posts = []
-                for row in cur.fetchall():
-                    posts.append({
-                        'id': row[0],
-                        'content': row[1],
-                        'created_at': row[2].isoformat() if row[2] else None,
-                        'likes': row[3],
-                        'comments': row[4]
-                    })
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'posts': posts}),
-                    'isBase64Encoded': False
-                }
+        # LATERAL с LIMIT читает по индексу (post_id, id) только первые
+        # per_post + 1 комментариев каждого поста, а не все комментарии
+        cur.execute("""
+            SELECT c.id, c.post_id, c.content, c.created_at,
+                   u.id, u.full_name, u.username, u.avatar_url
+            FROM unnest(%s::int[]) AS t(post_id)
+            CROSS JOIN LATERAL (
+                SELECT id, post_id, user_id, content, created_at
+                FROM comments
+                WHERE post_id = t.post_id
+                ORDER BY id
+                LIMIT %s
+            ) c
+            JOIN users u ON u.id = c.user_id
+            ORDER BY c.post_id, c.id
+        """, (post_ids, per_post + 1))
         
-        elif method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            action = body.get('action')
-            
-            if action == 'create':
-                user_id = body.get('user_id')
-                content = body.get('content', '').strip()
-                
-                if not content:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Контент не может быть пустым'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute(
-                    "INSERT INTO posts (user_id, content) VALUES (%s, %s) RETURNING id, created_at",
-                    (user_id, content)
-                )
-                post = cur.fetchone()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'success': True,
-                        'post': {
-                            'id': post[0],
-                            'created_at': post[1].isoformat() if post[1] else None
-                        }
-                    }),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'like':
-                user_id = body.get('user_id')
-                post_id = body.get('post_id')
-                
-                try:
-                    cur.execute(
-                        "INSERT INTO post_likes (post_id, user_id) VALUES (%s, %s)",
-                        (post_id, user_id)
-                    )
-                    
-                    cur.execute(
-                        "SELECT user_id FROM posts WHERE id = %s",
-                        (post_id,)
-                    )
-                    post_author = cur.fetchone()
-                    
-                    if post_author and post_author[0] != user_id:
-                        cur.execute(
-                            "INSERT INTO notifications (user_id, type, content, related_user_id, related_post_id) VALUES (%s, %s, %s, %s, %s)",
-                            (post_author[0], 'like', 'лайкнул ваш пост', user_id, post_id)
-                        )
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': True}),
-                        'isBase64Encoded': False
-                    }
-                except psycopg2.IntegrityError:
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': True, 'message': 'Уже лайкнуто'}),
-                        'isBase64Encoded': False
-                    }
-            
-            elif action == 'comment':
-                user_id = body.get('user_id')
-                post_id = body.get('post_id')
-                content = body.get('content', '').strip()
-                
-                if not content:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Комментарий не может быть пустым'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute(
-                    "INSERT INTO comments (post_id, user_id, content) VALUES (%s, %s, %s) RETURNING id",
-                    (post_id, user_id, content)
-                )
-                comment = cur.fetchone()
-                
-                cur.execute(
-                    "SELECT user_id FROM posts WHERE id = %s",
-                    (post_id,)
-                )
-                post_author = cur.fetchone()
-                
-                if post_author and post_author[0] != user_id:
-                    cur.execute(
-                        "INSERT INTO notifications (user_id, type, content, related_user_id, related_post_id) VALUES (%s, %s, %s, %s, %s)",
-                        (post_author[0], 'comment', 'прокомментировал ваш пост', user_id, post_id)
-                    )
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'comment_id': comment[0]}),
-                    'isBase64Encoded': False
-                }
+        threads = {str(post_id): {'comments': [], 'next_cursor': None} for post_id in post_ids}
+        for row in cur.fetchall():
+            thread = threads[str(row[1])]
+            if len(thread['comments']) < per_post:
+                thread['comments'].append(comment_item(row))
+            else:
+                thread['next_cursor'] = str(thread['comments'][-1]['id'])
         
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Метод не поддерживается'}),
-            'isBase64Encoded': False
-        }
+        return respond({'posts': threads})
     
-    finally:
-        cur.close()
-        conn.close()
\ No newline at end of file
+    if not params.get('post_id'):
+        raise ApiError(400, 'Не указан пост')
+    try:
+        post_id = int(params['post_id'])
+    except ValueError as e:
+        raise ApiError(400, 'Некорректный post_id') from e
+    limit = parse_limit(params.get('limit'), COMMENTS_PAGE_SIZE, COMMENTS_MAX_PAGE_SIZE)
+    try:
+        cursor = int(params['cursor']) if params.get('cursor') else 0
+    except ValueError as e:
+        raise ApiError(400, 'Некорректный курсор') from e
+    
+    cur.execute("""
+        WITH page AS (
+            SELECT id, post_id, user_id, content, created_at
+            FROM comments
+            WHERE post_id = %s AND id > %s
+            ORDER BY id
+            LIMIT %s
+        )
+        SELECT c.id, c.post_id, c.content, c.created_at,
+               u.id, u.full_name, u.username, u.avatar_url
+        FROM page c
+        JOIN users u ON u.id = c.user_id
+        ORDER BY c.id
+    """, (post_id, cursor, limit + 1))
+    
+    rows = cur.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    return respond({
+        'comments': [comment_item(row) for row in rows],
+        'next_cursor': str(rows[-1][0]) if has_more else None
+    })
+
+
+ROUTER = Router(
+    {
+        'GET': {
+            'feed': get_feed,
+            'home': get_home,
+            'search': search_posts,
+            'user_posts': get_user_posts,
+            'comments': get_comments
+        },
+        'POST': {
+            'create': create_post,
+            'like': like_post,
+            'unlike': unlike_post,
+            'comment': comment_post
+        }
+    },
+    {'GET': 'feed'}
+)
+
+
+def handler(event: dict, context) -> dict:
+    """API для управления постами, лайками и комментариями"""
+    return ROUTER(event)
@@ -0,0 +1,119 @@
+"""Проверяет путь события через очередь уведомлений на засеянной базе.
+
+Два пользователя лайкают чужой пост через обработчик posts, повторный лайк
+не должен ставить событие в очередь. Затем автор открывает список уведомлений
+через обработчик notifications: очередь автора разбирается, лайки схлопываются
+в одно непрочитанное уведомление группы like:<post_id>, а счётчик
+непрочитанных растёт не больше чем на одно уведомление. Код выхода 1,
+если что-то разошлось:
+
+    DATABASE_URL=postgresql://localhost/bench python bench/check_outbox.py
+
+Лайки и уведомления остаются в базе, как после сценариев run.py.
+"""
+import argparse
+import json
+import os
+import sys
+
+from run import get, load_functions, post
+
+_failures = []
+
+
+def check(condition: bool, message: str) -> None:
+    print(f"{'ok  ' if condition else 'FAIL'} {message}")
+    if not condition:
+        _failures.append(message)
+
+
+def call(module, event: dict) -> dict:
+    response = module.handler(event, None)
+    if response['statusCode'] != 200:
+        sys.exit(f"{event.get('body') or event.get('queryStringParameters')}: {response['statusCode']} {response['body']}")
+    return json.loads(response['body'])
+
+
+def like_group(cur, author_id: int, post_id: int) -> tuple:
+    """(непрочитанных уведомлений группы лайков поста, их суммарный group_count)"""
+    cur.execute("""
+        SELECT COUNT(*), COALESCE(SUM(group_count), 0) FROM notifications
+        WHERE user_id = %s AND group_key = %s AND is_read = FALSE
+    """, (author_id, f'like:{post_id}'))
+    return cur.fetchone()
+
+
+def queued(cur, author_id: int) -> int:
+    cur.execute("SELECT COUNT(*) FROM notification_outbox WHERE user_id = %s", (author_id,))
+    return cur.fetchone()[0]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--post-id', type=int, help='пост для лайков; по умолчанию самый свежий')
+    args = parser.parse_args()
+
+    if not os.environ.get('DATABASE_URL'):
+        sys.exit('Укажите DATABASE_URL засеянной базы')
+
+    modules = load_functions(1)
+    posts, notifications = modules['posts'], modules['notifications']
+
+    conn = notifications.get_connection()
+    try:
+        with conn.cursor() as cur:
+            if args.post_id:
+                cur.execute("SELECT id, user_id FROM posts WHERE id = %s", (args.post_id,))
+            else:
+                cur.execute("SELECT id, user_id FROM posts ORDER BY id DESC LIMIT 1")
+            row = cur.fetchone()
+            if not row:
+                sys.exit('База пуста: сначала запустите bench/seed.py')
+            post_id, author_id = row
+            cur.execute("""
+                SELECT u.id FROM users u
+                WHERE u.id <> %s
+                  AND NOT EXISTS (SELECT 1 FROM post_likes pl WHERE pl.post_id = %s AND pl.user_id = u.id)
+                ORDER BY u.id
+                LIMIT 2
+            """, (author_id, post_id))
+            likers = [liker for liker, in cur.fetchall()]
+            if len(likers) < 2:
+                sys.exit(f'У поста {post_id} не осталось пользователей без лайка')
+
+            # Сначала разбираем то, что уже стоит в очереди автора, чтобы
+            # дальше считать только события этой проверки
+            unread_before = call(notifications, get({'action': 'unread_count', 'user_id': author_id}))['unread_count']
+            groups_before, count_before = like_group(cur, author_id, post_id)
+            check(queued(cur, author_id) == 0, 'очередь автора пуста после unread_count')
+
+            for liker in likers:
+                call(posts, post({'action': 'like', 'user_id': liker, 'post_id': post_id}))
+            repeat = call(posts, post({'action': 'like', 'user_id': likers[0], 'post_id': post_id}))
+            check(repeat.get('message') == 'Уже лайкнуто', 'повторный лайк не ставится второй раз')
+            check(queued(cur, author_id) == 2, 'в очереди автора два события лайка')
+
+            listed = call(notifications, get({'user_id': author_id}))
+            check(queued(cur, author_id) == 0, 'список уведомлений разобрал очередь автора')
+            groups_after, count_after = like_group(cur, author_id, post_id)
+            check(groups_after == 1, 'лайки поста схлопнулись в одно непрочитанное уведомление')
+            check(count_after == count_before + 2, f'group_count вырос на 2: {count_before} -> {count_after}')
+            check(
+                any(item['group_count'] == count_after for item in listed['notifications']),
+                'уведомление группы есть в первой странице списка'
+            )
+
+            unread_after = call(notifications, get({'action': 'unread_count', 'user_id': author_id}))['unread_count']
+            expected = unread_before + (0 if groups_before else 1)
+            check(unread_after == expected, f'непрочитанных {unread_after}, ожидалось {expected}')
+            check(like_group(cur, author_id, post_id)[1] == count_after, 'повторное чтение не сливает события заново')
+    finally:
+        notifications.release_connection(conn)
+
+    if _failures:
+        sys.exit(1)
+    print('\nСобытия очереди доходят до уведомлений')
+
+
+if __name__ == '__main__':
+    main()
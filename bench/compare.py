@@ -0,0 +1,59 @@
+"""Сравнивает два отчёта bench/run.py и отмечает регрессии.
+
+    python bench/compare.py bench/results/old.json bench/results/new.json --threshold 0.15
+
+Код выхода 1, если p95 или число запросов к базе хоть одного сценария
+выросли больше чем на threshold.
+"""
+import argparse
+import json
+import sys
+
+METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request', 'db_ms_per_request')
+GATED = ('p95_ms', 'queries_per_request')
+
+
+def load(path: str) -> dict:
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def change(before: float, after: float) -> float:
+    """Относительное изменение; рост с нуля считается бесконечным"""
+    if before == 0:
+        return 0.0 if after == 0 else float('inf')
+    return (after - before) / before
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=0.15)
+    args = parser.parse_args()
+
+    baseline, candidate = load(args.baseline), load(args.candidate)
+    print(f"{baseline['commit']} -> {candidate['commit']}")
+
+    regressions = []
+    for name, after in candidate['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if before is None:
+            print(f'{name}: новый сценарий')
+            continue
+        cells = []
+        for metric in METRICS:
+            delta = change(before[metric], after[metric])
+            mark = '!' if metric in GATED and delta > args.threshold else ''
+            if mark:
+                regressions.append(f'{name} {metric}')
+            cells.append(f'{metric}={after[metric]} ({delta:+.0%}){mark}')
+        print(f'{name}: ' + ', '.join(cells))
+
+    if regressions:
+        print('регрессии: ' + ', '.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
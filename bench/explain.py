@@ -0,0 +1,114 @@
+"""Проверяет планы запросов обработчиков на засеянной базе.
+
+Прогоняет сценарии bench/run.py по нескольку раз и перед каждым запросом
+обработчика выполняет для него EXPLAIN (FORMAT JSON) с теми же параметрами.
+Код выхода 1, если в плане есть Seq Scan по таблице больше --min-rows строк:
+
+    DATABASE_URL=postgresql://localhost/bench python bench/explain.py
+
+Запросы выполняются по-настоящему, так что сценарии с записью меняют
+данные так же, как в run.py.
+"""
+import argparse
+import os
+import random
+import re
+import sys
+
+from run import build_scenarios, load_functions
+
+EXPLAINABLE = re.compile(r'^\s*(SELECT|WITH|INSERT|UPDATE|DELETE)\b', re.IGNORECASE)
+
+_current = {'scenario': None}
+_plans = []
+
+
+def explain_cursor(base):
+    """Курсор поверх MetricsCursor функции, который сохраняет план каждого запроса"""
+
+    class ExplainCursor(base):
+        def execute(self, query, vars=None):
+            # Несколько команд в одной строке EXPLAIN не принимает
+            if isinstance(query, str) and EXPLAINABLE.match(query) and ';' not in query.strip().rstrip(';'):
+                super().execute('EXPLAIN (FORMAT JSON) ' + query, vars)
+                _plans.append((_current['scenario'], query, self.fetchone()[0][0]['Plan']))
+            return super().execute(query, vars)
+
+    return ExplainCursor
+
+
+def seq_scans(plan: dict):
+    """Все узлы Seq Scan плана вместе с вложенными"""
+    if plan['Node Type'] == 'Seq Scan':
+        yield plan
+    for child in plan.get('Plans', ()):
+        yield from seq_scans(child)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=3, help='вызовов на сценарий')
+    parser.add_argument('--min-rows', type=int, default=10_000,
+                        help='Seq Scan по таблицам меньше этого размера допустим')
+    parser.add_argument('--allow', default='', help='таблицы через запятую, которым Seq Scan разрешён')
+    parser.add_argument('--only', help='сценарии через запятую или префикс функции')
+    parser.add_argument('--active-users', type=int, default=10_000)
+    args = parser.parse_args()
+
+    if not os.environ.get('DATABASE_URL'):
+        sys.exit('Укажите DATABASE_URL засеянной базы')
+
+    random.seed(1)
+    modules = load_functions(1)
+    for module in modules.values():
+        module.MetricsCursor = explain_cursor(module.MetricsCursor)
+
+    conn = modules['posts'].get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT (SELECT MAX(id) FROM users), (SELECT MAX(id) FROM posts), (SELECT MAX(id) FROM chats)")
+            users, posts, chats = cur.fetchone()
+            cur.execute("SELECT relname, reltuples FROM pg_class WHERE relkind IN ('r', 'p')")
+            table_rows = dict(cur.fetchall())
+    finally:
+        modules['posts'].release_connection(conn)
+    if not users or not posts or not chats:
+        sys.exit('База пуста: сначала запустите bench/seed.py')
+
+    scenarios = build_scenarios(users, posts, chats, min(users, args.active_users))
+    if args.only:
+        wanted = args.only.split(',')
+        scenarios = {
+            name: scenario for name, scenario in scenarios.items()
+            if name in wanted or name.split('.')[0] in wanted
+        }
+
+    for name, (function, make_event) in scenarios.items():
+        _current['scenario'] = name
+        for _ in range(args.requests):
+            modules[function].handler(make_event(), None)
+
+    allowed = set(filter(None, args.allow.split(',')))
+    violations = {}
+    checked = {}
+    for scenario, query, plan in _plans:
+        checked[scenario] = checked.get(scenario, 0) + 1
+        for node in seq_scans(plan):
+            relation = node['Relation Name']
+            if relation in allowed or table_rows.get(relation, 0) < args.min_rows:
+                continue
+            first_line = next(line.strip() for line in query.strip().splitlines() if line.strip())
+            violations.setdefault((scenario, relation, first_line), int(table_rows[relation]))
+
+    for scenario in scenarios:
+        print(f'{scenario:28} {checked.get(scenario, 0):4} statements')
+    if violations:
+        print('\nSeq Scan на горячем пути:')
+        for (scenario, relation, first_line), rows in sorted(violations.items()):
+            print(f'  {scenario}: {relation} (~{rows} строк) в «{first_line}»')
+        sys.exit(1)
+    print('\nSeq Scan по большим таблицам не найдено')
+
+
+if __name__ == '__main__':
+    main()
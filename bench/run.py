@@ -0,0 +1,217 @@
+"""Гоняет обработчики функций напрямую против засеянной базы и пишет отчёт.
+
+Каждый сценарий вызывает handler(event, context) из backend/<функция>/index.py
+в --concurrency потоков и собирает время ответа, число запросов к базе,
+время в базе и строки результата через MetricsCursor роутера. Итог —
+p50/p95/p99 и средние по каждому сценарию — печатается и сохраняется
+в bench/results/<время>-<коммит>.json для сравнения через compare.py:
+
+    DATABASE_URL=postgresql://localhost/bench python bench/run.py --requests 500 --concurrency 16
+
+Сценарии с записью (like, unlike, comment, send, create) меняют данные базы.
+"""
+import argparse
+import importlib.util
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from seed import BENCH_PASSWORD, WORDS, chat_members, user_phone
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+FUNCTIONS = ('posts', 'messages', 'notifications', 'auth', 'admin')
+
+_sample = threading.local()
+
+
+def load_functions(concurrency: int) -> dict:
+    """Импортирует index.py каждой функции с включёнными метриками роутера"""
+    os.environ['REQUEST_METRICS'] = 'true'
+    os.environ.setdefault('SESSION_SECRET', 'bench-secret')
+    os.environ['DB_POOL_MAX_SIZE'] = str(concurrency + 1)
+    os.environ['BCRYPT_MAX_QUEUE'] = str(concurrency * 2)
+
+    modules = {}
+    for name in FUNCTIONS:
+        spec = importlib.util.spec_from_file_location(f'bench_{name}', os.path.join(ROOT, 'backend', name, 'index.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        module.record_request = capture_request
+        modules[name] = module
+    return modules
+
+
+def capture_request(action: str, cur, response, elapsed: float) -> None:
+    """Подменяет record_request роутера: метрики запроса остаются в потоке вызова"""
+    _sample.stats = (cur.queries, cur.db_time, cur.rows)
+
+
+def get(params: dict) -> dict:
+    return {'httpMethod': 'GET', 'queryStringParameters': {k: str(v) for k, v in params.items()}, 'headers': {}}
+
+
+def post(body: dict, method: str = 'POST') -> dict:
+    return {'httpMethod': method, 'body': json.dumps(body), 'headers': {}}
+
+
+def build_scenarios(users: int, posts: int, chats: int, active_users: int) -> dict:
+    """Сценарий — функция и генератор событий со случайными, но реалистичными id"""
+    def active():
+        return random.randint(1, active_users)
+
+    def anyone():
+        return random.randint(1, users)
+
+    def popular_post():
+        return 1 + int(posts * random.random() ** 3)
+
+    def chat():
+        chat_id = random.randint(1, chats)
+        return chat_id, random.choice(chat_members(chat_id, users))
+
+    return {
+        'posts.feed': ('posts', lambda: get({'action': 'feed', 'viewer_id': anyone(), 'limit': 50})),
+        'posts.home': ('posts', lambda: get({'action': 'home', 'user_id': active(), 'limit': 50})),
+        'posts.search': ('posts', lambda: get({'action': 'search', 'q': ' '.join(random.sample(WORDS, 2))})),
+        # Одно слово из словаря сида встречается в большой доле всех постов
+        'posts.search_common': ('posts', lambda: get({'action': 'search', 'q': random.choice(WORDS)})),
+        'posts.user_posts': ('posts', lambda: get({'action': 'user_posts', 'user_id': anyone()})),
+        'posts.comments': ('posts', lambda: get({'action': 'comments', 'post_id': popular_post()})),
+        'posts.comments_batch': ('posts', lambda: get({'action': 'comments', 'post_ids': ','.join(str(popular_post()) for _ in range(50))})),
+        'posts.create': ('posts', lambda: post({'action': 'create', 'user_id': active(), 'content': ' '.join(random.sample(WORDS, 8))})),
+        'posts.like': ('posts', lambda: post({'action': 'like', 'user_id': anyone(), 'post_id': popular_post()})),
+        'posts.unlike': ('posts', lambda: post({'action': 'unlike', 'user_id': anyone(), 'post_id': popular_post()})),
+        'posts.comment': ('posts', lambda: post({'action': 'comment', 'user_id': anyone(), 'post_id': popular_post(), 'content': random.choice(WORDS)})),
+        'messages.chats': ('messages', lambda: get({'action': 'chats', 'user_id': chat()[1]})),
+        'messages.messages': ('messages', lambda: get(dict(zip(('chat_id', 'user_id'), chat()), action='messages'))),
+        'messages.send': ('messages', lambda: post(dict(zip(('chat_id', 'sender_id'), chat()), action='send', content=random.choice(WORDS)))),
+        'notifications.list': ('notifications', lambda: get({'user_id': active()})),
+        'notifications.unread_count': ('notifications', lambda: get({'action': 'unread_count', 'user_id': active()})),
+        'auth.profile': ('auth', lambda: get({'user_id': anyone()})),
+        'auth.login': ('auth', lambda: post({'action': 'login', 'phone': user_phone(active()), 'password': BENCH_PASSWORD})),
+        'auth.search': ('auth', lambda: get({'action': 'search', 'q': f'bench_{random.randint(1, 999)}'})),
+        'auth.follow_state': ('auth', lambda: get({'action': 'follow_state', 'user_id': active(), 'ids': ','.join(str(anyone()) for _ in range(50))})),
+        'admin.stats': ('admin', lambda: get({'action': 'stats'})),
+        'admin.users': ('admin', lambda: get({'action': 'users', 'limit': 50})),
+    }
+
+
+def percentile(values: list, q: float) -> float:
+    """Перцентиль по ближайшему рангу для отсортированного списка"""
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+def run_scenario(handler, make_event, requests: int, warmup: int, concurrency: int) -> dict:
+    def call(_):
+        event = make_event()
+        _sample.stats = (0, 0.0, 0)
+        started = time.perf_counter()
+        try:
+            status = handler(event, None)['statusCode']
+        except Exception as e:
+            print(f'{type(e).__name__}: {e}', file=sys.stderr)
+            status = 500
+        return time.perf_counter() - started, status, _sample.stats
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(call, range(warmup)))
+        results = list(executor.map(call, range(requests)))
+
+    latencies = sorted(elapsed * 1000 for elapsed, _, _ in results)
+    errors = sum(1 for _, status, _ in results if status >= 400)
+    return {
+        'requests': requests,
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 0.50), 2),
+        'p95_ms': round(percentile(latencies, 0.95), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+        'mean_ms': round(sum(latencies) / len(latencies), 2),
+        'queries_per_request': round(sum(stats[0] for _, _, stats in results) / requests, 2),
+        'db_ms_per_request': round(sum(stats[1] for _, _, stats in results) * 1000 / requests, 2),
+        'rows_per_request': round(sum(stats[2] for _, _, stats in results) / requests, 2),
+    }
+
+
+def current_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=200, help='запросов на сценарий')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--only', help='сценарии через запятую или префикс функции, например posts')
+    parser.add_argument('--active-users', type=int, default=10_000, help='пользователи с лентами и уведомлениями: --active-users × --scale из seed.py')
+    parser.add_argument('--seed', type=int, default=1, help='seed генератора случайных id')
+    parser.add_argument('--output', help='путь к JSON с результатами')
+    args = parser.parse_args()
+
+    if not os.environ.get('DATABASE_URL'):
+        sys.exit('Укажите DATABASE_URL засеянной базы')
+
+    random.seed(args.seed)
+    modules = load_functions(args.concurrency)
+
+    conn = modules['posts'].get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT (SELECT MAX(id) FROM users), (SELECT MAX(id) FROM posts), (SELECT MAX(id) FROM chats)")
+            users, posts, chats = cur.fetchone()
+    finally:
+        modules['posts'].release_connection(conn)
+    if not users or not posts or not chats:
+        sys.exit('База пуста: сначала запустите bench/seed.py')
+
+    scenarios = build_scenarios(users, posts, chats, min(users, args.active_users))
+    if args.only:
+        wanted = args.only.split(',')
+        scenarios = {
+            name: scenario for name, scenario in scenarios.items()
+            if name in wanted or name.split('.')[0] in wanted
+        }
+
+    report = {
+        'commit': current_commit(),
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'config': {
+            'requests': args.requests,
+            'warmup': args.warmup,
+            'concurrency': args.concurrency,
+            'seed': args.seed,
+            'users': users,
+            'posts': posts,
+            'chats': chats,
+        },
+        'scenarios': {},
+    }
+
+    print(f"{'scenario':28} {'p50':>9} {'p95':>9} {'p99':>9} {'queries':>8} {'db ms':>8} {'errors':>7}")
+    for name, (function, make_event) in scenarios.items():
+        result = run_scenario(modules[function].handler, make_event, args.requests, args.warmup, args.concurrency)
+        report['scenarios'][name] = result
+        print(f"{name:28} {result['p50_ms']:9.2f} {result['p95_ms']:9.2f} {result['p99_ms']:9.2f} "
+              f"{result['queries_per_request']:8.2f} {result['db_ms_per_request']:8.2f} {result['errors']:7d}")
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{report['commit']}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f'saved {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,350 @@
+"""Наполняет локальный Postgres данными для бенчмарка.
+
+Объёмы по умолчанию: 1M пользователей, 10M постов, подписки и лайки
+со смещением к «популярным» id, 100k чатов, из которых 1% длинные.
+--scale пропорционально уменьшает всё сразу, например --scale 0.01
+для быстрой проверки. Скрипт рассчитан на пустую базу:
+
+    DATABASE_URL=postgresql://localhost/bench python bench/seed.py --migrate
+
+Триггеры и внешние ключи на время загрузки отключаются через
+session_replication_role (нужны права суперпользователя), а счётчики,
+ленты и статистика пересчитываются одним проходом в конце.
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+import bcrypt
+import psycopg2
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'db_migrations')
+MIGRATION_NAME = re.compile(r'^V(\d+)__.+\.sql$')
+# CREATE/DROP INDEX CONCURRENTLY и CALL процедур, коммитящих пачки,
+# нельзя выполнять в транзакции; такая миграция состоит из одной команды
+NON_TRANSACTIONAL = re.compile(r'^(?:CREATE|DROP) INDEX CONCURRENTLY\b|^CALL\b', re.MULTILINE)
+
+BENCH_PASSWORD = 'bench-password'
+BATCH_ROWS = 1_000_000
+
+WORDS = (
+    'привет', 'сегодня', 'город', 'музыка', 'погода', 'работа', 'фото', 'друзья', 'выходные',
+    'кофе', 'книга', 'фильм', 'поездка', 'море', 'горы', 'спорт', 'футбол', 'концерт', 'новости',
+    'проект', 'код', 'релиз', 'утро', 'вечер', 'закат', 'дождь', 'снег', 'лето', 'зима', 'весна',
+    'осень', 'кошка', 'собака', 'ужин', 'завтрак', 'праздник', 'учёба', 'экзамен', 'отпуск', 'дом'
+)
+
+
+def user_phone(user_id: int) -> str:
+    """Телефон засеянного пользователя; по нему run.py логинится"""
+    return f'+7900{user_id:07d}'
+
+
+def chat_members(chat_id: int, users: int) -> tuple:
+    """Участники засеянного чата; формула совпадает с SQL в seed_chats"""
+    first = 1 + (chat_id * 7919) % users
+    second = 1 + (chat_id * 104729 + 1) % users
+    if second == first:
+        second = first % users + 1
+    return first, second
+
+
+def apply_migrations(conn) -> None:
+    """Применяет db_migrations по порядку версий"""
+    files = sorted(
+        (int(match.group(1)), name)
+        for name in os.listdir(MIGRATIONS_DIR)
+        if (match := MIGRATION_NAME.match(name))
+    )
+    with conn.cursor() as cur:
+        for _, name in files:
+            with open(os.path.join(MIGRATIONS_DIR, name), encoding='utf-8') as f:
+                script = f.read()
+            if NON_TRANSACTIONAL.search(script):
+                # Несколько команд в одном запросе сервер выполнил бы
+                # в неявной транзакции, и CONCURRENTLY отказался бы работать
+                conn.autocommit = True
+                cur.execute(script)
+                conn.autocommit = False
+            else:
+                cur.execute(script)
+                conn.commit()
+            print(f'applied {name}')
+
+
+def step(conn, title: str, sql: str, params=None) -> None:
+    """Выполняет шаг загрузки в своей транзакции и печатает его время"""
+    started = time.monotonic()
+    with conn.cursor() as cur:
+        cur.execute("SET session_replication_role = replica")
+        cur.execute(sql, params)
+        rows = cur.rowcount
+    conn.commit()
+    print(f'{title}: {rows} rows, {time.monotonic() - started:.1f}s')
+
+
+def batched(conn, title: str, sql: str, total: int, rows_per_item: int = 1, **params) -> None:
+    """Выполняет вставку диапазонами %(lo)s..%(hi)s примерно по BATCH_ROWS строк"""
+    size = max(1, BATCH_ROWS // rows_per_item)
+    for lo in range(1, total + 1, size):
+        hi = min(lo + size - 1, total)
+        step(conn, f'{title} {lo}-{hi}', sql, {**params, 'lo': lo, 'hi': hi})
+
+
+def seed_users(conn, users: int) -> None:
+    password_hash = bcrypt.hashpw(
+        BENCH_PASSWORD.encode('utf-8'),
+        bcrypt.gensalt(rounds=int(os.environ.get('BCRYPT_ROUNDS', '12')))
+    ).decode('utf-8')
+    batched(conn, 'users', """
+        INSERT INTO users (phone, password_hash, full_name, username, is_banned, created_at)
+        SELECT
+            '+7900' || lpad(i::TEXT, 7, '0'),
+            %(password_hash)s,
+            (%(words)s::TEXT[])[1 + i %% 40] || ' ' || (%(words)s::TEXT[])[1 + (i / 40) %% 40],
+            'bench_' || i,
+            random() < 0.002,
+            CURRENT_TIMESTAMP - random() * INTERVAL '365 days'
+        FROM generate_series(%(lo)s, %(hi)s) i
+    """, users, password_hash=password_hash, words=list(WORDS))
+
+
+def seed_posts(conn, users: int, posts: int) -> None:
+    # Авторы смещены к малым id: часть пользователей пишет намного чаще остальных
+    # search_vector заполняется здесь: триггер на время загрузки отключён
+    batched(conn, 'posts', """
+        INSERT INTO posts (user_id, content, created_at, search_vector)
+        SELECT user_id, content, created_at, to_tsvector('russian', content)
+        FROM (
+            SELECT
+                1 + floor(%(users)s * power(random(), 2))::INTEGER AS user_id,
+                (
+                    SELECT string_agg((%(words)s::TEXT[])[1 + floor(random() * 40)::INTEGER], ' ')
+                    FROM generate_series(1, 6 + i %% 10)
+                ) AS content,
+                CURRENT_TIMESTAMP - random() * INTERVAL '365 days' AS created_at
+            FROM generate_series(%(lo)s, %(hi)s) i
+        ) p
+    """, posts, users=users, words=list(WORDS))
+
+
+def seed_follows(conn, users: int, per_user: int) -> None:
+    # Подписки по степенному распределению: у первых id сотни тысяч подписчиков
+    batched(conn, 'follows', """
+        INSERT INTO follows (follower_id, following_id)
+        SELECT follower_id, following_id
+        FROM (
+            SELECT f AS follower_id, 1 + floor(%(users)s * power(random(), 3))::INTEGER AS following_id
+            FROM generate_series(%(lo)s, %(hi)s) f, generate_series(1, %(per_user)s)
+        ) t
+        WHERE follower_id <> following_id
+        ON CONFLICT DO NOTHING
+    """, users, rows_per_item=per_user, users=users, per_user=per_user)
+
+
+def seed_reactions(conn, users: int, posts: int, likes: int, comments: int) -> None:
+    batched(conn, 'post_likes', """
+        INSERT INTO post_likes (post_id, user_id)
+        SELECT 1 + floor(%(posts)s * power(random(), 3))::INTEGER, 1 + floor(%(users)s * random())::INTEGER
+        FROM generate_series(%(lo)s, %(hi)s)
+        ON CONFLICT DO NOTHING
+    """, likes, users=users, posts=posts)
+    batched(conn, 'comments', """
+        INSERT INTO comments (post_id, user_id, content)
+        SELECT
+            1 + floor(%(posts)s * power(random(), 3))::INTEGER,
+            1 + floor(%(users)s * random())::INTEGER,
+            (%(words)s::TEXT[])[1 + i %% 40] || ' ' || (%(words)s::TEXT[])[1 + (i / 40) %% 40]
+        FROM generate_series(%(lo)s, %(hi)s) i
+    """, comments, users=users, posts=posts, words=list(WORDS))
+
+
+def seed_chats(conn, users: int, chats: int, messages_per_chat: int, long_chat_messages: int) -> None:
+    step(conn, 'chats', """
+        INSERT INTO chats (id, created_at)
+        SELECT c, CURRENT_TIMESTAMP - INTERVAL '400 days' FROM generate_series(1, %(chats)s) c
+    """, {'chats': chats})
+    step(conn, 'chats sequence', "SELECT setval('chats_id_seq', %(chats)s)", {'chats': chats})
+    step(conn, 'chat_participants', """
+        WITH pairs AS (
+            SELECT c, 1 + (c::BIGINT * 7919) %% %(users)s AS a, 1 + (c::BIGINT * 104729 + 1) %% %(users)s AS b
+            FROM generate_series(1, %(chats)s) c
+        )
+        INSERT INTO chat_participants (chat_id, user_id)
+        SELECT c, a FROM pairs
+        UNION ALL
+        SELECT c, CASE WHEN b = a THEN a %% %(users)s + 1 ELSE b END FROM pairs
+    """, {'chats': chats, 'users': users})
+    # Первый процент чатов — длинные переписки
+    long_chats = max(1, chats // 100)
+    for title, first, last, count in (
+        ('messages (long chats)', 1, long_chats, long_chat_messages),
+        ('messages', long_chats + 1, chats, messages_per_chat),
+    ):
+        size = max(1, BATCH_ROWS // count)
+        for lo in range(first, last + 1, size):
+            hi = min(lo + size - 1, last)
+            step(conn, f'{title} {lo}-{hi}', """
+                INSERT INTO messages (chat_id, sender_id, content, created_at)
+                SELECT
+                    cp.chat_id,
+                    cp.user_id,
+                    (%(words)s::TEXT[])[1 + floor(random() * 40)::INTEGER],
+                    CURRENT_TIMESTAMP - (%(count)s - j) * INTERVAL '1 minute'
+                FROM generate_series(%(lo)s, %(hi)s) c
+                CROSS JOIN generate_series(1, %(count)s) j
+                JOIN LATERAL (
+                    SELECT chat_id, user_id FROM chat_participants
+                    WHERE chat_id = c
+                    ORDER BY user_id
+                    OFFSET j %% 2 LIMIT 1
+                ) cp ON TRUE
+                ORDER BY c, j
+            """, {'lo': lo, 'hi': hi, 'count': count, 'words': list(WORDS)})
+
+
+def seed_notifications(conn, active_users: int, per_user: int) -> None:
+    step(conn, 'notification partitions', "SELECT ensure_notification_partitions(CURRENT_DATE - 90, 3)")
+    step(conn, 'notifications', """
+        INSERT INTO notifications (user_id, type, content, related_user_id, is_read, created_at, group_key)
+        SELECT u, 'follow', 'подписался на вас', u %% %(active_users)s + 1, random() < 0.7,
+               CURRENT_TIMESTAMP - random() * INTERVAL '60 days', NULL
+        FROM generate_series(1, %(active_users)s) u, generate_series(1, %(per_user)s)
+    """, {'active_users': active_users, 'per_user': per_user})
+
+
+def finish(conn, timeline_users: int) -> None:
+    """Пересчитывает всё, что в работе поддерживают триггеры и обработчики"""
+    step(conn, 'likes_count', """
+        UPDATE posts p SET likes_count = s.n
+        FROM (SELECT post_id, COUNT(*) AS n FROM post_likes GROUP BY post_id) s
+        WHERE p.id = s.post_id
+    """)
+    step(conn, 'comments_count', """
+        UPDATE posts p SET comments_count = s.n
+        FROM (SELECT post_id, COUNT(*) AS n FROM comments GROUP BY post_id) s
+        WHERE p.id = s.post_id
+    """)
+    step(conn, 'followers_count', """
+        UPDATE users u SET followers_count = s.n
+        FROM (SELECT following_id, COUNT(*) AS n FROM follows GROUP BY following_id) s
+        WHERE u.id = s.following_id
+    """)
+    step(conn, 'following_count', """
+        UPDATE users u SET following_count = s.n
+        FROM (SELECT follower_id, COUNT(*) AS n FROM follows GROUP BY follower_id) s
+        WHERE u.id = s.follower_id
+    """)
+    step(conn, 'fanout_on_read', """
+        UPDATE users SET fanout_on_read = TRUE
+        WHERE followers_count > %(threshold)s
+    """, {'threshold': int(os.environ.get('HOME_FANOUT_MAX_FOLLOWERS', '5000'))})
+    step(conn, 'home_timeline', """
+        INSERT INTO home_timeline (user_id, post_id, created_at)
+        SELECT f.follower_id, p.id, p.created_at
+        FROM follows f
+        JOIN users a ON a.id = f.following_id AND NOT a.fanout_on_read
+        CROSS JOIN LATERAL (
+            SELECT id, created_at FROM posts
+            WHERE user_id = f.following_id
+            ORDER BY created_at DESC, id DESC
+            LIMIT 20
+        ) p
+        WHERE f.follower_id <= %(timeline_users)s
+        ON CONFLICT DO NOTHING
+    """, {'timeline_users': timeline_users})
+    step(conn, 'chat last message', """
+        UPDATE chats c SET last_message_id = m.id, last_message_at = m.created_at
+        FROM (
+            SELECT DISTINCT ON (chat_id) chat_id, id, created_at
+            FROM messages
+            ORDER BY chat_id, id DESC
+        ) m
+        WHERE c.id = m.chat_id
+    """)
+    step(conn, 'chat read cursors', """
+        UPDATE chat_participants cp
+        SET last_read_message_id = COALESCE(c.last_message_id - (cp.user_id %% 5), 0),
+            last_message_at = c.last_message_at
+        FROM chats c
+        WHERE c.id = cp.chat_id
+    """, {})
+    step(conn, 'stats counters', """
+        TRUNCATE stats_counters, daily_stats, daily_active_users;
+        INSERT INTO stats_counters (name, slot, value)
+        SELECT 'users_count', 0, COUNT(*) FROM users
+        UNION ALL SELECT 'banned_count', 0, COUNT(*) FROM users WHERE is_banned
+        UNION ALL SELECT 'posts_count', 0, COUNT(*) FROM posts
+        UNION ALL SELECT 'messages_count', 0, COUNT(*) FROM messages;
+        INSERT INTO daily_stats (day, metric, slot, value)
+        SELECT created_at::DATE, 'new_users', 0, COUNT(*) FROM users GROUP BY 1
+        UNION ALL SELECT created_at::DATE, 'posts', 0, COUNT(*) FROM posts GROUP BY 1
+        UNION ALL SELECT created_at::DATE, 'messages', 0, COUNT(*) FROM messages GROUP BY 1;
+        INSERT INTO daily_active_users (day, user_id)
+        SELECT created_at::DATE, user_id FROM posts WHERE created_at >= CURRENT_DATE - 90
+        UNION SELECT created_at::DATE, sender_id FROM messages WHERE created_at >= CURRENT_DATE - 90;
+        INSERT INTO daily_stats (day, metric, slot, value)
+        SELECT day, 'active_users', 0, COUNT(*) FROM daily_active_users GROUP BY day
+    """)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        started = time.monotonic()
+        cur.execute("VACUUM ANALYZE")
+        print(f'vacuum analyze: {time.monotonic() - started:.1f}s')
+    conn.autocommit = False
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--migrate', action='store_true', help='сначала применить db_migrations')
+    parser.add_argument('--scale', type=float, default=1.0)
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--posts', type=int, default=10_000_000)
+    parser.add_argument('--follows-per-user', type=int, default=20)
+    parser.add_argument('--likes', type=int, default=20_000_000)
+    parser.add_argument('--comments', type=int, default=5_000_000)
+    parser.add_argument('--chats', type=int, default=100_000)
+    parser.add_argument('--messages-per-chat', type=int, default=30)
+    parser.add_argument('--long-chat-messages', type=int, default=5_000)
+    parser.add_argument('--active-users', type=int, default=10_000,
+                        help='у скольких первых пользователей собрать home_timeline и уведомления')
+    parser.add_argument('--notifications-per-user', type=int, default=50)
+    args = parser.parse_args()
+
+    if not args.dsn:
+        sys.exit('Укажите --dsn или DATABASE_URL')
+
+    def scaled(value: int) -> int:
+        return max(1, int(value * args.scale))
+
+    users = scaled(args.users)
+    active_users = min(users, scaled(args.active_users))
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        if args.migrate:
+            apply_migrations(conn)
+
+        with conn.cursor() as cur:
+            cur.execute("SELECT EXISTS (SELECT 1 FROM users)")
+            if cur.fetchone()[0]:
+                sys.exit('В базе уже есть пользователи: seed.py рассчитан на пустую базу')
+
+        started = time.monotonic()
+        seed_users(conn, users)
+        seed_posts(conn, users, scaled(args.posts))
+        seed_follows(conn, users, args.follows_per_user)
+        seed_reactions(conn, users, scaled(args.posts), scaled(args.likes), scaled(args.comments))
+        seed_chats(conn, users, scaled(args.chats), args.messages_per_chat, args.long_chat_messages)
+        seed_notifications(conn, active_users, args.notifications_per_user)
+        finish(conn, active_users)
+        print(f'done in {time.monotonic() - started:.1f}s')
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,3 @@
+-- Индекс для keyset-пагинации общей ленты по (created_at, id).
+-- Строится без блокировки записи, поэтому выполняется вне транзакции.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_posts_created_at_id ON posts(created_at DESC, id DESC);
@@ -0,0 +1,29 @@
+-- Денормализованные счётчики лайков и комментариев постов
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS likes_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS comments_count INTEGER NOT NULL DEFAULT 0;
+
+-- Заполняет счётчики по существующим данным пачками по id. Каждая пачка
+-- коммитится отдельно, чтобы не переписывать всю posts одной транзакцией.
+-- Процедура вызывается отдельной миграцией вне транзакции (V0034) после
+-- индекса comments(post_id) из V0033 и удаляется в V0035.
+CREATE OR REPLACE PROCEDURE backfill_post_counters(batch_size INTEGER)
+LANGUAGE plpgsql AS $$
+DECLARE
+    last_id INTEGER := 0;
+    batch_last_id INTEGER;
+BEGIN
+    LOOP
+        SELECT MAX(id) INTO batch_last_id
+        FROM (SELECT id FROM posts WHERE id > last_id ORDER BY id LIMIT batch_size) b;
+        EXIT WHEN batch_last_id IS NULL;
+
+        UPDATE posts p SET
+            likes_count = (SELECT COUNT(*) FROM post_likes pl WHERE pl.post_id = p.id),
+            comments_count = (SELECT COUNT(*) FROM comments c WHERE c.post_id = p.id)
+        WHERE p.id > last_id AND p.id <= batch_last_id;
+        COMMIT;
+
+        last_id := batch_last_id;
+    END LOOP;
+END;
+$$;
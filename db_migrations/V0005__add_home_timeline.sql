@@ -0,0 +1,52 @@
+-- Материализованная домашняя лента: посты тех, на кого подписан пользователь.
+-- Таблица новая и пустая, поэтому её индекс строится обычным CREATE INDEX.
+CREATE TABLE IF NOT EXISTS home_timeline (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    post_id INTEGER NOT NULL REFERENCES posts(id),
+    created_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (user_id, post_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_home_timeline_user_created ON home_timeline(user_id, created_at DESC, post_id DESC);
+
+-- Авторы с большим числом подписчиков читаются из posts при запросе ленты
+ALTER TABLE users ADD COLUMN IF NOT EXISTS fanout_on_read BOOLEAN NOT NULL DEFAULT FALSE;
+
+-- Заполняет ленты по существующим постам пачками по id поста: подписчикам —
+-- последние 100 постов каждого автора, автору — все его посты. Каждая пачка
+-- коммитится отдельно. Процедура вызывается отдельной миграцией вне
+-- транзакции (V0038) после индексов V0036–V0037 и удаляется в V0039.
+CREATE OR REPLACE PROCEDURE backfill_home_timeline(batch_size INTEGER)
+LANGUAGE plpgsql AS $$
+DECLARE
+    last_id INTEGER := 0;
+    batch_last_id INTEGER;
+BEGIN
+    LOOP
+        SELECT MAX(id) INTO batch_last_id
+        FROM (SELECT id FROM posts WHERE id > last_id ORDER BY id LIMIT batch_size) b;
+        EXIT WHEN batch_last_id IS NULL;
+
+        INSERT INTO home_timeline (user_id, post_id, created_at)
+        SELECT f.follower_id, p.id, p.created_at
+        FROM posts p
+        JOIN follows f ON f.following_id = p.user_id
+        WHERE p.id > last_id AND p.id <= batch_last_id
+          AND p.id IN (
+              SELECT id FROM posts
+              WHERE user_id = p.user_id
+              ORDER BY created_at DESC, id DESC
+              LIMIT 100
+          )
+        ON CONFLICT DO NOTHING;
+
+        INSERT INTO home_timeline (user_id, post_id, created_at)
+        SELECT user_id, id, created_at FROM posts
+        WHERE id > last_id AND id <= batch_last_id AND user_id IS NOT NULL
+        ON CONFLICT DO NOTHING;
+        COMMIT;
+
+        last_id := batch_last_id;
+    END LOOP;
+END;
+$$;
@@ -0,0 +1,3 @@
+-- Инкрементальная подгрузка сообщений чата по (chat_id, id).
+-- Строится без блокировки записи, поэтому выполняется вне транзакции.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_chat_id_id ON messages(chat_id, id);
@@ -0,0 +1,10 @@
+-- Курсор прочтения участника чата вместо флага is_read у каждого сообщения
+ALTER TABLE chat_participants ADD COLUMN IF NOT EXISTS last_read_message_id INTEGER NOT NULL DEFAULT 0;
+
+-- Курсор встаёт перед первым непрочитанным входящим сообщением
+UPDATE chat_participants cp SET last_read_message_id = COALESCE(
+    (SELECT MIN(m.id) - 1 FROM messages m
+     WHERE m.chat_id = cp.chat_id AND m.sender_id != cp.user_id AND m.is_read = FALSE),
+    (SELECT MAX(m.id) FROM messages m WHERE m.chat_id = cp.chat_id),
+    0
+);
@@ -0,0 +1,15 @@
+-- Последнее сообщение чата хранится в самом чате и обновляется при отправке
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS last_message_id INTEGER REFERENCES messages(id);
+-- Для чатов без сообщений last_message_at совпадает с временем создания чата
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS last_message_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP;
+
+UPDATE chats c SET last_message_id = m.id, last_message_at = m.created_at
+FROM (
+    SELECT DISTINCT ON (chat_id) chat_id, id, created_at
+    FROM messages
+    ORDER BY chat_id, id DESC
+) m
+WHERE m.chat_id = c.id;
+
+UPDATE chats SET last_message_at = created_at
+WHERE last_message_id IS NULL AND created_at IS NOT NULL;
@@ -0,0 +1,21 @@
+-- Очередь событий для уведомлений: запись в запросе, разбор пачками воркером.
+-- Таблица новая и пустая, поэтому её индекс строится обычным CREATE INDEX.
+CREATE TABLE IF NOT EXISTS notification_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    type VARCHAR(50) NOT NULL,
+    content TEXT NOT NULL,
+    related_user_id INTEGER,
+    related_post_id INTEGER,
+    group_key VARCHAR(100) NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_notification_outbox_user_id ON notification_outbox(user_id, id);
+
+-- Повторяющиеся события схлопываются в одно уведомление группы
+ALTER TABLE notifications ADD COLUMN IF NOT EXISTS group_key VARCHAR(100);
+ALTER TABLE notifications ADD COLUMN IF NOT EXISTS group_count INTEGER NOT NULL DEFAULT 1;
+
+-- Индекс непрочитанных групп строится на секционированной таблице в V0011:
+-- нынешняя notifications после переноса данных удаляется
@@ -0,0 +1,107 @@
+-- Помесячное секционирование уведомлений по created_at без долгой блокировки:
+-- здесь создаётся пустая секционированная notifications_partitioned, строки
+-- переносятся пачками по id в V0043, а в V0044 короткая транзакция
+-- досинхронизирует изменённые за время переноса строки и меняет таблицы местами.
+CREATE TABLE notifications_partitioned (
+    id INTEGER NOT NULL DEFAULT nextval('notifications_id_seq'),
+    user_id INTEGER REFERENCES users(id),
+    type VARCHAR(50) NOT NULL,
+    content TEXT NOT NULL,
+    related_user_id INTEGER REFERENCES users(id),
+    related_post_id INTEGER REFERENCES posts(id),
+    is_read BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    group_key VARCHAR(100),
+    group_count INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- Секция по умолчанию принимает строки вне созданных месяцев
+-- и непрочитанные уведомления из секций, снятых по сроку хранения
+CREATE TABLE notifications_default PARTITION OF notifications_partitioned DEFAULT;
+
+-- Создаёт недостающие месячные секции parent_table от from_month до текущего месяца + months_ahead
+CREATE OR REPLACE FUNCTION ensure_notification_partitions(from_month DATE, months_ahead INTEGER, parent_table TEXT DEFAULT 'notifications')
+RETURNS INTEGER AS $$
+DECLARE
+    month_start DATE := date_trunc('month', from_month)::DATE;
+    last_month DATE := (date_trunc('month', CURRENT_DATE) + make_interval(months => months_ahead))::DATE;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    WHILE month_start <= last_month LOOP
+        partition_name := 'notifications_' || to_char(month_start, 'YYYY_MM');
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                partition_name, parent_table, month_start, (month_start + INTERVAL '1 month')::DATE
+            );
+            created := created + 1;
+        END IF;
+        month_start := (month_start + INTERVAL '1 month')::DATE;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Первые месяцы берутся по самой ранней строке первичного ключа, без чтения
+-- всей таблицы; более старые строки попадут в секцию по умолчанию
+SELECT ensure_notification_partitions(
+    COALESCE((SELECT created_at FROM notifications ORDER BY id LIMIT 1)::DATE, CURRENT_DATE),
+    3,
+    'notifications_partitioned'
+);
+
+-- Таблица пока пустая, поэтому индексы строятся сразу
+CREATE INDEX IF NOT EXISTS idx_notifications_user_created ON notifications_partitioned(user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_notifications_user_unread ON notifications_partitioned(user_id) WHERE is_read = FALSE;
+CREATE INDEX IF NOT EXISTS idx_notifications_unread_group ON notifications_partitioned(user_id, group_key) WHERE is_read = FALSE;
+
+-- id строк, вставленных, изменённых или удалённых в notifications после этой
+-- миграции: V0044 переносит их заново в транзакции перестановки таблиц
+CREATE TABLE notifications_partition_changes (
+    id INTEGER PRIMARY KEY
+);
+
+CREATE OR REPLACE FUNCTION track_notification_changes() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO notifications_partition_changes (id)
+    VALUES (CASE WHEN TG_OP = 'DELETE' THEN OLD.id ELSE NEW.id END)
+    ON CONFLICT DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER notifications_track_changes
+    AFTER INSERT OR UPDATE OR DELETE ON notifications
+    FOR EACH ROW EXECUTE FUNCTION track_notification_changes();
+
+-- Копирует строки notifications в notifications_partitioned пачками по id.
+-- Каждая пачка коммитится отдельно; строки, изменённые после копирования,
+-- записаны в notifications_partition_changes. Процедура вызывается отдельной
+-- миграцией вне транзакции (V0043) и удаляется в V0044.
+CREATE OR REPLACE PROCEDURE copy_notifications_to_partitioned(batch_size INTEGER)
+LANGUAGE plpgsql AS $$
+DECLARE
+    last_id INTEGER := 0;
+    batch_last_id INTEGER;
+BEGIN
+    LOOP
+        SELECT MAX(id) INTO batch_last_id
+        FROM (SELECT id FROM notifications WHERE id > last_id ORDER BY id LIMIT batch_size) b;
+        EXIT WHEN batch_last_id IS NULL;
+
+        INSERT INTO notifications_partitioned (id, user_id, type, content, related_user_id, related_post_id, is_read, created_at, group_key, group_count)
+        SELECT id, user_id, type, content, related_user_id, related_post_id, is_read, COALESCE(created_at, CURRENT_TIMESTAMP), group_key, group_count
+        FROM notifications
+        WHERE id > last_id AND id <= batch_last_id
+        ON CONFLICT DO NOTHING;
+        COMMIT;
+
+        last_id := batch_last_id;
+    END LOOP;
+END;
+$$;
+
+-- Схема для архивных секций, снятых по сроку хранения
+CREATE SCHEMA IF NOT EXISTS notifications_archive;
@@ -0,0 +1,7 @@
+-- Отзыв токенов сессий: токены пользователя, выпущенные до revoked_at, недействительны
+CREATE TABLE IF NOT EXISTS session_revocations (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id),
+    revoked_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_session_revocations_revoked_at ON session_revocations(revoked_at);
@@ -0,0 +1,40 @@
+-- Хранимые счётчики подписчиков и подписок пользователя
+ALTER TABLE users ADD COLUMN IF NOT EXISTS followers_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS following_count INTEGER NOT NULL DEFAULT 0;
+
+UPDATE users u SET
+    followers_count = (SELECT COUNT(*) FROM follows f WHERE f.following_id = u.id),
+    following_count = (SELECT COUNT(*) FROM follows f WHERE f.follower_id = u.id);
+
+-- Счётчики меняются вместе с подпиской, кто бы её ни создал или удалил
+CREATE OR REPLACE FUNCTION update_follow_counters() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE users SET following_count = following_count + 1 WHERE id = NEW.follower_id;
+        UPDATE users SET followers_count = followers_count + 1 WHERE id = NEW.following_id;
+    ELSE
+        UPDATE users SET following_count = following_count - 1 WHERE id = OLD.follower_id;
+        UPDATE users SET followers_count = followers_count - 1 WHERE id = OLD.following_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS follows_update_counters ON follows;
+CREATE TRIGGER follows_update_counters
+    AFTER INSERT OR DELETE ON follows
+    FOR EACH ROW EXECUTE FUNCTION update_follow_counters();
+
+-- Любое изменение пользователя сбрасывает его профиль в кешах функций
+CREATE OR REPLACE FUNCTION notify_profile_invalidate() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('profile_invalidate', NEW.id::TEXT);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS users_profile_invalidate ON users;
+CREATE TRIGGER users_profile_invalidate
+    AFTER UPDATE ON users
+    FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*)
+    EXECUTE FUNCTION notify_profile_invalidate();
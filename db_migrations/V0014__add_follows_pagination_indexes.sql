@@ -0,0 +1,4 @@
+-- Постраничные списки подписчиков и подписок по id подписки. Индексы строятся
+-- без блокировки записи, поэтому каждый выполняется вне транзакции; индекс
+-- по follower_id — V0045, старые одноколоночные снимаются в V0046–V0047.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_follows_following_id ON follows(following_id, id DESC);
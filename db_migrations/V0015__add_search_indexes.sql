@@ -0,0 +1,21 @@
+-- Полнотекстовый поиск по постам (русская морфология).
+-- Обычный столбец вместо GENERATED ... STORED: тот перезаписал бы всю таблицу
+-- posts под ACCESS EXCLUSIVE. Новые и изменённые посты заполняет триггер,
+-- существующие — пачками процедурой из V0026 (вызов в V0048), индексы
+-- строятся CONCURRENTLY в V0027–V0029.
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS search_vector TSVECTOR;
+
+CREATE OR REPLACE FUNCTION posts_search_vector() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.search_vector := to_tsvector('russian', COALESCE(NEW.content, ''));
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS posts_search_vector ON posts;
+CREATE TRIGGER posts_search_vector
+    BEFORE INSERT OR UPDATE OF content ON posts
+    FOR EACH ROW EXECUTE FUNCTION posts_search_vector();
+
+-- Триграммы для поиска пользователей по имени с опечатками и по префиксу
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
@@ -0,0 +1,5 @@
+-- Keyset-пагинация списка пользователей в админке по (created_at, id).
+-- Индексы строятся без блокировки записи отдельными миграциями вне
+-- транзакции: V0050 и V0051.
+UPDATE users SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL;
+ALTER TABLE users ALTER COLUMN created_at SET NOT NULL;
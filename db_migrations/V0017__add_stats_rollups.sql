@@ -0,0 +1,159 @@
+-- Итоговые счётчики для админки. Каждый счётчик разбит на 16 слотов по номеру
+-- backend-процесса, чтобы параллельные вставки не выстраивались в очередь
+-- за одной строкой; значение счётчика — сумма его слотов.
+CREATE TABLE IF NOT EXISTS stats_counters (
+    name VARCHAR(50) NOT NULL,
+    slot SMALLINT NOT NULL,
+    value BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (name, slot)
+);
+
+-- Дневные ряды: new_users, posts, messages, active_users
+CREATE TABLE IF NOT EXISTS daily_stats (
+    day DATE NOT NULL,
+    metric VARCHAR(50) NOT NULL,
+    slot SMALLINT NOT NULL,
+    value BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, metric, slot)
+);
+
+-- Кто был активен в какой день: нужен только для подсчёта уникальных за день
+CREATE TABLE IF NOT EXISTS daily_active_users (
+    day DATE NOT NULL,
+    user_id INTEGER NOT NULL,
+    PRIMARY KEY (day, user_id)
+);
+
+CREATE OR REPLACE FUNCTION bump_stat(p_name VARCHAR, p_delta BIGINT) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO stats_counters (name, slot, value)
+    VALUES (p_name, pg_backend_pid() % 16, p_delta)
+    ON CONFLICT (name, slot) DO UPDATE SET value = stats_counters.value + EXCLUDED.value;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION bump_daily_stat(p_day DATE, p_metric VARCHAR) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO daily_stats (day, metric, slot, value)
+    VALUES (p_day, p_metric, pg_backend_pid() % 16, 1)
+    ON CONFLICT (day, metric, slot) DO UPDATE SET value = daily_stats.value + 1;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION record_activity(p_user_id INTEGER, p_at TIMESTAMP) RETURNS VOID AS $$
+BEGIN
+    IF p_user_id IS NULL THEN
+        RETURN;
+    END IF;
+    INSERT INTO daily_active_users (day, user_id)
+    VALUES (COALESCE(p_at, CURRENT_TIMESTAMP)::DATE, p_user_id)
+    ON CONFLICT DO NOTHING;
+    IF FOUND THEN
+        PERFORM bump_daily_stat(COALESCE(p_at, CURRENT_TIMESTAMP)::DATE, 'active_users');
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION update_user_stats() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM bump_stat('users_count', 1);
+        PERFORM bump_daily_stat(NEW.created_at::DATE, 'new_users');
+        IF NEW.is_banned THEN
+            PERFORM bump_stat('banned_count', 1);
+        END IF;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM bump_stat('users_count', -1);
+        IF OLD.is_banned THEN
+            PERFORM bump_stat('banned_count', -1);
+        END IF;
+    ELSIF NEW.is_banned IS DISTINCT FROM OLD.is_banned THEN
+        PERFORM bump_stat('banned_count', CASE WHEN NEW.is_banned THEN 1 ELSE -1 END);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS users_update_stats ON users;
+CREATE TRIGGER users_update_stats
+    AFTER INSERT OR DELETE OR UPDATE OF is_banned ON users
+    FOR EACH ROW EXECUTE FUNCTION update_user_stats();
+
+CREATE OR REPLACE FUNCTION update_post_stats() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM bump_stat('posts_count', 1);
+        PERFORM bump_daily_stat(NEW.created_at::DATE, 'posts');
+        PERFORM record_activity(NEW.user_id, NEW.created_at);
+    ELSE
+        PERFORM bump_stat('posts_count', -1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS posts_update_stats ON posts;
+CREATE TRIGGER posts_update_stats
+    AFTER INSERT OR DELETE ON posts
+    FOR EACH ROW EXECUTE FUNCTION update_post_stats();
+
+CREATE OR REPLACE FUNCTION update_message_stats() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM bump_stat('messages_count', 1);
+        PERFORM bump_daily_stat(NEW.created_at::DATE, 'messages');
+        PERFORM record_activity(NEW.sender_id, NEW.created_at);
+    ELSE
+        PERFORM bump_stat('messages_count', -1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS messages_update_stats ON messages;
+CREATE TRIGGER messages_update_stats
+    AFTER INSERT OR DELETE ON messages
+    FOR EACH ROW EXECUTE FUNCTION update_message_stats();
+
+-- Лайки и комментарии не считаются отдельно, но делают пользователя активным
+CREATE OR REPLACE FUNCTION record_row_activity() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM record_activity(NEW.user_id, NEW.created_at);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS comments_record_activity ON comments;
+CREATE TRIGGER comments_record_activity
+    AFTER INSERT ON comments
+    FOR EACH ROW EXECUTE FUNCTION record_row_activity();
+
+DROP TRIGGER IF EXISTS post_likes_record_activity ON post_likes;
+CREATE TRIGGER post_likes_record_activity
+    AFTER INSERT ON post_likes
+    FOR EACH ROW EXECUTE FUNCTION record_row_activity();
+
+-- Начальные значения по существующим данным
+INSERT INTO stats_counters (name, slot, value)
+SELECT 'users_count', 0, COUNT(*) FROM users
+UNION ALL SELECT 'banned_count', 0, COUNT(*) FROM users WHERE is_banned
+UNION ALL SELECT 'posts_count', 0, COUNT(*) FROM posts
+UNION ALL SELECT 'messages_count', 0, COUNT(*) FROM messages
+ON CONFLICT (name, slot) DO NOTHING;
+
+INSERT INTO daily_stats (day, metric, slot, value)
+SELECT created_at::DATE, 'new_users', 0, COUNT(*) FROM users GROUP BY 1
+UNION ALL SELECT created_at::DATE, 'posts', 0, COUNT(*) FROM posts GROUP BY 1
+UNION ALL SELECT created_at::DATE, 'messages', 0, COUNT(*) FROM messages GROUP BY 1
+ON CONFLICT (day, metric, slot) DO NOTHING;
+
+INSERT INTO daily_active_users (day, user_id)
+SELECT created_at::DATE, user_id FROM posts WHERE created_at >= CURRENT_DATE - 90 AND user_id IS NOT NULL
+UNION SELECT created_at::DATE, sender_id FROM messages WHERE created_at >= CURRENT_DATE - 90 AND sender_id IS NOT NULL
+UNION SELECT created_at::DATE, user_id FROM comments WHERE created_at >= CURRENT_DATE - 90 AND user_id IS NOT NULL
+UNION SELECT created_at::DATE, user_id FROM post_likes WHERE created_at >= CURRENT_DATE - 90 AND user_id IS NOT NULL
+ON CONFLICT DO NOTHING;
+
+INSERT INTO daily_stats (day, metric, slot, value)
+SELECT day, 'active_users', 0, COUNT(*) FROM daily_active_users GROUP BY day
+ON CONFLICT (day, metric, slot) DO NOTHING;
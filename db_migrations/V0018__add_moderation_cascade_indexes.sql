@@ -0,0 +1,6 @@
+-- Каскадная блокировка удаляет контент пользователя и ссылки на его посты.
+-- Уведомления к этому моменту ещё копируются в секционированную таблицу
+-- из V0011: она пуста, поэтому индекс строится сразу и переезжает вместе
+-- с ней в V0044. Индексы comments и home_timeline строятся без блокировки
+-- записи отдельными миграциями вне транзакции: V0052 и V0053.
+CREATE INDEX IF NOT EXISTS idx_notifications_related_post ON notifications_partitioned(related_post_id) WHERE related_post_id IS NOT NULL;
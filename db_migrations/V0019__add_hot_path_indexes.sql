@@ -0,0 +1,13 @@
+-- Индексы строятся и снимаются CONCURRENTLY, без блокировки записи, поэтому
+-- каждая команда — отдельная миграция вне транзакции; лишние индексы
+-- снимаются в V0054–V0056.
+--
+-- Остальные индексы горячих путей уже есть: post_likes(post_id) и
+-- chat_participants(chat_id) — ведущие колонки уникальных ключей,
+-- comments(post_id) — V0033, posts(created_at, id) — V0003,
+-- messages(chat_id, id) — V0040 (сообщения листаются по id, а не по
+-- created_at), notifications(user_id, created_at, id) — V0011.
+-- Проверка планов: bench/explain.py.
+
+-- Фильтр admin=true в списке пользователей админки
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_admin_created ON users(created_at DESC, id DESC) WHERE is_admin;
@@ -0,0 +1,5 @@
+-- Комментарии поста листаются по id: индекс отдаёт страницу и первые N
+-- комментариев каждого поста без сортировки. Строится без блокировки записи,
+-- поэтому выполняется вне транзакции; покрытый им comments(post_id)
+-- снимается в V0057, после заполнения счётчиков в V0034.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_comments_post_id_id ON comments(post_id, id);
@@ -0,0 +1,4 @@
+-- liked_by_me для страницы ленты ищет лайки смотрящего по списку постов:
+-- уникальный ключ (post_id, user_id) для этого поиска начинается не с той колонки.
+-- Строится без блокировки записи, поэтому выполняется вне транзакции.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_post_likes_user_post ON post_likes(user_id, post_id);
@@ -0,0 +1,9 @@
+-- Время последнего сообщения дублируется в строку участника, чтобы список
+-- чатов листался по одному индексу участника, а не сортировал все его чаты.
+-- Значение по умолчанию не изменчивое, поэтому столбец добавляется без
+-- перезаписи таблицы; новые чаты получают время создания, как и chats.
+ALTER TABLE chat_participants ADD COLUMN IF NOT EXISTS last_message_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP;
+
+UPDATE chat_participants cp SET last_message_at = c.last_message_at
+FROM chats c
+WHERE c.id = cp.chat_id AND cp.last_message_at IS DISTINCT FROM c.last_message_at;
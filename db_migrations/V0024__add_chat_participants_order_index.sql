@@ -0,0 +1,3 @@
+-- Страница списка чатов: keyset по (last_message_at, chat_id) участника.
+-- Строится без блокировки записи, поэтому выполняется вне транзакции.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_chat_participants_user_last_message ON chat_participants(user_id, last_message_at DESC, chat_id DESC);
@@ -0,0 +1,9 @@
+-- Номер последнего слияния событий в уведомление: берётся из той же
+-- последовательности, что и id, поэтому poll догоняет и новые уведомления,
+-- и пополнившиеся группы по одному since_id. Столбец без значения
+-- по умолчанию добавляется без перезаписи секций.
+ALTER TABLE notifications ADD COLUMN IF NOT EXISTS update_seq BIGINT;
+
+-- Секционированная копия из V0011 получает столбец до переноса: V0044
+-- переносит update_seq изменённых за время копирования строк.
+ALTER TABLE notifications_partitioned ADD COLUMN IF NOT EXISTS update_seq BIGINT;
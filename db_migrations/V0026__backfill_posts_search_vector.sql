@@ -0,0 +1,23 @@
+-- Заполняет search_vector у постов, созданных до V0015, пачками по id.
+-- Каждая пачка коммитится отдельно, чтобы не держать блокировки строк
+-- до конца миграции, поэтому процедура вызывается отдельной миграцией
+-- вне транзакции (V0048) и удаляется в V0049.
+CREATE OR REPLACE PROCEDURE backfill_posts_search_vector(batch_size INTEGER)
+LANGUAGE plpgsql AS $$
+DECLARE
+    last_id INTEGER := 0;
+    batch_last_id INTEGER;
+BEGIN
+    LOOP
+        SELECT MAX(id) INTO batch_last_id
+        FROM (SELECT id FROM posts WHERE id > last_id ORDER BY id LIMIT batch_size) b;
+        EXIT WHEN batch_last_id IS NULL;
+
+        UPDATE posts SET search_vector = to_tsvector('russian', COALESCE(content, ''))
+        WHERE id > last_id AND id <= batch_last_id AND search_vector IS NULL;
+        COMMIT;
+
+        last_id := batch_last_id;
+    END LOOP;
+END;
+$$;
@@ -0,0 +1,3 @@
+-- Полнотекстовый поиск постов; строится без блокировки записи,
+-- поэтому выполняется вне транзакции.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_posts_search_vector ON posts USING GIN (search_vector);
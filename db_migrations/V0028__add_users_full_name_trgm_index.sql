@@ -0,0 +1,3 @@
+-- Поиск пользователей по имени (%, ILIKE); строится без блокировки записи,
+-- поэтому выполняется вне транзакции.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_full_name_trgm ON users USING GIN (full_name gin_trgm_ops);
@@ -0,0 +1,3 @@
+-- Поиск пользователей по username (%, ILIKE); строится без блокировки записи,
+-- поэтому выполняется вне транзакции.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_username_trgm ON users USING GIN (username gin_trgm_ops);
@@ -0,0 +1,5 @@
+-- Курсор ленты строится из created_at последнего поста, а NULL в
+-- ORDER BY created_at DESC идёт первым. Ограничение NOT VALID проверяет
+-- только новые строки и ставится без чтения таблицы; старые строки
+-- заполняются и проверяются в V0031, NOT NULL ставится в V0032.
+ALTER TABLE posts ADD CONSTRAINT posts_created_at_not_null CHECK (created_at IS NOT NULL) NOT VALID;
@@ -0,0 +1,3 @@
+-- Проверка читает всю таблицу, но не блокирует запись в posts
+UPDATE posts SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL;
+ALTER TABLE posts VALIDATE CONSTRAINT posts_created_at_not_null;
@@ -0,0 +1,3 @@
+-- Проверенное ограничение избавляет SET NOT NULL от повторного чтения таблицы
+ALTER TABLE posts ALTER COLUMN created_at SET NOT NULL;
+ALTER TABLE posts DROP CONSTRAINT posts_created_at_not_null;
@@ -0,0 +1,3 @@
+-- Индекс для подсчёта комментариев поста при заполнении и сверке счётчиков.
+-- Строится без блокировки записи, поэтому выполняется вне транзакции.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_comments_post_id ON comments(post_id);
@@ -0,0 +1,2 @@
+-- Процедура коммитит каждую пачку, поэтому вызывается одна, вне транзакции
+CALL backfill_post_counters(10000);
@@ -0,0 +1 @@
+DROP PROCEDURE IF EXISTS backfill_post_counters(INTEGER);
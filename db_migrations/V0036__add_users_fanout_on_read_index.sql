@@ -0,0 +1,3 @@
+-- Авторы, чьи посты читаются из posts при запросе домашней ленты.
+-- Строится без блокировки записи, поэтому выполняется вне транзакции.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_fanout_on_read ON users(id) WHERE fanout_on_read;
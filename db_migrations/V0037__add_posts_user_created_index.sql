@@ -0,0 +1,3 @@
+-- Последние посты автора для домашней ленты и её заполнения.
+-- Строится без блокировки записи, поэтому выполняется вне транзакции.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_posts_user_created ON posts(user_id, created_at DESC, id DESC);
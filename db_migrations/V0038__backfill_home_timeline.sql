@@ -0,0 +1,2 @@
+-- Процедура коммитит каждую пачку, поэтому вызывается одна, вне транзакции
+CALL backfill_home_timeline(1000);
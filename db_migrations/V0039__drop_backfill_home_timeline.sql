@@ -0,0 +1 @@
+DROP PROCEDURE IF EXISTS backfill_home_timeline(INTEGER);
@@ -0,0 +1,3 @@
+-- Подсчёт непрочитанных читается из индекса без обращения к таблице.
+-- Строится без блокировки записи, поэтому выполняется вне транзакции.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_chat_id_id_sender ON messages(chat_id, id) INCLUDE (sender_id);
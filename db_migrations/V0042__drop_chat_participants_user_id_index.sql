@@ -0,0 +1,3 @@
+-- Покрывается idx_chat_participants_user_last_message.
+-- Снимается без блокировки записи, поэтому выполняется вне транзакции.
+DROP INDEX CONCURRENTLY IF EXISTS idx_chat_participants_user_id;
@@ -0,0 +1,2 @@
+-- Процедура коммитит каждую пачку, поэтому вызывается одна, вне транзакции
+CALL copy_notifications_to_partitioned(10000);
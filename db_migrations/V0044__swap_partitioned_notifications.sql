@@ -0,0 +1,27 @@
+-- Перестановка таблиц после переноса V0043. EXCLUSIVE не даёт писать
+-- в notifications, но не мешает чтению; под ней заново переносятся только
+-- строки, изменённые после V0011, поэтому транзакция короткая.
+LOCK TABLE notifications IN EXCLUSIVE MODE;
+
+DELETE FROM notifications_partitioned p
+USING notifications_partition_changes c
+WHERE p.id = c.id;
+
+INSERT INTO notifications_partitioned (id, user_id, type, content, related_user_id, related_post_id, is_read, created_at, group_key, group_count, update_seq)
+SELECT id, user_id, type, content, related_user_id, related_post_id, is_read, COALESCE(created_at, CURRENT_TIMESTAMP), group_key, group_count, update_seq
+FROM notifications
+WHERE id IN (SELECT id FROM notifications_partition_changes);
+
+DROP TRIGGER notifications_track_changes ON notifications;
+DROP FUNCTION track_notification_changes();
+DROP TABLE notifications_partition_changes;
+DROP PROCEDURE copy_notifications_to_partitioned(INTEGER);
+
+-- Последовательность id переходит к новой таблице и не удаляется вместе со старой
+ALTER SEQUENCE notifications_id_seq OWNED BY NONE;
+ALTER TABLE notifications RENAME TO notifications_legacy;
+ALTER TABLE notifications_partitioned RENAME TO notifications;
+ALTER SEQUENCE notifications_id_seq OWNED BY notifications.id;
+
+DROP TABLE notifications_legacy;
+ALTER TABLE notifications RENAME CONSTRAINT notifications_partitioned_pkey TO notifications_pkey;
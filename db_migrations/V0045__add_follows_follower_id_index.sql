@@ -0,0 +1,3 @@
+-- Страница подписок пользователя по id подписки.
+-- Строится без блокировки записи, поэтому выполняется вне транзакции.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_follows_follower_id ON follows(follower_id, id DESC);
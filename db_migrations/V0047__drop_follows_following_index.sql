@@ -0,0 +1,3 @@
+-- Покрывается idx_follows_following_id.
+-- Снимается без блокировки записи, поэтому выполняется вне транзакции.
+DROP INDEX CONCURRENTLY IF EXISTS idx_follows_following;
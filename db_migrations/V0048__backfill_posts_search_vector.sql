@@ -0,0 +1,2 @@
+-- Процедура коммитит каждую пачку, поэтому вызывается одна, вне транзакции
+CALL backfill_posts_search_vector(10000);
@@ -0,0 +1 @@
+DROP PROCEDURE IF EXISTS backfill_posts_search_vector(INTEGER);
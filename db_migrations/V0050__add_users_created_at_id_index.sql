@@ -0,0 +1,3 @@
+-- Страница пользователей админки по (created_at, id).
+-- Строится без блокировки записи, поэтому выполняется вне транзакции.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_created_at_id ON users(created_at DESC, id DESC);
@@ -0,0 +1,3 @@
+-- Заблокированных немного: отдельный частичный индекс для модерации.
+-- Строится без блокировки записи, поэтому выполняется вне транзакции.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_banned_created ON users(created_at DESC, id DESC) WHERE is_banned;
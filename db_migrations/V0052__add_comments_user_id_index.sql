@@ -0,0 +1,3 @@
+-- Комментарии пользователя при каскадной блокировке.
+-- Строится без блокировки записи, поэтому выполняется вне транзакции.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_comments_user_id ON comments(user_id);
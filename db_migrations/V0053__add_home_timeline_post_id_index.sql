@@ -0,0 +1,3 @@
+-- Строки домашних лент с постами заблокированного пользователя.
+-- Строится без блокировки записи, поэтому выполняется вне транзакции.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_home_timeline_post_id ON home_timeline(post_id);
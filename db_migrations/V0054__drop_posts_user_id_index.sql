@@ -0,0 +1,3 @@
+-- Покрывается idx_posts_user_created.
+-- Снимается без блокировки записи, поэтому выполняется вне транзакции.
+DROP INDEX CONCURRENTLY IF EXISTS idx_posts_user_id;
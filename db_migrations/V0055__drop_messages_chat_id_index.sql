@@ -0,0 +1,3 @@
+-- Покрывается idx_messages_chat_id_id_sender.
+-- Снимается без блокировки записи, поэтому выполняется вне транзакции.
+DROP INDEX CONCURRENTLY IF EXISTS idx_messages_chat_id;
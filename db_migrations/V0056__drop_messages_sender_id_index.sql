@@ -0,0 +1,4 @@
+-- Ни один обработчик не ищет сообщения по отправителю без чата,
+-- а индекс обновляется на каждой отправке.
+-- Снимается без блокировки записи, поэтому выполняется вне транзакции.
+DROP INDEX CONCURRENTLY IF EXISTS idx_messages_sender_id;
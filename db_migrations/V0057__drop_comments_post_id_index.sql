@@ -0,0 +1,3 @@
+-- Покрывается idx_comments_post_id_id.
+-- Снимается без блокировки записи, поэтому выполняется вне транзакции.
+DROP INDEX CONCURRENTLY IF EXISTS idx_comments_post_id;
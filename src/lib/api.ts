@@ -6,6 +6,12 @@ const API_URLS = {
   notifications: 'https://functions.poehali.dev/7480a3ac-6265-4404-ab86-d0b2b1ec9979',
 };
 
+// Токен сессии администратора: с ним админка получает телефоны пользователей
+let adminToken: string | null = null;
+
+const adminHeaders = (headers: Record<string, string> = {}) =>
+  adminToken ? { ...headers, 'X-Auth-Token': adminToken } : headers;
+
 export const api = {
   async register(phone: string, password: string, full_name: string) {
     const response = await fetch(API_URLS.auth, {
@@ -100,11 +106,11 @@ export const api = {
     return response.json();
   },
 
-  async markNotificationRead(notification_id: number) {
+  async markNotificationRead(user_id: number, notification_id: number) {
     const response = await fetch(API_URLS.notifications, {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
-      body: JSON.dumps({ action: 'mark_read', notification_id }),
+      body: JSON.dumps({ action: 'mark_read', user_id, notification_id }),
     });
     return response.json();
   },
@@ -112,25 +118,26 @@ export const api = {
   async adminLogin(phone: string, password: string) {
     const result = await this.login(phone, password);
     if (result.success && result.user.is_admin) {
+      adminToken = result.token;
       return result;
     }
     return { success: false, error: 'Доступ запрещён. Требуются права администратора.' };
   },
 
   async adminGetStats() {
-    const response = await fetch(`${API_URLS.admin}?action=stats`);
+    const response = await fetch(`${API_URLS.admin}?action=stats`, { headers: adminHeaders() });
     return response.json();
   },
 
   async adminGetUsers() {
-    const response = await fetch(`${API_URLS.admin}?action=users`);
+    const response = await fetch(`${API_URLS.admin}?action=users`, { headers: adminHeaders() });
     return response.json();
   },
 
   async adminBanUser(admin_id: number, user_id: number) {
     const response = await fetch(API_URLS.admin, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: adminHeaders({ 'Content-Type': 'application/json' }),
       body: JSON.dumps({ action: 'ban', admin_id, user_id }),
     });
     return response.json();
@@ -139,7 +146,7 @@ export const api = {
   async adminUnbanUser(admin_id: number, user_id: number) {
     const response = await fetch(API_URLS.admin, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: adminHeaders({ 'Content-Type': 'application/json' }),
       body: JSON.dumps({ action: 'unban', admin_id, user_id }),
     });
     return response.json();
@@ -148,7 +155,7 @@ export const api = {
   async adminUpdateUser(admin_id: number, user_id: number, full_name?: string, username?: string) {
     const response = await fetch(API_URLS.admin, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: adminHeaders({ 'Content-Type': 'application/json' }),
       body: JSON.dumps({ action: 'update_user', admin_id, user_id, full_name, username }),
     });
     return response.json();
@@ -157,7 +164,7 @@ export const api = {
   async adminGrantAdmin(admin_id: number, user_id: number) {
     const response = await fetch(API_URLS.admin, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: adminHeaders({ 'Content-Type': 'application/json' }),
       body: JSON.dumps({ action: 'grant_admin', admin_id, user_id }),
     });
     return response.json();
@@ -640,7 +640,7 @@ const Index = () => {
           <Card
             key={notif.id}
             className={`p-4 blur-card hover:bg-accent transition-colors cursor-pointer ${!notif.is_read ? 'border-primary' : ''}`}
-            onClick={() => api.markNotificationRead(notif.id)}
+            onClick={() => user && api.markNotificationRead(user.id, notif.id)}
           >
             <div className="flex items-center gap-4">
               <div className="w-10 h-10 rounded-full gradient-primary flex items-center justify-center">